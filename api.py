@@ -0,0 +1,152 @@
+# JSON API helpers for ChordApp
+# - compact array-of-arrays encoding of token streams
+# - strong ETags and 304 Not Modified on revalidation, checked before the response body is built
+# - gzip/deflate compression negotiated from Accept-Encoding
+import hashlib
+import json
+import zlib
+from functools import wraps
+
+from flask import Response, request, session
+
+from tokenizer import CHORD, LINE_BREAK, LYRIC, SPACES
+
+# Token kinds in the compact encoding: [0, "G"] chord, [1, "Hello"] lyric, [2, 3] three spaces, [3] line break
+TOKEN_KINDS = {CHORD: 0, LYRIC: 1, SPACES: 2, LINE_BREAK: 3}
+
+# Clients may keep responses, but must revalidate them (cheaply, with If-None-Match) before reuse
+CACHE_CONTROL = "private, no-cache"
+
+
+def api_login_required(f):
+    """Decorator to require login for API routes.
+
+    Like helpers.login_required, but answers 401 with a JSON error instead of redirecting to the login page.
+
+    Args:
+        f: The function to decorate.
+
+    Returns:
+        callable: The decorated function.
+    """
+
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if session.get("user_id") is None:
+            return api_error(401, "login required")
+        return f(*args, **kwargs)
+
+    return decorated_function
+
+
+def api_error(status, message):
+    """Builds a JSON error response.
+
+    Args:
+        status: The HTTP status code.
+        message: What went wrong.
+
+    Returns:
+        Response: {"error": message} with the given status.
+    """
+    return Response(json.dumps({"error": message}), status=status, mimetype="application/json")
+
+
+def compact_tokens(tokens):
+    """Encodes a token stream as a list of short arrays.
+
+    Args:
+        tokens: Tokens as produced by the tokenizer.
+
+    Returns:
+        list[list]: [kind, value] per token (see TOKEN_KINDS), with space runs as their length and line
+            breaks as just [3].
+    """
+    encoded = []
+    append = encoded.append
+    for token in tokens:
+        kind = TOKEN_KINDS[token.type]
+        if kind == 3:
+            append([3])
+        elif kind == 2:
+            append([2, len(token.value)])
+        else:
+            append([kind, token.value])
+    return encoded
+
+
+def negotiate_encoding():
+    """Picks the response compression from the request's Accept-Encoding header.
+
+    Returns:
+        str | None: "gzip" or "deflate", or None to send the body as is.
+    """
+    return request.accept_encodings.best_match(("gzip", "deflate"))
+
+
+def make_etag(key, encoding):
+    """Builds the strong ETag of one representation of a resource.
+
+    Compressed and uncompressed bodies differ byte for byte, so each encoding gets its own tag.
+
+    Args:
+        key: What identifies the resource's current state, e.g. a content hash.
+        encoding: The negotiated compression, or None.
+
+    Returns:
+        str: The ETag value, unquoted.
+    """
+    return f"{key}-{encoding}" if encoding else key
+
+
+def not_modified(etag):
+    """Checks the request's If-None-Match against an ETag.
+
+    Args:
+        etag: The ETag of the representation the request would get.
+
+    Returns:
+        Response | None: A 304 Not Modified response if the client already has it, None otherwise.
+    """
+    if not request.if_none_match.contains(etag):
+        return None
+    response = Response(status=304)
+    _set_cache_headers(response, etag)
+    return response
+
+
+def json_response(payload, etag_key=None):
+    """Builds a compressed, revalidatable JSON response.
+
+    Args:
+        payload: The data to send.
+        etag_key: What identifies the data's state, if the caller knows it up front (and has already
+            answered If-None-Match with not_modified). Otherwise the ETag is a hash of the body.
+
+    Returns:
+        Response: The JSON body, compressed as the client accepts, or 304 if the client's copy is current.
+    """
+    body = json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    encoding = negotiate_encoding()
+    etag = make_etag(etag_key or hashlib.blake2b(body, digest_size=16).hexdigest(), encoding)
+    if etag_key is None:
+        cached = not_modified(etag)
+        if cached is not None:
+            return cached
+
+    if encoding:
+        # gzip is deflate with a gzip header and trailer (wbits 31), HTTP's deflate is the zlib format
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 31 if encoding == "gzip" else 15)
+        body = compressor.compress(body) + compressor.flush()
+
+    response = Response(body, mimetype="application/json")
+    if encoding:
+        response.headers["Content-Encoding"] = encoding
+    _set_cache_headers(response, etag)
+    return response
+
+
+def _set_cache_headers(response, etag):
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = CACHE_CONTROL
+    response.vary.add("Accept-Encoding")
@@ -2,12 +2,28 @@
 # - SQLite database
 # - routes: /, /login, /register, /logout
 # - uses Jinja templates
-from cs50 import SQL
-from flask import Flask, abort, render_template, request, redirect, url_for, session, g, flash
-from werkzeug.security import generate_password_hash, check_password_hash
+import atexit
+import click
+import hmac
+from flask import Flask, Response, abort, render_template, request, redirect, url_for, session, g, flash
+from werkzeug.exceptions import HTTPException, ServiceUnavailable
 import os
-
-from helpers import login_required, parse_content
+import sqlite3
+
+from api import api_error, api_login_required, compact_tokens, json_response, make_etag, negotiate_encoding, not_modified
+from cache import ParsedSongCache, ReferenceCache
+from chord_index import MATCHES as CHORD_MATCHES, SUBSET, ChordIndex, chart_chords
+from database import Database, DatabaseBusy
+from exporter import FORMATS as EXPORT_FORMATS, stream_export
+from helpers import content_hash, decode_cursor, keyset_page, login_required, parse_content, search_expression
+from history import detach_history, load_revision, record_revision, storage_report
+from importer import Importer
+from metrics import instrument, registry
+from passwords import HasherBusy, PasswordHasher
+from schema import MIGRATIONS, migrate, pending_migrations, rebuild_search_index, reconcile_rating_aggregates, schema_version
+from tokenizer import MAX_CONTENT_LENGTH, TOKENS_FORMAT, deserialize_tokens, serialize_tokens, stored_chords
+from transpose import SPELLINGS, TRANSPOSE_VERSION, transpose_tokens
+from write_behind import UPSERT_RATING, RatingWriter
 
 # Input validation constants
 MAX_USERNAME_LENGTH = 50
@@ -16,15 +32,169 @@ MIN_PASSWORD_LENGTH = 3
 MAX_TITLE_LENGTH = 200
 MAX_ARTIST_NAME_LENGTH = 100
 MAX_GENRE_NAME_LENGTH = 50
-MAX_CONTENT_LENGTH = 10000  # Song content
 MAX_SEARCH_QUERY_LENGTH = 100
 
+# Rows per page of the songs list and search results (?limit= can ask for up to MAX_PAGE_SIZE)
+PAGE_SIZE = int(os.getenv("PAGE_SIZE", 50))
+MAX_PAGE_SIZE = 200
+
+# Statements taking at least this long are logged with their parameters
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", 100))
+
+# Write-behind mode for ratings: queue them and write them in batches from a background thread
+RATING_WRITE_BEHIND = os.getenv("RATING_WRITE_BEHIND", "false").lower() == "true"
+RATING_FLUSH_SIZE = int(os.getenv("RATING_FLUSH_SIZE", 500))
+RATING_FLUSH_INTERVAL = float(os.getenv("RATING_FLUSH_INTERVAL", 0.5))  # Seconds
+
+# Memory budget for parsed charts kept between requests
+PARSED_CACHE_MAX_BYTES = int(os.getenv("PARSED_CACHE_MAX_BYTES", 32 * 1024 * 1024))
+
+# Seconds between checks for artists and genres added by other processes
+REFERENCE_REFRESH_SECONDS = float(os.getenv("REFERENCE_REFRESH_SECONDS", 30))
+
+# Versions returned by /api/chord-search (?limit= can ask for up to MAX_CHORD_SEARCH_RESULTS), and most chords it takes
+CHORD_SEARCH_RESULTS = 20
+MAX_CHORD_SEARCH_RESULTS = 200
+MAX_CHORD_SEARCH_CHORDS = 50
+
+# Which tokenizer and transposition rules a chart is rendered with. Part of the API's ETags: a new version of
+# either can change the chart sent for the same content, and clients must not be told their copy is current.
+RENDER_VERSION = f"{TOKENS_FORMAT}.{TRANSPOSE_VERSION}"
+
+# Suggestions returned by /autocomplete (?limit= can ask for up to MAX_AUTOCOMPLETE_RESULTS)
+AUTOCOMPLETE_RESULTS = 10
+MAX_AUTOCOMPLETE_RESULTS = 50
+
+# Password hashing: werkzeug method and cost, worker processes, and calls allowed to wait before new ones are turned away
+PASSWORD_HASH_METHOD = os.getenv("PASSWORD_HASH_METHOD", "scrypt")
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", max(1, (os.cpu_count() or 2) // 2)))
+PASSWORD_HASH_MAX_PENDING = int(os.getenv("PASSWORD_HASH_MAX_PENDING", 4 * max(PASSWORD_HASH_WORKERS, 1)))
+PASSWORD_HASH_TIMEOUT = float(os.getenv("PASSWORD_HASH_TIMEOUT", 5))  # Seconds
+# Seconds a client turned away by a saturated hashing pool is asked to wait before trying again
+PASSWORD_RETRY_AFTER = 2
+# Same, for a write that couldn't get the database's write lock
+WRITE_RETRY_AFTER = 1
+
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'dev-secret-key'
 
-# db = SQL("sqlite:///chordapp.db")
 DB_PATH = os.getenv("DB_PATH", "chordapp.db")
-db = SQL(f"sqlite:///{DB_PATH}")
+# Milliseconds a request waits for another connection's write lock before giving up
+DB_BUSY_TIMEOUT_MS = int(os.getenv("DB_BUSY_TIMEOUT_MS", 5000))
+DB_MMAP_SIZE = int(os.getenv("DB_MMAP_SIZE", 256 * 1024 * 1024))
+# Prepared statements kept per connection
+DB_STATEMENT_CACHE = int(os.getenv("DB_STATEMENT_CACHE", 256))
+# Bearer token an operator sends to download /export; the route is off unless it's set
+EXPORT_TOKEN = os.getenv("EXPORT_TOKEN", "")
+
+# Idle connections kept open between requests; a request thread takes one and hands it back when the request ends
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 8))
+# Apply pending schema migrations when the app starts; with 0, run them with `flask --app app migrate`
+MIGRATE_ON_STARTUP = os.getenv("MIGRATE_ON_STARTUP", "1") != "0"
+
+# Hashing workers (see passwords.py) are fresh interpreters that re-import the script that started the server,
+# as __mp_main__. Under `python app.py` that's this module: there it's only loaded for passwords.py's functions,
+# so it skips the startup work that touches the database. Everything else below only runs on first use.
+HASHING_WORKER = __name__ == "__mp_main__"
+
+if MIGRATE_ON_STARTUP and not HASHING_WORKER:
+    migrate(DB_PATH, log=lambda number, description, seconds: app.logger.warning("Applied migration %d (%s) in %.1fs", number, description, seconds))
+db = Database(DB_PATH, busy_timeout=DB_BUSY_TIMEOUT_MS, mmap_size=DB_MMAP_SIZE, cached_statements=DB_STATEMENT_CACHE, pool_size=DB_POOL_SIZE)
+if not MIGRATE_ON_STARTUP and not HASHING_WORKER:
+    pending = pending_migrations(db.connection())
+    if pending:
+        app.logger.warning("Schema migrations pending (%d), run `flask --app app migrate`", len(pending))
+
+@app.teardown_appcontext
+def release_connection(exception):
+    """Hands the request thread's database connection back to the pool once the request is done.
+
+    The development server runs every request on a new thread, so a connection kept per thread would be
+    left open by each of them.
+    """
+    db.release()
+
+parsed_cache = ParsedSongCache(PARSED_CACHE_MAX_BYTES)
+reference_cache = ReferenceCache(db, refresh_interval=REFERENCE_REFRESH_SECONDS)
+chord_index = ChordIndex(db)
+
+instrument(app, db, SLOW_QUERY_MS)
+registry.callback("chordapp_parsed_cache_hits_total", "Version views served from the parsed chart cache.", "counter", lambda: parsed_cache.hits)
+registry.callback("chordapp_parsed_cache_misses_total", "Version views that had to load or parse the chart.", "counter", lambda: parsed_cache.misses)
+registry.callback("chordapp_parsed_cache_evictions_total", "Parsed charts evicted to stay within the memory budget.", "counter", lambda: parsed_cache.evictions)
+registry.callback("chordapp_parsed_cache_bytes", "Estimated memory held by the parsed chart cache.", "gauge", lambda: parsed_cache.stats()["bytes"])
+
+password_hasher = PasswordHasher(PASSWORD_HASH_METHOD, workers=PASSWORD_HASH_WORKERS, max_pending=PASSWORD_HASH_MAX_PENDING, timeout=PASSWORD_HASH_TIMEOUT)
+atexit.register(password_hasher.close)
+password_hash_latency = registry.histogram("chordapp_password_hash_seconds", "Time spent hashing or verifying a password.", ["operation"])
+password_queue_wait = registry.histogram("chordapp_password_queue_wait_seconds", "Time a password hash or check waited for a worker.", ["operation"])
+
+def observe_password_timing(operation, queue_seconds, hash_seconds):
+    password_queue_wait.observe(queue_seconds, operation=operation)
+    password_hash_latency.observe(hash_seconds, operation=operation)
+
+password_hasher.timing_hook = observe_password_timing
+registry.callback("chordapp_password_pending", "Password hashes and checks queued or running.", "gauge", password_hasher.pending)
+registry.callback("chordapp_password_rejected_total", "Password hashes and checks turned away because the pool was saturated.", "counter", lambda: password_hasher.rejected)
+
+rating_writer = None
+if RATING_WRITE_BEHIND:
+    rating_writer = RatingWriter(db, batch_size=RATING_FLUSH_SIZE, flush_interval=RATING_FLUSH_INTERVAL)
+    # Write out every queued rating before the process exits
+    atexit.register(rating_writer.close)
+    registry.callback("chordapp_ratings_pending", "Ratings queued and not yet written.", "gauge", rating_writer.pending)
+    registry.callback("chordapp_ratings_flushed_total", "Queued ratings written to the database.", "counter", lambda: rating_writer.flushed)
+    registry.callback("chordapp_ratings_dropped_total", "Queued ratings rejected by the database.", "counter", lambda: rating_writer.dropped)
+
+def read_limit(default, maximum):
+    """Reads ?limit=, the number of results a listing returns.
+
+    Every route taking a limit answers one it can't honor with 400, rather than quietly returning some
+    other number of results than the client asked for.
+
+    Args:
+        default: The limit when the query string gives none.
+        maximum: The largest limit allowed.
+
+    Returns:
+        int: The limit, 1 to maximum.
+
+    Raises:
+        400: If the limit isn't a whole number from 1 to maximum.
+    """
+    limit = request.args.get("limit")
+    if limit is None:
+        return min(default, maximum)
+    # Not request.args.get(type=int), which falls back to the default on "abc"
+    if not (limit.isascii() and limit.isdigit()) or not 1 <= int(limit) <= maximum:
+        abort(400, f"limit must be a whole number from 1 to {maximum}")
+    return int(limit)
+
+def read_page_args(key_length):
+    """Reads the page size and cursor of a paginated listing from the query string.
+
+    ?after=<cursor> asks for the page following a row, ?before=<cursor> for the page preceding it.
+
+    Args:
+        key_length: Number of values in the listing's sort key.
+
+    Returns:
+        tuple[int, list | None, bool]: The page size, the sort key to continue from (None for the first page),
+            and whether to go backwards from it.
+
+    Raises:
+        400: If the cursor or the page size is malformed.
+    """
+    page_size = read_limit(PAGE_SIZE, MAX_PAGE_SIZE)
+    before = request.args.get("before")
+    cursor = before or request.args.get("after")
+    if not cursor:
+        return page_size, None, False
+
+    key = decode_cursor(cursor)
+    if key is None or len(key) != key_length:
+        abort(400)
+    return page_size, key, bool(before)
 
 @app.route("/")
 @login_required
@@ -65,9 +235,20 @@ def login():
         rows = db.execute("SELECT id, username, password_hash FROM users WHERE username = ?", username)
 
         # Ensure username exists and password is correct
-        if len(rows) != 1 or not check_password_hash(rows[0]["password_hash"], password):
+        try:
+            valid = len(rows) == 1 and password_hasher.verify(rows[0]["password_hash"], password)
+        except HasherBusy:
+            return render_template("login.html", error="Too many logins right now, please try again in a moment"), 503, {"Retry-After": str(PASSWORD_RETRY_AFTER)}
+        if not valid:
             return render_template("login.html", error="Invalid username and/or password")
 
+        # Hashes made with older parameters are upgraded while the password is at hand
+        if password_hasher.needs_rehash(rows[0]["password_hash"]):
+            try:
+                db.execute("UPDATE users SET password_hash = ? WHERE id = ?", password_hasher.hash(password), rows[0]["id"])
+            except HasherBusy:
+                pass  # Upgraded on a later login
+
         # Remember which user has logged in
         session["user_id"] = rows[0]["id"]
 
@@ -105,15 +286,18 @@ def register():
         if len(password) > MAX_PASSWORD_LENGTH:
             return render_template("register.html", error=f"Password must be {MAX_PASSWORD_LENGTH} characters or less")
         
-        # Hash the password
-        hashed_password = generate_password_hash(password)
-
         confirmation = request.form.get("confirmation")
         if not confirmation:
             return render_template("register.html", error="Password confirmation is required")
         if password != confirmation:
             return render_template("register.html", error="Password and confirmation do not match")
 
+        # Hash the password, once the form is known to be valid
+        try:
+            hashed_password = password_hasher.hash(password)
+        except HasherBusy:
+            return render_template("register.html", error="Too many sign-ups right now, please try again in a moment"), 503, {"Retry-After": str(PASSWORD_RETRY_AFTER)}
+
         try:
             db.execute("INSERT INTO users (username, password_hash) VALUES (?, ?)", username, hashed_password)
         except ValueError:
@@ -133,18 +317,37 @@ def logout():
     session.clear()
     return redirect(url_for("login"))
 
+def read_songs_page():
+    """Reads the page of the song list asked for in the query string, ordered by title.
+
+    Returns:
+        tuple[list[dict], str | None, str | None]: The songs with their artist and genre, and the cursors
+            of the next and previous pages.
+    """
+    page_size, key, backwards = read_page_args(2)
+    query = "SELECT songs.id, songs.title, artists.name AS artist, genres.name AS genre FROM songs JOIN artists ON songs.artist_id = artists.id JOIN genres ON songs.genre_id = genres.id"
+    if key is None:
+        rows = db.execute(f"{query} ORDER BY songs.title, songs.id LIMIT ?", page_size + 1)
+    elif backwards:
+        rows = db.execute(f"{query} WHERE (songs.title, songs.id) < (?, ?) ORDER BY songs.title DESC, songs.id DESC LIMIT ?", *key, page_size + 1)
+    else:
+        rows = db.execute(f"{query} WHERE (songs.title, songs.id) > (?, ?) ORDER BY songs.title, songs.id LIMIT ?", *key, page_size + 1)
+
+    return keyset_page(rows, page_size, backwards, key is not None, lambda song: (song["title"], song["id"]))
+
 @app.route("/songs")
 @login_required
 def songs():
-    """Lists all songs from the database.
+    """Lists the songs from the database, one page at a time.
 
-    Queries songs with artist and genre details, ordered by title.
+    Queries songs with artist and genre details, ordered by title. Pages are read with keyset pagination
+    on (title, id), so every page costs the same no matter how deep the user goes.
 
     Returns:
-        Response: Rendered songs template with song list.
+        Response: Rendered songs template with one page of the song list and the cursors around it.
     """
-    songs = db.execute("SELECT songs.id, songs.title, artists.name AS artist, genres.name AS genre FROM songs JOIN artists ON songs.artist_id = artists.id JOIN genres ON songs.genre_id = genres.id ORDER BY songs.title")
-    return render_template("songs.html", songs=songs)
+    songs, next_cursor, prev_cursor = read_songs_page()
+    return render_template("songs.html", songs=songs, next_cursor=next_cursor, prev_cursor=prev_cursor)
 
 @app.route("/songs/<int:song_id>")
 @login_required
@@ -157,15 +360,71 @@ def song(song_id):
     Returns:
         Response: Rendered song template with versions and song info.
     """
-    song = db.execute("SELECT versions.id, versions.version_number, versions.creator_id, users.username, versions.created_at, ROUND(AVG(ratings.rating), 1) AS avg FROM versions JOIN users ON versions.creator_id = users.id LEFT JOIN ratings ON ratings.version_id = versions.id WHERE versions.song_id = ? GROUP BY versions.id ORDER BY avg DESC", song_id)
+    song = db.execute("SELECT versions.id, versions.version_number, versions.creator_id, users.username, versions.created_at, ROUND(versions.rating_avg, 1) AS avg FROM versions JOIN users ON versions.creator_id = users.id WHERE versions.song_id = ? ORDER BY versions.rating_avg DESC", song_id)
     song_info = db.execute("SELECT songs.id, songs.title, artists.name AS artist FROM songs JOIN artists ON songs.artist_id = artists.id WHERE songs.id = ?", song_id)
     return render_template("song.html", versions=song, song_info=song_info[0], user=session["user_id"])
 
+def read_transpose_args():
+    """Reads the transposition asked for in the query string.
+
+    ?transpose=n moves every chord n semitones up (or down, if negative). Black keys are named after the
+    key the chart lands in, unless ?spelling=sharp or ?spelling=flat says otherwise.
+
+    Returns:
+        tuple[int, str | None]: The offset in semitones, 0 to 11, and the spelling (None to follow the key).
+    """
+    offset = request.args.get("transpose", 0, type=int) % 12
+    spelling = request.args.get("spelling")
+    return offset, spelling if spelling in SPELLINGS else None
+
+def load_parsed_song(version, offset=0, spelling=None):
+    """Returns a version's parsed chart, from the cache, its stored tokens or its content, in that order.
+
+    Args:
+        version: The version's row, with its id, content, tokens and tokens_format.
+        offset: Semitones to transpose the chart by, 0 to 11.
+        spelling: How to name black keys when transposing, or None to follow the key.
+
+    Returns:
+        tuple[list[Token], str]: The chart's tokens, and the hash of the content they come from.
+    """
+    # Content only changes through save_version, so reuse the parsed chart while the content is unchanged
+    content = version["content"]
+    digest = content_hash(content)
+    if offset or spelling:
+        # Each key is cached on its own, so popular transpositions are served without redoing them
+        variant = (offset, spelling)
+        parsed_song = parsed_cache.get(version["id"], digest, variant)
+        if parsed_song is None:
+            original, _ = load_parsed_song(version)
+            parsed_song = transpose_tokens(original, offset, spelling)
+            parsed_cache.put(version["id"], digest, parsed_song, variant)
+        return parsed_song, digest
+
+    parsed_song = parsed_cache.get(version["id"], digest)
+    if parsed_song is None:
+        if version["tokens_format"] == TOKENS_FORMAT:
+            parsed_song = deserialize_tokens(version["tokens"])
+        else:
+            # Saved before tokens were stored, or by an older tokenizer: tokenize once and keep the result
+            parsed_song = parse_content(content)
+            try:
+                # Unless the content was edited since it was read
+                db.execute("UPDATE versions SET tokens = ?, tokens_format = ? WHERE id = ? AND content = ?", serialize_tokens(parsed_song), TOKENS_FORMAT, version["id"], content)
+            except sqlite3.OperationalError as e:
+                # Best effort: with the write lock held elsewhere, the page is still served from the parsed chart,
+                # and the next view (or `flask backfill-tokens`) stores it
+                app.logger.info("Tokens of version %d not stored: %s", version["id"], e)
+        parsed_cache.put(version["id"], digest, parsed_song)
+    return parsed_song, digest
+
 @app.route("/songs/<int:song_id>/versions/<int:version_id>")
 @login_required
 def version(song_id, version_id):
     """Displays a specific version of a song, including parsed content and average rating.
 
+    The chart can be transposed with ?transpose=n and ?spelling=sharp|flat (see read_transpose_args).
+
     Args:
         song_id: The ID of the song.
         version_id: The ID of the version to display.
@@ -176,19 +435,20 @@ def version(song_id, version_id):
     Raises:
         404: If the version does not exist.
     """
-    version = db.execute("SELECT users.username, versions.id, versions.version_number, versions.created_at, versions.creator_id, versions.content FROM versions JOIN users ON versions.creator_id = users.id WHERE versions.id = ?", version_id)
+    version = db.execute("SELECT users.username, versions.id, versions.version_number, versions.created_at, versions.creator_id, versions.content, versions.tokens, versions.tokens_format, ROUND(versions.rating_avg, 1) AS avg FROM versions JOIN users ON versions.creator_id = users.id WHERE versions.id = ?", version_id)
 
     song_info = db.execute("SELECT songs.id, songs.title, artists.name AS artist FROM songs JOIN artists ON songs.artist_id = artists.id WHERE songs.id = ?", song_id)
 
-    avg_rating = db.execute("SELECT ROUND(AVG(rating), 1) AS avg FROM ratings WHERE version_id = ?", version_id)[0]["avg"]
-
     if not version:
         abort(404)
-        
-    parsed_song = parse_content(version[0]["content"])
+    avg_rating = version[0]["avg"]
 
+    offset, spelling = read_transpose_args()
+    parsed_song, _ = load_parsed_song(version[0], offset, spelling)
 
-    return render_template("version.html", version=version[0], song_info=song_info[0], avg_rating=avg_rating, parsed_song=parsed_song, user=session["user_id"])
+    # Shown as the shortest way there: +5 rather than -7, -1 rather than +11
+    transpose = offset - 12 if offset > 6 else offset
+    return render_template("version.html", version=version[0], song_info=song_info[0], avg_rating=avg_rating, parsed_song=parsed_song, user=session["user_id"], transpose=transpose, spelling=spelling)
 
 @app.route("/songs/<int:song_id>/workstation")
 @login_required
@@ -247,14 +507,36 @@ def save_version(song_id):
         flash(f"Content must be {MAX_CONTENT_LENGTH} characters or less")
         return render_template("workstation.html", song_info=song_info[0], content=content)
 
-    version_number = request.form.get("version_number", type=int)
-    if version_number:
-        db.execute("UPDATE versions SET content = ? WHERE version_number = ? AND song_id = ? AND creator_id = ?", content, version_number, song_id, session["user_id"])
-    else: 
-        version_number = db.execute("SELECT COALESCE(MAX(version_number), 0) + 1 AS next_version FROM versions WHERE song_id = ?", song_id)[0]["next_version"]
-        db.execute("INSERT INTO versions (song_id, version_number, creator_id, content) VALUES (?, ?, ?, ?)", song_id, version_number, session["user_id"], content)
+    # Store the tokenized chart along with the content, so viewing the version doesn't need to parse it
+    parsed_song = parse_content(content)
+    tokens = serialize_tokens(parsed_song)
 
-    version_id = db.execute("SELECT id FROM versions WHERE song_id = ? AND version_number = ? AND creator_id = ?", song_id, version_number, session["user_id"])[0]["id"]
+    version_number = request.form.get("version_number", type=int)
+    user_id = session["user_id"]
+
+    def save(connection):
+        # The new content, its chord set and its revision in the history are saved together. The version
+        # number is picked inside the INSERT, under the write lock, so concurrent saves can't pick the same one.
+        chord_set_id = chord_index.set_id(connection, chart_chords(parsed_song))
+        if version_number:
+            version = connection.execute("SELECT id, content FROM versions WHERE version_number = ? AND song_id = ? AND creator_id = ?", (version_number, song_id, user_id)).fetchone()
+            if version is None:
+                abort(404)
+            version_id, previous = version
+            connection.execute("UPDATE versions SET content = ?, tokens = ?, tokens_format = ?, chord_set_id = ? WHERE id = ?", (content, tokens, TOKENS_FORMAT, chord_set_id, version_id))
+        else:
+            version_id = connection.execute("""
+                INSERT INTO versions (song_id, version_number, creator_id, content, tokens, tokens_format, chord_set_id)
+                SELECT ?, COALESCE(MAX(version_number), 0) + 1, ?, ?, ?, ?, ? FROM versions WHERE song_id = ?
+                RETURNING id
+            """, (song_id, user_id, content, tokens, TOKENS_FORMAT, chord_set_id, song_id)).fetchone()[0]
+            previous = None
+        record_revision(connection, version_id, content, user_id, previous)
+        return version_id
+
+    version_id = db.run_transaction(save)
+    chord_index.committed()
+    parsed_cache.invalidate(version_id)
 
     return redirect(url_for("version", song_id=song_id, version_id=version_id))
 
@@ -273,19 +555,111 @@ def delete_version(song_id, version_id):
     Raises:
         404: If the version does not exist or is not owned by the user.
     """
-    version = db.execute("SELECT id FROM versions WHERE id = ? AND song_id = ? AND creator_id = ?", version_id, song_id, session["user_id"])
+    def delete(connection):
+        if connection.execute("SELECT 1 FROM versions WHERE id = ? AND song_id = ? AND creator_id = ?", (version_id, song_id, session["user_id"])).fetchone() is None:
+            abort(404)
+        # Other versions' revisions may be stored as deltas against this one's. Its chord set goes with the
+        # row; the set itself stays, other versions may use it.
+        detach_history(connection, version_id)
+        connection.execute("DELETE FROM ratings WHERE version_id = ?", (version_id,))
+        connection.execute("DELETE FROM versions WHERE id = ?", (version_id,))
+
+    db.run_transaction(delete)
+    parsed_cache.invalidate(version_id)
+    return redirect(url_for("song", song_id=song_id))
+
+@app.route("/songs/<int:song_id>/versions/<int:version_id>/history")
+@login_required
+def version_history(song_id, version_id):
+    """Lists the saved revisions of a version, newest first.
+
+    Args:
+        song_id: The ID of the song.
+        version_id: The ID of the version.
+
+    Returns:
+        Response: Rendered history template with every revision's author, date and size.
+
+    Raises:
+        404: If the version does not exist.
+    """
+    version = db.execute("SELECT versions.id, versions.version_number, versions.creator_id, songs.id AS song_id, songs.title, artists.name AS artist FROM versions JOIN songs ON versions.song_id = songs.id JOIN artists ON songs.artist_id = artists.id WHERE versions.id = ? AND versions.song_id = ?", version_id, song_id)
     if not version:
         abort(404)
+    revisions = db.execute("SELECT revisions.revision_number, users.username, revisions.created_at, revisions.size, length(revisions.data) AS stored, revisions.parent_id IS NULL AS snapshot FROM revisions JOIN users ON revisions.author_id = users.id WHERE revisions.version_id = ? ORDER BY revisions.revision_number DESC", version_id)
+    return render_template("history.html", version=version[0], revisions=revisions)
 
-    db.execute("DELETE FROM versions WHERE id = ?", version_id)
-    return redirect(url_for("song", song_id=song_id))
+@app.route("/songs/<int:song_id>/versions/<int:version_id>/history/<int:revision_number>")
+@login_required
+def revision(song_id, version_id, revision_number):
+    """Displays a past revision of a version.
+
+    Args:
+        song_id: The ID of the song.
+        version_id: The ID of the version.
+        revision_number: Which revision, 1 being the first one saved.
+
+    Returns:
+        Response: Rendered revision template with the chart as it was then.
+
+    Raises:
+        404: If the revision does not exist.
+    """
+    # One read transaction: a version deleted (or a history detached) between the lookups and the walk
+    # down the revision's deltas would leave a chain with missing links
+    with db.read_transaction() as connection:
+        version = db.execute("SELECT versions.id, versions.version_number, versions.creator_id, versions.content, songs.id AS song_id, songs.title, artists.name AS artist FROM versions JOIN songs ON versions.song_id = songs.id JOIN artists ON songs.artist_id = artists.id WHERE versions.id = ? AND versions.song_id = ?", version_id, song_id)
+        found = db.execute("SELECT revisions.id, revisions.revision_number, users.username, revisions.created_at FROM revisions JOIN users ON revisions.author_id = users.id WHERE revisions.version_id = ? AND revisions.revision_number = ?", version_id, revision_number)
+        if not version or not found:
+            abort(404)
+        content = load_revision(connection, found[0]["id"])
+
+    return render_template("revision.html", version=version[0], revision=found[0], parsed_song=parse_content(content), is_current=content == version[0]["content"], user=session["user_id"])
+
+@app.route("/songs/<int:song_id>/versions/<int:version_id>/history/<int:revision_number>/restore", methods=["POST"])
+@login_required
+def restore_revision(song_id, version_id, revision_number):
+    """Makes a past revision the current content of a version, if owned by the user.
+
+    The restore is saved as a new revision, so the history keeps everything that came after it.
+
+    Args:
+        song_id: The ID of the song.
+        version_id: The ID of the version.
+        revision_number: The revision to bring back.
+
+    Returns:
+        Response: Redirect to the version view.
+
+    Raises:
+        404: If the revision does not exist or the version is not owned by the user.
+    """
+    def restore(connection):
+        version = connection.execute("SELECT content FROM versions WHERE id = ? AND song_id = ? AND creator_id = ?", (version_id, song_id, session["user_id"])).fetchone()
+        found = connection.execute("SELECT id FROM revisions WHERE version_id = ? AND revision_number = ?", (version_id, revision_number)).fetchone()
+        if version is None or found is None:
+            abort(404)
+
+        content = load_revision(connection, found[0])
+        parsed_song = parse_content(content)
+        connection.execute(
+            "UPDATE versions SET content = ?, tokens = ?, tokens_format = ?, chord_set_id = ? WHERE id = ?",
+            (content, serialize_tokens(parsed_song), TOKENS_FORMAT, chord_index.set_id(connection, chart_chords(parsed_song)), version_id),
+        )
+        record_revision(connection, version_id, content, session["user_id"], version[0])
+
+    db.run_transaction(restore)
+    chord_index.committed()
+    parsed_cache.invalidate(version_id)
+    flash(f"Revision {revision_number} restored.")
+    return redirect(url_for("version", song_id=song_id, version_id=version_id))
 
 @app.route("/songs/add_song", methods=["GET", "POST"])
 @login_required
 def add_song():
     """Handles adding a new song.
 
-    On GET, renders the add song form with artist/genre suggestions. On POST, creates or retrieves artist/genre and adds the song if unique.
+    On GET, renders the add song form. On POST, creates or retrieves artist/genre and adds the song if unique.
 
     Returns:
         Response: Rendered template or redirect to the song page with flash message.
@@ -297,61 +671,89 @@ def add_song():
 
         if not title or not artist_name or not genre_name:
             flash("All fields are required")
-            artists = db.execute("SELECT name FROM artists ORDER BY name")
-            genres = db.execute("SELECT name FROM genres ORDER BY name")
-            return render_template("add_song.html", artists=[a["name"] for a in artists], genres=[g["name"] for g in genres])
+            return render_template("add_song.html")
         
         if len(title) > MAX_TITLE_LENGTH:
             flash(f"Title must be {MAX_TITLE_LENGTH} characters or less")
-            artists = db.execute("SELECT name FROM artists ORDER BY name")
-            genres = db.execute("SELECT name FROM genres ORDER BY name")
-            return render_template("add_song.html", artists=[a["name"] for a in artists], genres=[g["name"] for g in genres])
+            return render_template("add_song.html")
         
         if len(artist_name) > MAX_ARTIST_NAME_LENGTH:
             flash(f"Artist name must be {MAX_ARTIST_NAME_LENGTH} characters or less")
-            artists = db.execute("SELECT name FROM artists ORDER BY name")
-            genres = db.execute("SELECT name FROM genres ORDER BY name")
-            return render_template("add_song.html", artists=[a["name"] for a in artists], genres=[g["name"] for g in genres])
+            return render_template("add_song.html")
         
         if len(genre_name) > MAX_GENRE_NAME_LENGTH:
             flash(f"Genre name must be {MAX_GENRE_NAME_LENGTH} characters or less")
-            artists = db.execute("SELECT name FROM artists ORDER BY name")
-            genres = db.execute("SELECT name FROM genres ORDER BY name")
-            return render_template("add_song.html", artists=[a["name"] for a in artists], genres=[g["name"] for g in genres])
-
-        # Get or create artist
-        artist = db.execute("SELECT id FROM artists WHERE name = ?", artist_name)
-        if artist:
-            artist_id = artist[0]["id"]
-        else:
-            artist_id = db.execute("INSERT INTO artists (name) VALUES (?)", artist_name)
-        
-        # Get or create genre
-        genre = db.execute("SELECT id FROM genres WHERE name = ?", genre_name)
-        if genre:
-            genre_id = genre[0]["id"]
-        else:
-            genre_id = db.execute("INSERT INTO genres (name) VALUES (?)", genre_name)
+            return render_template("add_song.html")
+
+        # Artist, genre and song are looked up or created in one transaction; each INSERT only runs if the
+        # row doesn't exist yet, and returns the new id so nothing needs to be read back
+        def create(connection):
+            added = []  # (table, name, id) of the artist and genre rows this transaction inserted
+            artist_id = reference_cache.get_id("artists", artist_name)
+            if artist_id is None:
+                # artists.name has no UNIQUE constraint, so the existence check is part of the INSERT
+                created = connection.execute("INSERT INTO artists (name) SELECT ? WHERE NOT EXISTS (SELECT 1 FROM artists WHERE name = ?) RETURNING id", (artist_name, artist_name)).fetchone()
+                if created is not None:
+                    artist_id = created[0]
+                    added.append(("artists", artist_name, artist_id))
+                else:
+                    artist_id = connection.execute("SELECT id FROM artists WHERE name = ?", (artist_name,)).fetchone()[0]
+            genre_id = reference_cache.get_id("genres", genre_name)
+            if genre_id is None:
+                # genres.name is UNIQUE; RETURNING gives nothing when the genre already exists
+                created = connection.execute("INSERT INTO genres (name) VALUES (?) ON CONFLICT (name) DO NOTHING RETURNING id", (genre_name,)).fetchone()
+                if created is not None:
+                    genre_id = created[0]
+                    added.append(("genres", genre_name, genre_id))
+                else:
+                    genre_id = connection.execute("SELECT id FROM genres WHERE name = ?", (genre_name,)).fetchone()[0]
+            created = connection.execute("""
+                INSERT INTO songs (title, artist_id, genre_id)
+                SELECT ?, ?, ? WHERE NOT EXISTS (SELECT 1 FROM songs WHERE title = ? AND artist_id = ? AND genre_id = ?)
+                RETURNING id
+            """, (title, artist_id, genre_id, title, artist_id, genre_id)).fetchone()
+            if created is not None:
+                return added, created[0], True
+            existing = connection.execute("SELECT id FROM songs WHERE title = ? AND artist_id = ? AND genre_id = ?", (title, artist_id, genre_id)).fetchone()
+            return added, existing[0], False
+
+        added, song_id, created = db.run_transaction(create)
+        # Only once committed: a rolled back id must not end up in the cache
+        for table, name, row_id in added:
+            reference_cache.add(table, name, row_id)
+        flash("Song added successfully!" if created else "Song already exists!")
+        return redirect(url_for("song", song_id=song_id))
+
+    # Artist and genre suggestions are fetched from /autocomplete as the user types
+    return render_template("add_song.html")
+
+@app.route("/autocomplete")
+@api_login_required
+def autocomplete():
+    """Suggests artist or genre names for the add song form.
+
+    ?field=artist or ?field=genre picks the list, ?q= is what the user has typed and ?limit= caps the
+    suggestions (MAX_AUTOCOMPLETE_RESULTS at most). Served from the in-memory reference cache.
 
-        # Create song
-        existing_song = db.execute("SELECT id FROM songs WHERE title = ? AND artist_id = ? AND genre_id = ?", title, artist_id, genre_id)
-        if existing_song:
-            flash("Song already exists!")
-            return redirect(url_for("song", song_id=existing_song[0]["id"]))
-        else:
-            db.execute("INSERT INTO songs (title, artist_id, genre_id) VALUES (?, ?, ?)", title, artist_id, genre_id)
-            song_id = db.execute("SELECT id FROM songs WHERE title = ? AND artist_id = ? AND genre_id = ?", title, artist_id, genre_id)[0]["id"]
-            flash("Song added successfully!")
-            return redirect(url_for("song", song_id=song_id))
+    Returns:
+        Response: JSON list of the names starting with q, ignoring case, in alphabetical order.
 
-    artists = db.execute("SELECT name FROM artists ORDER BY name")
-    genres = db.execute("SELECT name FROM genres ORDER BY name")
-    return render_template("add_song.html", artists=[a["name"] for a in artists], genres=[g["name"] for g in genres])
+    Raises:
+        400: If the field is unknown or the limit is invalid.
+    """
+    table = {"artist": "artists", "genre": "genres"}.get(request.args.get("field"))
+    if table is None:
+        abort(400)
+    prefix = request.args.get("q", "").strip()
+    limit = read_limit(AUTOCOMPLETE_RESULTS, MAX_AUTOCOMPLETE_RESULTS)
+    return json_response(reference_cache.complete(table, prefix, limit))
 
 @app.route("/search")
 @login_required
 def search():
-    """Searches for songs by title, artist, or genre.
+    """Searches for songs by title, artist, or genre, and optionally by lyrics (?lyrics=1).
+
+    Uses the songs_fts and versions_fts full-text indexes, with results ranked by relevance.
 
     Returns:
         Response: Rendered search results template, or redirect with flash if no query.
@@ -366,18 +768,45 @@ def search():
         flash(f"Search query must be {MAX_SEARCH_QUERY_LENGTH} characters or less.")
         return redirect(url_for("songs"))
 
-    like = f"%{query}%"
-
-    results = db.execute("""
-        SELECT songs.id, songs.title, artists.name AS artist, genres.name AS genre
-        FROM songs
+    include_lyrics = request.args.get("lyrics") == "1"
+    match = search_expression(query)
+    if match is None:
+        return render_template("search_results.html", query=query, results=[], include_lyrics=include_lyrics)
+
+    # Full-text index lookup, best matches first: a hit in the title weighs more than one in the artist or genre.
+    # With lyrics, songs having a version that contains every word are found too, ranked by their best hit.
+    # Paginated with keyset pagination on (rank, id).
+    page_size, key, backwards = read_page_args(2)
+    if include_lyrics:
+        matches = """
+            SELECT song_id, MIN(rank) AS rank FROM (
+                SELECT rowid AS song_id, bm25(songs_fts, 10.0, 5.0, 2.0) AS rank FROM songs_fts WHERE songs_fts MATCH ?
+                UNION ALL
+                SELECT versions.song_id, bm25(versions_fts) FROM versions_fts JOIN versions ON versions.id = versions_fts.rowid WHERE versions_fts MATCH ?
+            )
+            GROUP BY song_id
+        """
+        args = (match, match)
+    else:
+        matches = "SELECT rowid AS song_id, rank FROM songs_fts WHERE songs_fts MATCH ? AND rank MATCH 'bm25(10.0, 5.0, 2.0)'"
+        args = (match,)
+    sql = f"""
+        WITH ranked AS ({matches})
+        SELECT songs.id, songs.title, artists.name AS artist, genres.name AS genre, ranked.rank
+        FROM ranked
+        JOIN songs ON songs.id = ranked.song_id
         JOIN artists ON songs.artist_id = artists.id
         JOIN genres ON songs.genre_id = genres.id
-        WHERE songs.title LIKE ? OR artists.name LIKE ? OR genres.name LIKE ?
-        ORDER BY artists.name, songs.title
-    """, like, like, like) 
+    """
+    if key is None:
+        rows = db.execute(f"{sql} ORDER BY ranked.rank, ranked.song_id LIMIT ?", *args, page_size + 1)
+    elif backwards:
+        rows = db.execute(f"{sql} WHERE (ranked.rank, ranked.song_id) < (?, ?) ORDER BY ranked.rank DESC, ranked.song_id DESC LIMIT ?", *args, *key, page_size + 1)
+    else:
+        rows = db.execute(f"{sql} WHERE (ranked.rank, ranked.song_id) > (?, ?) ORDER BY ranked.rank, ranked.song_id LIMIT ?", *args, *key, page_size + 1)
 
-    return render_template("search_results.html", query=query, results=results)
+    results, next_cursor, prev_cursor = keyset_page(rows, page_size, backwards, key is not None, lambda song: (song["rank"], song["id"]))
+    return render_template("search_results.html", query=query, results=results, include_lyrics=include_lyrics, next_cursor=next_cursor, prev_cursor=prev_cursor)
     
 @app.route("/versions/<int:version_id>/rate", methods=["POST"])
 @login_required
@@ -389,28 +818,335 @@ def rate_version(version_id):
 
     Returns:
         Response: Redirect to the version page with flash message.
+
+    Raises:
+        404: If the version does not exist.
     """
     # Get rating from form
     rating = request.form.get("rating", type=int)
 
-    song_id = db.execute("SELECT song_id FROM versions WHERE id = ?", version_id)[0]["song_id"]
+    user_id = session["user_id"]
+    # The version, and whether the user has rated it before, in one query
+    version = db.execute("SELECT song_id, EXISTS (SELECT 1 FROM ratings WHERE version_id = versions.id AND user_id = ?) AS had_rated FROM versions WHERE id = ?", user_id, version_id)
+    if not version:
+        abort(404)
+    song_id = version[0]["song_id"]
 
     if not rating or rating < 1 or rating > 5:
         flash("Invalid rating. Please select a rating between 1 and 5.")
         return redirect(url_for("version", song_id=song_id, version_id=version_id))
 
-    # Check if user has already rated this version
-    if db.execute("SELECT id FROM ratings WHERE version_id = ? AND user_id = ?", version_id, session["user_id"]):
-        # Update existing rating
-        db.execute("UPDATE ratings SET rating = ? WHERE version_id = ? AND user_id = ?", rating, version_id, session["user_id"])
+    if rating_writer is not None:
+        # Written in the background together with other users' ratings
+        rating_writer.submit(version_id, user_id, rating)
+        flash("Your rating has been saved.")
+        return redirect(url_for("version", song_id=song_id, version_id=version_id))
+
+    # Two concurrent submissions can't both insert; run_transaction waits out other writers
+    db.run_transaction(lambda connection: connection.execute(UPSERT_RATING, (version_id, user_id, rating)))
+    if version[0]["had_rated"]:
         flash("Your rating has been updated.")
     else:
-        # Insert new rating
-        db.execute("INSERT INTO ratings (rating, version_id, user_id) VALUES (?, ?, ?)", rating, version_id, session["user_id"])
         flash("Your rating has been added.")
 
     return redirect(url_for("version", song_id=song_id, version_id=version_id))
 
+@app.cli.command("import-charts")
+@click.argument("path", type=click.Path(exists=True))
+@click.option("--user", "username", required=True, help="User the imported versions are credited to.")
+@click.option("--genre", "default_genre", default="Unknown", show_default=True, help="Genre for charts that don't state one.")
+@click.option("--batch-size", default=1000, show_default=True, help="Charts stored per transaction.")
+@click.option("--restart", is_flag=True, help="Ignore the saved checkpoint and import the source from the start.")
+def import_charts_command(path, username, default_genre, batch_size, restart):
+    """Bulk imports ChordPro and bracket-notation charts from a directory, .zip or .tar archive.
+
+    An interrupted import picks up where it stopped when run again on the same PATH.
+    """
+    user = db.execute("SELECT id FROM users WHERE username = ?", username)
+    if not user:
+        raise click.BadParameter(f"no user named {username!r}", param_hint="--user")
+    if restart:
+        db.execute("DELETE FROM import_checkpoints WHERE source = ?", os.path.abspath(path))
+
+    limits = {"title": MAX_TITLE_LENGTH, "artist": MAX_ARTIST_NAME_LENGTH, "genre": MAX_GENRE_NAME_LENGTH, "content": MAX_CONTENT_LENGTH}
+    importer = Importer(db, user[0]["id"], limits, default_genre=default_genre, batch_size=batch_size, chord_index=chord_index)
+
+    def progress(imported, skipped, seconds):
+        click.echo(f"{imported} charts imported, {skipped} skipped, {imported / max(seconds, 1e-9):.0f} charts/s")
+
+    importer.run(path, progress)
+    for name, reason in importer.skipped:
+        click.echo(f"Skipped {name}: {reason}")
+
+@app.route("/export")
+def export():
+    """Streams a full dump of the catalog, for backups and analytics. Operators only.
+
+    The dump holds every user's ratings, so the request must carry EXPORT_TOKEN in an
+    "Authorization: Bearer <token>" header; being logged in isn't enough, since anyone can register.
+    ?format=ndjson (default) dumps songs, versions with their rating aggregates, and ratings as JSON lines.
+    ?format=chordpro dumps every version as a ChordPro song. ?gzip=1 compresses the download.
+
+    Returns:
+        Response: The dump as a file download, streamed as it's read from the database.
+
+    Raises:
+        400: If the format is unknown.
+        403: If the token is missing or wrong.
+        404: If EXPORT_TOKEN isn't set.
+    """
+    if not EXPORT_TOKEN:
+        abort(404)
+    scheme, _, token = request.headers.get("Authorization", "").partition(" ")
+    if scheme.lower() != "bearer" or not hmac.compare_digest(token.encode(), EXPORT_TOKEN.encode()):
+        abort(403)
+    export_format = request.args.get("format", "ndjson")
+    if export_format not in EXPORT_FORMATS:
+        abort(400)
+    compress = request.args.get("gzip") == "1"
+
+    filename = f"chordapp.{'ndjson' if export_format == 'ndjson' else 'cho'}{'.gz' if compress else ''}"
+    mimetype = "application/gzip" if compress else ("application/x-ndjson" if export_format == "ndjson" else "text/plain")
+    return Response(stream_export(db, export_format, compress), mimetype=mimetype, headers={"Content-Disposition": f"attachment; filename={filename}"})
+
+@app.route("/api/songs")
+@api_login_required
+def api_songs():
+    """Lists the songs as JSON, one page at a time, like the songs route.
+
+    Returns:
+        Response: {"songs": [{"id", "title", "artist", "genre"}, ...], "next": cursor, "prev": cursor}.
+    """
+    songs, next_cursor, prev_cursor = read_songs_page()
+    return json_response({"songs": songs, "next": next_cursor, "prev": prev_cursor})
+
+@app.route("/api/songs/<int:song_id>")
+@api_login_required
+def api_song(song_id):
+    """Describes a song and lists its versions as JSON, best rated first.
+
+    Args:
+        song_id: The ID of the song.
+
+    Returns:
+        Response: The song's id, title, artist and genre, and its versions with their creator and rating.
+
+    Raises:
+        404: If the song does not exist.
+    """
+    song_info = db.execute("SELECT songs.id, songs.title, artists.name AS artist, genres.name AS genre FROM songs JOIN artists ON songs.artist_id = artists.id JOIN genres ON songs.genre_id = genres.id WHERE songs.id = ?", song_id)
+    if not song_info:
+        abort(404)
+    song_info[0]["versions"] = db.execute("SELECT versions.id, versions.version_number, users.username AS creator, versions.created_at, versions.rating_count, ROUND(versions.rating_avg, 2) AS rating_avg FROM versions JOIN users ON versions.creator_id = users.id WHERE versions.song_id = ? ORDER BY versions.rating_avg DESC", song_id)
+    return json_response(song_info[0])
+
+@app.route("/api/versions/<int:version_id>")
+@api_login_required
+def api_version(version_id):
+    """Returns a version's chart as JSON, in the compact token encoding (see api.compact_tokens).
+
+    Accepts ?transpose=n and ?spelling=sharp|flat like the version route. The ETag comes from the content
+    hash, RENDER_VERSION and the transposition, so a client revalidating its copy gets a 304 without the
+    chart being loaded, encoded or compressed.
+
+    Args:
+        version_id: The ID of the version.
+
+    Returns:
+        Response: The version's id, song, number, creator and date, and its tokens; or 304 Not Modified.
+
+    Raises:
+        404: If the version does not exist.
+    """
+    version = db.execute("SELECT versions.id, versions.song_id, versions.version_number, users.username AS creator, versions.created_at, versions.content, versions.tokens, versions.tokens_format FROM versions JOIN users ON versions.creator_id = users.id WHERE versions.id = ?", version_id)
+    if not version:
+        abort(404)
+    version = version[0]
+
+    offset, spelling = read_transpose_args()
+    etag_key = f"{content_hash(version['content'])}-r{RENDER_VERSION}"
+    if offset or spelling:
+        etag_key += f"-t{offset}{spelling or ''}"
+    cached = not_modified(make_etag(etag_key, negotiate_encoding()))
+    if cached is not None:
+        return cached
+
+    parsed_song, _ = load_parsed_song(version, offset, spelling)
+    payload = {key: version[key] for key in ("id", "song_id", "version_number", "creator", "created_at")}
+    payload["transpose"] = offset
+    payload["tokens"] = compact_tokens(parsed_song)
+    return json_response(payload, etag_key)
+
+@app.route("/api/chord-search")
+@api_login_required
+def api_chord_search():
+    """Finds versions that can be played with the chords a player knows, best rated first.
+
+    ?chords=G,C,D,Em lists the chords. ?match=subset (the default) returns versions using only those chords,
+    ?match=overlap versions using any of them. ?limit=n returns n versions (CHORD_SEARCH_RESULTS by default,
+    MAX_CHORD_SEARCH_RESULTS at most). Chords are matched whatever their spelling (A#m = Bbm = Bbmin), and a
+    slash chord counts as its chord without the bass.
+
+    Returns:
+        Response: {"chords": [...], "match": ..., "versions": [{"id", "song_id", "version_number", "title",
+            "artist", "rating_count", "rating_avg", "chords", "known"}, ...]}; "known" is how many of the
+            version's chords were asked for.
+
+    Raises:
+        400: If no chords are given, there are too many, or match or limit is invalid.
+    """
+    chords = [chord.strip() for chord in request.args.get("chords", "").split(",") if chord.strip()]
+    if not chords:
+        abort(400, "chords is required")
+    if len(chords) > MAX_CHORD_SEARCH_CHORDS:
+        abort(400, f"at most {MAX_CHORD_SEARCH_CHORDS} chords")
+    match = request.args.get("match", SUBSET)
+    if match not in CHORD_MATCHES:
+        abort(400, f"match must be one of {', '.join(CHORD_MATCHES)}")
+    limit = read_limit(CHORD_SEARCH_RESULTS, MAX_CHORD_SEARCH_RESULTS)
+    return json_response({"chords": chords, "match": match, "versions": chord_index.search(chords, match, limit)})
+
+@app.errorhandler(HTTPException)
+def handle_http_exception(e):
+    """Answers errors on API routes with JSON instead of an HTML page.
+
+    Args:
+        e: The HTTP error.
+
+    Returns:
+        Response | HTTPException: {"error": ...} for API routes, the default error page otherwise.
+    """
+    if request.path.startswith("/api/"):
+        # abort(400, "...") explains what was wrong; otherwise the status name is enough
+        return api_error(e.code, e.description if e.description != type(e).description else e.name.lower())
+    return e
+
+@app.errorhandler(DatabaseBusy)
+def handle_database_busy(e):
+    """Turns a write that kept finding the database locked into 503, so the client can try again.
+
+    Args:
+        e: The error raised by Database.run_transaction.
+
+    Returns:
+        Response | HTTPException: 503 Service Unavailable with a Retry-After header.
+    """
+    return handle_http_exception(ServiceUnavailable(retry_after=WRITE_RETRY_AFTER))
+
+@app.route("/metrics")
+def metrics():
+    """Exposes request, template, SQL and cache metrics for Prometheus to scrape.
+
+    Returns:
+        Response: The metrics in the Prometheus text exposition format.
+    """
+    return app.response_class(registry.render(), mimetype="text/plain; version=0.0.4")
+
+@app.cli.command("backfill-tokens")
+@click.option("--batch-size", default=500, show_default=True, help="Versions updated per transaction.")
+def backfill_tokens(batch_size):
+    """Stores tokenized charts for every version saved without them, or with an outdated token format."""
+    last_id = 0
+    total = 0
+    while True:
+        rows = db.execute("SELECT id, content FROM versions WHERE id > ? AND (tokens_format IS NULL OR tokens_format != ?) ORDER BY id LIMIT ?", last_id, TOKENS_FORMAT, batch_size)
+        if not rows:
+            break
+
+        with db.transaction() as connection:
+            connection.executemany(
+                "UPDATE versions SET tokens = ?, tokens_format = ? WHERE id = ?",
+                [(serialize_tokens(parse_content(row["content"])), TOKENS_FORMAT, row["id"]) for row in rows],
+            )
+
+        last_id = rows[-1]["id"]
+        total += len(rows)
+        click.echo(f"{total} versions tokenized")
+
+    click.echo(f"Done: {total} versions tokenized")
+
+@app.cli.command("index-chords")
+@click.option("--batch-size", default=1000, show_default=True, help="Versions indexed per transaction.")
+@click.option("--all", "rebuild", is_flag=True, help="Recompute the chord set of every version, not only the missing ones.")
+def index_chords(batch_size, rebuild):
+    """Adds every version missing from the chord index (saved before it existed, or imported) to it.
+
+    With --all, every version's chord set is recomputed, e.g. after a change to which symbols count as
+    chords; only the versions whose set changed are written.
+    """
+    missing = "" if rebuild else " AND chord_set_id IS NULL"
+    last_id = 0
+    total = 0
+    changed = 0
+    while True:
+        rows = db.execute(f"SELECT id, content, tokens, tokens_format FROM versions WHERE id > ?{missing} ORDER BY id LIMIT ?", last_id, batch_size)
+        if not rows:
+            break
+
+        with db.transaction() as connection:
+            updates = []
+            for row in rows:
+                set_id = chord_index.set_id(connection, stored_chords(row["tokens"]) if row["tokens_format"] == TOKENS_FORMAT else chart_chords(parse_content(row["content"])))
+                updates.append((set_id, row["id"], set_id))
+            # Versions already pointing to the right set aren't rewritten
+            cursor = connection.executemany("UPDATE versions SET chord_set_id = ? WHERE id = ? AND chord_set_id IS NOT ?", updates)
+        # Sets created by this batch are found in memory by the next ones
+        chord_index.committed()
+
+        last_id = rows[-1]["id"]
+        total += len(rows)
+        changed += cursor.rowcount
+        click.echo(f"{total} versions indexed")
+
+    click.echo(f"Done: {total} versions indexed, {changed} changed")
+
+@app.cli.command("export-catalog")
+@click.argument("output", type=click.Path(dir_okay=False, allow_dash=True), default="-")
+@click.option("--format", "export_format", type=click.Choice(EXPORT_FORMATS), default="ndjson", show_default=True)
+@click.option("--gzip", "compress", is_flag=True, help="Compress the output (implied when OUTPUT ends in .gz).")
+def export_catalog_command(output, export_format, compress):
+    """Writes a full dump of the catalog to OUTPUT (standard output by default)."""
+    compress = compress or output.endswith(".gz")
+    with click.open_file(output, "wb") as f:
+        for chunk in stream_export(db, export_format, compress):
+            f.write(chunk)
+
+@app.cli.command("history-report")
+def history_report_command():
+    """Reports how much space the version history takes, against storing every revision in full."""
+    report = storage_report(db.connection())
+    saved = report["full_bytes"] - report["stored_bytes"]
+    click.echo(f"{report['revisions']} revisions of {report['versions']} versions: {report['snapshots']} snapshots, {report['deltas']} deltas (longest chain {report['deepest_chain']})")
+    click.echo(f"Full copies: {report['full_bytes']} bytes, stored: {report['stored_bytes']} bytes, saved: {saved} bytes ({saved / max(report['full_bytes'], 1):.0%})")
+
+@app.cli.command("migrate")
+@click.option("--to", "target", type=int, help="Stop after this migration instead of applying all of them.")
+@click.option("--list", "list_only", is_flag=True, help="Show every migration and whether it's applied, without applying any.")
+def migrate_command(target, list_only):
+    """Applies pending schema migrations."""
+    connection = db.connection()
+    if list_only:
+        current = schema_version(connection)
+        for number, description, _ in MIGRATIONS:
+            click.echo(f"{'applied' if number <= current else 'pending':<8} {number:>3}  {description}")
+        return
+    applied = migrate(DB_PATH, target, log=lambda number, description, seconds: click.echo(f"Applied {number}: {description} ({seconds:.1f}s)"))
+    click.echo(f"Schema at version {schema_version(connection)}" + ("" if applied else ", nothing to apply"))
+
+@app.cli.command("rebuild-search-index")
+def rebuild_search_index_command():
+    """Rebuilds the full-text search indexes from scratch."""
+    with db.transaction() as connection:
+        rebuild_search_index(connection)
+    click.echo("Search index rebuilt")
+
+@app.cli.command("reconcile-ratings")
+def reconcile_ratings_command():
+    """Rebuilds every version's rating count, sum and average from the ratings table."""
+    with db.transaction() as connection:
+        drifted = reconcile_rating_aggregates(connection)
+    click.echo(f"Rating aggregates rebuilt, {drifted} versions were out of date")
+
 if __name__ == "__main__":
     print("Starting Flask Server...")
     debug = os.getenv("FLASK_DEBUG", "false").lower() == "true"
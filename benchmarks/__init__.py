@@ -0,0 +1,2 @@
+# Benchmarks and stress tools for ChordApp. Run them from the repository root, e.g.:
+#   python -m benchmarks.parser_bench
@@ -0,0 +1,88 @@
+# Benchmark: chord search through the chord index vs. reading every version's chords
+# - the scan is the best the app could do without the index: every version's chords are read from its stored token
+#   stream (or its content, if it has none) and checked, then the matches are ranked by rating
+# - both must return the same versions, in the same order
+# Usage: python -m benchmarks.chord_bench DATABASE [--repeat N] [--limit N] [--no-scan]
+# DATABASE should come from benchmarks.generate, or have been indexed with `flask --app app index-chords`.
+import argparse
+import statistics
+import time
+
+from chord_index import OVERLAP, SUBSET, ChordIndex, chart_chords, chord_keys
+from database import Database
+from tokenizer import TOKENS_FORMAT, stored_chords, tokenize
+
+SEARCHES = [
+    ("G,C,D,Em", SUBSET),
+    ("C,F,G,Am,Dm,Em", SUBSET),
+    ("A,D,E,F#m,Bm,C#m", SUBSET),
+    ("G,C,D", SUBSET),
+    ("Bbm7", SUBSET),
+    ("F#m", OVERLAP),
+    ("C,G", OVERLAP),
+]
+
+
+def scan(connection, symbols, match, limit):
+    """Answers a search by reading every version's chords. Returns the version ids, best rated first."""
+    known = chord_keys(symbols)
+    found = []
+    for version_id, rating_avg, content, tokens, tokens_format in connection.execute("SELECT id, rating_avg, content, tokens, tokens_format FROM versions"):
+        keys = chord_keys(stored_chords(tokens) if tokens_format == TOKENS_FORMAT else chart_chords(tokenize(content)))
+        if keys and (keys <= known if match == SUBSET else keys & known):
+            found.append((rating_avg, version_id))
+    found.sort(key=lambda row: (row[0] is not None, row), reverse=True)
+    return [version_id for _, version_id in found[:limit]]
+
+
+def timed(function, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure chord search latency with and without the chord index")
+    parser.add_argument("database", help="database with the chord index filled in")
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--limit", type=int, default=20)
+    parser.add_argument("--no-scan", dest="scan", action="store_false", help="skip the scan, which reads every version")
+    args = parser.parse_args()
+
+    db = Database(args.database)
+    connection = db.connection()
+    versions = connection.execute("SELECT COUNT(*) FROM versions").fetchone()[0]
+    missing = connection.execute("SELECT COUNT(*) FROM versions WHERE chord_set_id IS NULL").fetchone()[0]
+    if missing:
+        raise SystemExit(f"{missing} versions aren't indexed yet; run `flask --app app index-chords` first")
+
+    index = ChordIndex(db)
+    start = time.perf_counter()
+    index.refresh()
+    load_ms = (time.perf_counter() - start) * 1000
+    chords, sets = (connection.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0] for table in ("chords", "chord_sets"))
+    print(f"{versions} versions, {chords} chords, {sets} chord sets; index loaded in {load_ms:.1f}ms")
+
+    print(f"{'chords':<20} {'match':<8} {'index ms':>9} {'versions':>9} {'scan ms':>9}")
+    failed = False
+    for chords, match in SEARCHES:
+        symbols = chords.split(",")
+        index_ms, results = timed(lambda: index.search(symbols, match, args.limit), args.repeat)
+        if args.scan:
+            scan_ms, expected = timed(lambda: scan(connection, symbols, match, args.limit), 1)
+            failed = failed or [version["id"] for version in results] != expected
+            scanned = f"{scan_ms:>9.0f}"
+        else:
+            scanned = f"{'-':>9}"
+        print(f"{chords:<20} {match:<8} {index_ms:>9.2f} {len(results):>9} {scanned}")
+
+    if failed:
+        print("The index and the scan found different versions")
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
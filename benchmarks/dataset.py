@@ -0,0 +1,223 @@
+# Synthetic databases for the benchmarks
+# - same schema as chordapp.db, brought up to date by schema.migrate
+# - seeded, so runs with the same parameters produce the same data
+# - realistic chord charts: verses and choruses over common progressions, in every key
+import os
+import random
+import sqlite3
+import time
+
+from werkzeug.security import generate_password_hash
+
+from chord_index import chart_chords, chord_keys, intern_chord_set
+from schema import install_triggers, migrate, rebuild_search_index, reconcile_rating_aggregates
+from tokenizer import TOKENS_FORMAT, serialize_tokens, tokenize
+
+# The schema is copied from the repository's database, wherever the generator runs from
+SOURCE_DB = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "chordapp.db")
+
+# Every generated user has this password, so the load driver can log in as any of them
+PASSWORD = "benchmark"
+
+WORDS = [
+    "love", "night", "heart", "river", "fire", "dream", "road", "summer", "rain", "light", "shadow", "home",
+    "blue", "golden", "wild", "silent", "broken", "city", "ocean", "moon", "dance", "forever", "yesterday", "song",
+    "little", "lonely", "sweet", "thunder", "angel", "midnight", "morning", "stone", "paper", "highway", "garden",
+]
+LYRIC_WORDS = WORDS + ["I", "you", "we", "the", "and", "in", "my", "your", "on", "of", "is", "was", "will", "never", "always", "when"]
+GENRES = ["Rock", "Pop", "Folk", "Blues", "Jazz", "Country", "Reggae", "Metal", "Punk", "Soul", "Funk", "Indie"]
+
+NOTES = ["C", "C#", "D", "Eb", "E", "F", "F#", "G", "Ab", "A", "Bb", "B"]
+# Scale degrees as (semitones above the key, chord quality)
+DEGREES = {"I": (0, ""), "ii": (2, "m"), "iii": (4, "m"), "IV": (5, ""), "V": (7, ""), "V7": (7, "7"), "vi": (9, "m"), "bVII": (10, "")}
+PROGRESSIONS = [
+    ["I", "V", "vi", "IV"], ["I", "IV", "V", "I"], ["vi", "IV", "I", "V"], ["ii", "V7", "I", "I"],
+    ["I", "vi", "IV", "V"], ["I", "bVII", "IV", "I"], ["I", "iii", "IV", "V7"],
+]
+
+# Distinct charts generated per run; versions draw from this pool, so huge datasets don't spend hours writing lyrics
+CHART_POOL_SIZE = 2000
+
+
+def create_database(path):
+    """Creates an empty database with the same schema as chordapp.db.
+
+    Args:
+        path: Where to create the database file. It must not exist yet.
+    """
+    source = sqlite3.connect(SOURCE_DB)
+    statements = [
+        row[0] for row in source.execute("SELECT sql FROM sqlite_master WHERE type IN ('table', 'index') AND sql IS NOT NULL AND name NOT LIKE 'sqlite_%' AND name NOT LIKE 'songs_fts%' AND name NOT LIKE 'versions_fts%' ORDER BY type = 'index'")
+    ]
+    source.close()
+
+    connection = sqlite3.connect(path)
+    for statement in statements:
+        connection.execute(statement)
+    connection.commit()
+    connection.close()
+    migrate(path)
+
+
+def title(rng):
+    return " ".join(rng.choice(WORDS) for _ in range(rng.randint(1, 4))).capitalize()
+
+
+def make_chart(rng):
+    """Writes a chord chart: a few verses and a chorus, with chords placed over the lyrics.
+
+    Args:
+        rng: The random generator to draw from.
+
+    Returns:
+        str: The chart in the app's bracket notation.
+    """
+    key = rng.randrange(12)
+    verse_progression = rng.choice(PROGRESSIONS)
+    chorus_progression = rng.choice(PROGRESSIONS)
+
+    def line(progression):
+        words = [rng.choice(LYRIC_WORDS) for _ in range(rng.randint(5, 9))]
+        # One chord per bar, at evenly spaced words
+        for bar, degree in enumerate(progression):
+            offset, quality = DEGREES[degree]
+            position = bar * len(words) // len(progression)
+            words[position] = f"[{NOTES[(key + offset) % 12]}{quality}]{words[position]}"
+        return " ".join(words)
+
+    sections = []
+    chorus = [line(chorus_progression) for _ in range(4)]
+    for verse in range(rng.randint(2, 4)):
+        sections.append(f"Verse {verse + 1}:\n" + "\n".join(line(verse_progression) for _ in range(4)))
+        sections.append("Chorus:\n" + "\n".join(chorus))
+    return "\n\n".join(sections)
+
+
+def populate_catalog(connection, song_count, rng):
+    """Fills the artists, genres and songs tables.
+
+    Args:
+        connection: An open sqlite3 connection to a database made by create_database.
+        song_count: Number of songs to create. Artists are created at one per ten songs.
+        rng: The random generator to draw from.
+    """
+    artist_count = max(1, song_count // 10)
+    connection.executemany("INSERT INTO genres (name) VALUES (?)", [(genre,) for genre in GENRES])
+    connection.executemany("INSERT INTO artists (name) VALUES (?)", [(f"{title(rng)} {i}",) for i in range(artist_count)])
+    connection.executemany(
+        "INSERT INTO songs (title, artist_id, genre_id) VALUES (?, ?, ?)",
+        ((title(rng), rng.randint(1, artist_count), rng.randint(1, len(GENRES))) for _ in range(song_count)),
+    )
+    connection.commit()
+
+
+def populate_users(connection, user_count):
+    """Fills the users table with bench0, bench1, ... all with PASSWORD as password.
+
+    Args:
+        connection: An open sqlite3 connection.
+        user_count: Number of users to create.
+    """
+    password_hash = generate_password_hash(PASSWORD)
+    connection.executemany("INSERT INTO users (username, password_hash) VALUES (?, ?)", ((f"bench{i}", password_hash) for i in range(user_count)))
+    connection.commit()
+
+
+def populate_versions(connection, version_count, song_count, user_count, rng):
+    """Fills the versions table with charts (and their stored tokens and chord sets).
+
+    Popular songs get many more versions than the rest, like in a real catalog.
+
+    Args:
+        connection: An open sqlite3 connection.
+        version_count: Number of versions to create.
+        song_count: Number of songs to spread them over.
+        user_count: Number of users to pick creators from.
+        rng: The random generator to draw from.
+    """
+    pool = []
+    for _ in range(min(CHART_POOL_SIZE, version_count)):
+        chart = make_chart(rng)
+        tokens = tokenize(chart)
+        pool.append((chart, serialize_tokens(tokens), intern_chord_set(connection, chord_keys(chart_chords(tokens)))))
+
+    next_number = {}
+
+    def rows():
+        for _ in range(version_count):
+            # Pareto-skewed song popularity
+            song_id = min(int(rng.paretovariate(1.2)), song_count) if rng.random() < 0.5 else rng.randint(1, song_count)
+            number = next_number.get(song_id, 0) + 1
+            next_number[song_id] = number
+            chart, tokens, chord_set_id = rng.choice(pool)
+            yield song_id, number, rng.randint(1, user_count), chart, tokens, TOKENS_FORMAT, chord_set_id
+
+    connection.executemany("INSERT INTO versions (song_id, version_number, creator_id, content, tokens, tokens_format, chord_set_id) VALUES (?, ?, ?, ?, ?, ?, ?)", rows())
+    connection.commit()
+
+
+def populate_ratings(connection, rating_count, version_count, user_count, rng):
+    """Fills the ratings table, at most one rating per user and version.
+
+    Args:
+        connection: An open sqlite3 connection.
+        rating_count: Approximate number of ratings to create.
+        version_count: Number of versions to rate.
+        user_count: Number of users to rate them.
+        rng: The random generator to draw from.
+    """
+    per_version = rating_count / version_count
+
+    def rows():
+        for version_id in range(1, version_count + 1):
+            count = min(user_count, int(rng.expovariate(1 / per_version) + 0.5)) if per_version else 0
+            # Each version has its own typical quality, so averages spread out
+            quality = rng.uniform(1.5, 4.5)
+            for user_id in rng.sample(range(1, user_count + 1), count):
+                yield version_id, user_id, min(5, max(1, round(rng.gauss(quality, 1))))
+
+    connection.executemany("INSERT INTO ratings (version_id, user_id, rating) VALUES (?, ?, ?)", rows())
+    connection.commit()
+
+
+def generate(path, songs, versions, ratings, users, seed=0, log=print):
+    """Builds a complete synthetic database.
+
+    Triggers are dropped during the bulk load and the derived data (search index, rating aggregates)
+    is rebuilt once at the end, which is much faster than maintaining it row by row.
+
+    Args:
+        path: Where to create the database file. It must not exist yet.
+        songs: Number of songs.
+        versions: Number of versions.
+        ratings: Approximate number of ratings.
+        users: Number of users.
+        seed: Seed for the random generator.
+        log: Function to report progress with.
+    """
+    rng = random.Random(seed)
+    create_database(path)
+    connection = sqlite3.connect(path)
+    connection.execute("PRAGMA journal_mode = WAL")
+    connection.execute("PRAGMA synchronous = OFF")
+    for (name,) in connection.execute("SELECT name FROM sqlite_master WHERE type = 'trigger'").fetchall():
+        connection.execute(f"DROP TRIGGER {name}")
+
+    steps = [
+        (f"{users} users", lambda: populate_users(connection, users)),
+        (f"{songs} songs", lambda: populate_catalog(connection, songs, rng)),
+        (f"{versions} versions", lambda: populate_versions(connection, versions, songs, users, rng)),
+        (f"~{ratings} ratings", lambda: populate_ratings(connection, ratings, versions, users, rng) if versions else None),
+        ("rating aggregates", lambda: reconcile_rating_aggregates(connection)),
+        ("search index", lambda: rebuild_search_index(connection)),
+    ]
+    for description, step in steps:
+        start = time.perf_counter()
+        step()
+        connection.commit()
+        log(f"{description}: {time.perf_counter() - start:.1f}s")
+
+    install_triggers(connection)
+    connection.execute("ANALYZE")
+    connection.commit()
+    connection.close()
@@ -0,0 +1,34 @@
+# Builds a synthetic chordapp.db for benchmarking
+# Usage: python -m benchmarks.generate OUTPUT [--songs N] [--versions N] [--ratings N] [--users N] [--seed S]
+# e.g. the large catalog: python -m benchmarks.generate bench.db --songs 100000 --versions 1000000 --ratings 10000000
+import argparse
+import os
+import sys
+
+from benchmarks.dataset import PASSWORD, generate
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic ChordApp database")
+    parser.add_argument("output", help="path of the database to create")
+    parser.add_argument("--songs", type=int, default=10_000)
+    parser.add_argument("--versions", type=int, default=50_000)
+    parser.add_argument("--ratings", type=int, default=500_000)
+    parser.add_argument("--users", type=int, default=10_000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--force", action="store_true", help="overwrite the output if it exists")
+    args = parser.parse_args()
+
+    if os.path.exists(args.output):
+        if not args.force:
+            sys.exit(f"{args.output} already exists (use --force to overwrite it)")
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(args.output + suffix):
+                os.remove(args.output + suffix)
+
+    generate(args.output, args.songs, args.versions, args.ratings, args.users, args.seed)
+    print(f"Done. Users are bench0 to bench{args.users - 1}, password {PASSWORD!r}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,240 @@
+# Load driver: replays a mixed read/write workload against every ChordApp route
+# - in-process through Flask's test client (default), or over HTTP against a running server (--url)
+# - reports p50/p95/p99 latency and throughput per route, and writes them to JSON so runs can be diffed
+# Usage: python -m benchmarks.load DATABASE [--requests N] [--threads N] [--url http://127.0.0.1:8000] [--output results.json]
+# DATABASE should come from benchmarks.generate. Write routes modify it, so use a copy you can throw away.
+import argparse
+import http.cookiejar
+import json
+import os
+import platform
+import random
+import sqlite3
+import statistics
+import subprocess
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+from benchmarks.dataset import PASSWORD, WORDS, make_chart
+
+# Relative weight of each route in the workload
+DEFAULT_MIX = {"songs": 20, "search": 20, "song": 20, "version": 30, "rate": 7, "save_version": 3}
+
+
+class TestClientSession:
+    """Sends requests to the app in-process, through Flask's test client."""
+
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def get(self, path, params=None):
+        return self.client.get(path, query_string=params).status_code
+
+    def post(self, path, data):
+        return self.client.post(path, data=data).status_code
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+class HttpSession:
+    """Sends requests to a running server, keeping the session cookie."""
+
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip("/")
+        self.opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()), _NoRedirect())
+
+    def _send(self, request):
+        try:
+            with self.opener.open(request) as response:
+                response.read()
+                return response.status
+        except urllib.error.HTTPError as e:
+            # Redirects (after logins and form posts) surface as errors because they aren't followed
+            return e.code
+
+    def get(self, path, params=None):
+        query = f"?{urllib.parse.urlencode(params)}" if params else ""
+        return self._send(urllib.request.Request(f"{self.base_url}{path}{query}"))
+
+    def post(self, path, data):
+        return self._send(urllib.request.Request(f"{self.base_url}{path}", data=urllib.parse.urlencode(data).encode()))
+
+
+def load_targets(db_path, rng, limit=2000):
+    """Samples the songs, versions and users the workload will hit.
+
+    Args:
+        db_path: The benchmark database.
+        rng: The random generator to draw from.
+        limit: Maximum number of songs and versions to sample.
+
+    Returns:
+        dict[str, list]: Song ids, (song id, version id) pairs and usernames.
+    """
+    connection = sqlite3.connect(db_path)
+    song_ids = [row[0] for row in connection.execute("SELECT id FROM songs ORDER BY random() LIMIT ?", (limit,))]
+    versions = connection.execute("SELECT song_id, id FROM versions ORDER BY random() LIMIT ?", (limit,)).fetchall()
+    usernames = [row[0] for row in connection.execute("SELECT username FROM users WHERE username LIKE 'bench%' LIMIT 1000")]
+    connection.close()
+    if not song_ids or not versions or not usernames:
+        raise SystemExit("The database has no songs, versions or bench users; build it with benchmarks.generate")
+    rng.shuffle(usernames)
+    return {"songs": song_ids, "versions": versions, "users": usernames}
+
+
+def make_request(session, route, targets, rng):
+    """Sends one request of the given kind.
+
+    Returns:
+        int: The HTTP status code.
+    """
+    if route == "songs":
+        return session.get("/songs")
+    if route == "search":
+        return session.get("/search", {"q": rng.choice(WORDS)[:rng.randint(3, 6)]})
+    if route == "song":
+        return session.get(f"/songs/{rng.choice(targets['songs'])}")
+    if route == "version":
+        song_id, version_id = rng.choice(targets["versions"])
+        return session.get(f"/songs/{song_id}/versions/{version_id}")
+    if route == "rate":
+        _, version_id = rng.choice(targets["versions"])
+        return session.post(f"/versions/{version_id}/rate", {"rating": rng.randint(1, 5)})
+    if route == "save_version":
+        return session.post(f"/save_version/{rng.choice(targets['songs'])}", {"content": make_chart(rng)})
+    raise ValueError(f"unknown route {route}")
+
+
+def summarize(timings, errors, elapsed):
+    """Computes latency percentiles and throughput for one route.
+
+    Args:
+        timings: Latencies of the route's requests, in seconds.
+        errors: Number of requests that failed (5xx or exception).
+        elapsed: Wall time of the whole run, in seconds.
+
+    Returns:
+        dict: Request and error counts, throughput (req/s) and p50/p95/p99/max latency (ms).
+    """
+    summary = {"requests": len(timings), "errors": errors, "throughput": round(len(timings) / elapsed, 2)}
+    if timings:
+        ms = sorted(t * 1000 for t in timings)
+        cuts = statistics.quantiles(ms, n=100, method="inclusive") if len(ms) > 1 else [ms[0]] * 99
+        summary.update({"p50_ms": round(cuts[49], 3), "p95_ms": round(cuts[94], 3), "p99_ms": round(cuts[98], 3), "max_ms": round(ms[-1], 3)})
+    return summary
+
+
+def run(make_session, targets, mix, total_requests, threads, seed):
+    """Replays the workload from several threads at once.
+
+    Returns:
+        tuple[dict, float]: Per route (timings, error count), and the wall time of the run.
+    """
+    routes = list(mix)
+    weights = [mix[route] for route in routes]
+    results = {route: ([], [0]) for route in routes}
+    lock = threading.Lock()
+    per_thread = total_requests // threads
+
+    def worker(index):
+        rng = random.Random(seed + index)
+        session = make_session()
+        credentials = {"username": targets["users"][index % len(targets["users"])], "password": PASSWORD}
+        # Logins past the password hashing pool's limit are turned away with 503; wait for a free slot
+        while session.post("/login", credentials) == 503:
+            time.sleep(0.1)
+        local = {route: ([], 0) for route in routes}
+        barrier.wait()
+        for _ in range(per_thread):
+            route = rng.choices(routes, weights)[0]
+            start = time.perf_counter()
+            try:
+                failed = make_request(session, route, targets, rng) >= 500
+            except Exception:
+                failed = True
+            timings, errors = local[route]
+            timings.append(time.perf_counter() - start)
+            local[route] = (timings, errors + failed)
+        with lock:
+            for route, (timings, errors) in local.items():
+                results[route][0].extend(timings)
+                results[route][1][0] += errors
+
+    barrier = threading.Barrier(threads + 1)
+    workers = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    for thread in workers:
+        thread.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for thread in workers:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    return {route: (timings, errors[0]) for route, (timings, errors) in results.items()}, elapsed
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a mixed workload against ChordApp and report latency per route")
+    parser.add_argument("database", help="database built by benchmarks.generate (write routes modify it)")
+    parser.add_argument("--requests", type=int, default=2000, help="total requests across all threads")
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument("--url", help="base URL of a running server (e.g. gunicorn) instead of the in-process test client")
+    parser.add_argument("--mix", type=json.loads, default=DEFAULT_MIX, help=f"route weights as JSON, default {json.dumps(DEFAULT_MIX)}")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the results to this JSON file")
+    args = parser.parse_args()
+
+    targets = load_targets(args.database, random.Random(args.seed))
+    if args.url:
+        make_session = lambda: HttpSession(args.url)
+    else:
+        # The app reads DB_PATH when it's imported
+        os.environ["DB_PATH"] = args.database
+        from app import app
+        make_session = lambda: TestClientSession(app)
+
+    timings, elapsed = run(make_session, targets, args.mix, args.requests, args.threads, args.seed)
+    routes = {route: summarize(route_timings, errors, elapsed) for route, (route_timings, errors) in timings.items()}
+    all_timings = [t for route_timings, _ in timings.values() for t in route_timings]
+    report = {
+        "meta": {
+            "database": os.path.abspath(args.database),
+            "target": args.url or "test-client",
+            "requests": args.requests,
+            "threads": args.threads,
+            "mix": args.mix,
+            "seed": args.seed,
+            "revision": git_revision(),
+            "python": platform.python_version(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "elapsed_s": round(elapsed, 3),
+        },
+        "total": summarize(all_timings, sum(errors for _, errors in timings.values()), elapsed),
+        "routes": routes,
+    }
+
+    print(f"{'route':<14} {'requests':>8} {'errors':>6} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    for route, summary in list(routes.items()) + [("total", report["total"])]:
+        print(f"{route:<14} {summary['requests']:>8} {summary['errors']:>6} {summary['throughput']:>8} "
+              f"{summary.get('p50_ms', '-'):>8} {summary.get('p95_ms', '-'):>8} {summary.get('p99_ms', '-'):>8}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+# Micro-benchmark: tokenizer engine vs. the original character-by-character parser,
+# and reading a stored (serialized) token stream instead of parsing
+# Usage: python -m benchmarks.parser_bench [--repeat N]
+import argparse
+import random
+import timeit
+
+from tokenizer import deserialize_tokens, iter_tokens, serialize_tokens, tokenize
+
+CHORDS = ["C", "G", "Am", "F", "D", "Em", "E7", "Bm", "Fmaj7,9,13", "C#m7", "Bb", "G/B"]
+WORDS = ["love", "you", "the", "night", "is", "young", "and", "I", "am", "singing", "along", "tonight"]
+
+
+def legacy_parse_content(content):
+    """The original helpers.parse_content, kept as a reference for speed and output comparisons.
+
+    Builds every chord and lyric with `str +=` one character at a time. Never call it on content
+    containing a "]" outside a chord: it loops forever on it.
+
+    Args:
+        content: The raw song content string with chords and lyrics.
+
+    Returns:
+        list[dict[str, str]]: A list of dictionaries with 'type' and 'value' keys.
+    """
+    parsed_song = []
+    cursor = 0
+    while cursor < len(content):
+        if content[cursor] == " ":
+            space_count = 0
+            while cursor < len(content) and content[cursor] == " ":
+                space_count += 1
+                cursor += 1
+            parsed_song.append({"type": "spaces", "value": " " * space_count})
+        elif content[cursor] == "[":
+            chord = ""
+            cursor += 1
+            while cursor < len(content) and content[cursor] != "]":
+                chord += content[cursor]
+                cursor += 1
+            parsed_song.append({"type": "spaces", "value": " "})
+            parsed_song.append({"type": "chord", "value": chord})
+            parsed_song.append({"type": "spaces", "value": " "})
+            if cursor < len(content):
+                cursor += 1
+        elif content[cursor] == "\n":
+            parsed_song.append({"type": "line-break", "value": "\n"})
+            cursor += 1
+        else:
+            lyric = ""
+            while cursor < len(content) and content[cursor] not in [" ", "[", "]", "\n"]:
+                lyric += content[cursor]
+                cursor += 1
+            parsed_song.append({"type": "lyric", "value": lyric})
+
+    return parsed_song
+
+
+def make_chart(length, seed=0):
+    """Builds a realistic chord chart of roughly the given length.
+
+    Args:
+        length: Target size of the chart in characters.
+        seed: Seed for the random generator, so runs are comparable.
+
+    Returns:
+        str: A chart with bracketed chords over lyric lines.
+    """
+    rng = random.Random(seed)
+    lines = []
+    size = 0
+    while size < length:
+        words = []
+        for _ in range(rng.randint(4, 9)):
+            if rng.random() < 0.3:
+                words.append(f"[{rng.choice(CHORDS)}]{rng.choice(WORDS)}")
+            else:
+                words.append(rng.choice(WORDS))
+        line = " ".join(words)
+        lines.append(line)
+        size += len(line) + 1
+    return "\n".join(lines)[:length]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the chord chart tokenizer")
+    parser.add_argument("--repeat", type=int, default=200, help="parses per measurement")
+    args = parser.parse_args()
+
+    print(f"{'chars':>8} {'legacy ms':>10} {'tokenize ms':>12} {'lazy ms':>10} {'stored ms':>10} {'speedup':>8}")
+    for length in (500, 2000, 10000, 100000):
+        chart = make_chart(length)
+        assert [(t.type, t.value) for t in tokenize(chart)] == [(d["type"], d["value"]) for d in legacy_parse_content(chart)]
+
+        legacy = timeit.timeit(lambda: legacy_parse_content(chart), number=args.repeat) / args.repeat * 1000
+        eager = timeit.timeit(lambda: tokenize(chart), number=args.repeat) / args.repeat * 1000
+        # Consume the generator without keeping the tokens around
+        lazy = timeit.timeit(lambda: sum(1 for _ in iter_tokens(chart)), number=args.repeat) / args.repeat * 1000
+        blob = serialize_tokens(tokenize(chart))
+        stored = timeit.timeit(lambda: deserialize_tokens(blob), number=args.repeat) / args.repeat * 1000
+        print(f"{length:>8} {legacy:>10.3f} {eager:>12.3f} {lazy:>10.3f} {stored:>10.3f} {legacy / eager:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
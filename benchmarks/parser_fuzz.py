@@ -0,0 +1,136 @@
+# Fuzz check for the chord chart tokenizer
+# - replays a corpus of hand-picked pathological inputs, then random ones up to MAX_CONTENT_LENGTH
+# - every input must tokenize within a time limit and round-trip back to the original text
+# Usage: python -m benchmarks.parser_fuzz [--runs N] [--seed S]
+import argparse
+import random
+import signal
+import sys
+
+from benchmarks.parser_bench import legacy_parse_content
+from tokenizer import CHORD, MAX_CONTENT_LENGTH, PAD, tokenize
+
+# Seconds any single input may take. Real charts tokenize in well under a millisecond.
+TIME_LIMIT = 2
+
+CORPUS = [
+    "",
+    " ",
+    "[",
+    "]",
+    "[]",
+    "][",
+    "]]]]",
+    "[[[[",
+    "[C",
+    "[C]",
+    "C]",
+    "a]b",
+    "[C]]",
+    "[[C]]",
+    "\n",
+    "\r\n",
+    "\n\n\n",
+    "[C\nG]",
+    "[C] [G]   [Am]\n",
+    "word]" * 2000,
+    "]" * MAX_CONTENT_LENGTH,
+    "[" * MAX_CONTENT_LENGTH,
+    " " * MAX_CONTENT_LENGTH,
+    "\n" * MAX_CONTENT_LENGTH,
+    "[]" * (MAX_CONTENT_LENGTH // 2),
+    "a" * MAX_CONTENT_LENGTH,
+    "[" + "a" * (MAX_CONTENT_LENGTH - 1),
+    "ñandú [Sol]corazón 🎸 [Re7]",
+    "\t\x00\x0b[\x0c] ",
+]
+
+# Characters that drive the tokenizer's state changes, plus a few ordinary ones
+ALPHABET = " []\n\r\tabcCG#m7/,ñ🎸"
+
+
+class Timeout(Exception):
+    pass
+
+
+def _on_alarm(signum, frame):
+    raise Timeout()
+
+
+def render(tokens):
+    """Rebuilds the source text from a token stream, dropping the padding around chords.
+
+    Args:
+        tokens: Tokens produced by the tokenizer.
+
+    Returns:
+        str: The chart text, with every chord written back in brackets.
+    """
+    parts = []
+    skip_pad = False
+    for token in tokens:
+        if token.type == CHORD:
+            parts.pop()  # padding before the chord
+            parts.append(f"[{token.value}]")
+            skip_pad = True
+        elif skip_pad and token is PAD:
+            skip_pad = False
+        else:
+            parts.append(token.value)
+    return "".join(parts)
+
+
+def check(content):
+    """Tokenizes one input and verifies its output.
+
+    Args:
+        content: The input to tokenize.
+
+    Returns:
+        str | None: A description of the failure, or None if the input passed.
+    """
+    signal.alarm(TIME_LIMIT)
+    try:
+        tokens = tokenize(content)
+    except Timeout:
+        return "did not terminate"
+    finally:
+        signal.alarm(0)
+
+    # An unclosed bracket swallows the rest of the content, so its "]" is missing from the input
+    if render(tokens) not in (content, content + "]"):
+        return "output does not round-trip to the input"
+
+    # The original parser agrees with the new one wherever it terminates (no "]" outside chords)
+    if "]" not in content:
+        if [(t.type, t.value) for t in tokens] != [(d["type"], d["value"]) for d in legacy_parse_content(content)]:
+            return "output differs from the original parser"
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fuzz the chord chart tokenizer")
+    parser.add_argument("--runs", type=int, default=2000, help="number of random inputs")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    signal.signal(signal.SIGALRM, _on_alarm)
+    rng = random.Random(args.seed)
+    inputs = list(CORPUS)
+    for _ in range(args.runs):
+        length = rng.choice([rng.randint(0, 50), rng.randint(0, MAX_CONTENT_LENGTH)])
+        inputs.append("".join(rng.choice(ALPHABET) for _ in range(length)))
+
+    failures = 0
+    for content in inputs:
+        error = check(content)
+        if error:
+            failures += 1
+            print(f"FAIL ({error}): {content[:60]!r}{'...' if len(content) > 60 else ''}")
+
+    print(f"{len(inputs)} inputs, {failures} failures")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
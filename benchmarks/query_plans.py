@@ -0,0 +1,217 @@
+# Query plan regression check: runs every route, then EXPLAIN QUERY PLAN on each SQL statement the routes sent
+# - statements are captured through the database's query_hook, with their real parameters, so queries assembled
+#   with f-strings (pagination, search) are checked as actually run
+# - fails if any plan reads a whole table ("SCAN <table>" without an index); index-ordered walks such as
+#   keyset pagination ("SCAN songs USING COVERING INDEX ...") are fine, since their LIMIT bounds them
+# - sorts that need a temporary B-tree are reported as warnings
+# Usage: python -m benchmarks.query_plans DATABASE [--verbose]
+# DATABASE should come from benchmarks.generate (the larger the better, so the planner sees realistic sizes).
+# Write routes are exercised too, so use a copy you can throw away.
+import argparse
+import os
+import random
+import re
+import sqlite3
+import sys
+
+from benchmarks.dataset import PASSWORD, WORDS, make_chart
+
+# A full table scan: "SCAN versions", "SCAN v" (aliased); not "SCAN songs USING INDEX ...", a virtual table or a subquery
+FULL_SCAN = re.compile(r"^SCAN (\w+)$")
+# A CTE or subquery the plan builds first; scanning it afterwards reads its rows, not a table's
+MATERIALIZED = re.compile(r"^(?:MATERIALIZE|CO-ROUTINE) (\w+)$")
+TEMP_SORT = "USE TEMP B-TREE"
+
+# Modules whose statements are checked: the routes, and the index they query directly
+CHECKED_MODULES = ("app.py", "chord_index.py")
+
+# Statements worth planning; BEGIN, COMMIT and PRAGMAs have no plan
+PLANNED = ("SELECT", "INSERT", "UPDATE", "DELETE", "WITH")
+
+
+def pick_targets(db_path):
+    """Chooses the song, version and user the routes are run against.
+
+    Returns:
+        dict: The busiest song's id, its most recent version's id and number, and that version's creator.
+    """
+    connection = sqlite3.connect(db_path)
+    try:
+        song_id = connection.execute("SELECT song_id FROM versions GROUP BY song_id ORDER BY COUNT(*) DESC LIMIT 1").fetchone()[0]
+        version_id, version_number, username = connection.execute(
+            "SELECT versions.id, versions.version_number, users.username FROM versions JOIN users ON versions.creator_id = users.id WHERE song_id = ? AND users.username LIKE 'bench%' ORDER BY versions.id DESC LIMIT 1",
+            (song_id,),
+        ).fetchone()
+        first_title = connection.execute("SELECT title, id FROM songs ORDER BY title, id LIMIT 1 OFFSET 50").fetchone()
+    finally:
+        connection.close()
+    return {"song": song_id, "version": version_id, "number": version_number, "user": username, "title_key": list(first_title)}
+
+
+def run_routes(client, targets):
+    """Sends one request to every route (or every branch of it that runs different SQL).
+
+    Returns:
+        list[tuple[str, int]]: Each request's description and status code.
+    """
+    from helpers import encode_cursor
+
+    song, version, number = targets["song"], targets["version"], targets["number"]
+    cursor = encode_cursor(targets["title_key"])
+    word = WORDS[0]
+    requests = [
+        ("POST", "/login", {"username": targets["user"], "password": PASSWORD}),
+        ("GET", "/", None),
+        ("GET", "/songs", None),
+        ("GET", f"/songs?after={cursor}", None),
+        ("GET", f"/songs?before={cursor}", None),
+        ("GET", f"/songs/{song}", None),
+        ("GET", f"/songs/{song}/versions/{version}", None),
+        ("GET", f"/songs/{song}/versions/{version}?transpose=2", None),
+        ("GET", f"/songs/{song}/workstation", None),
+        ("GET", f"/songs/{song}/workstation?version_number={number}", None),
+        ("POST", f"/save_version/{song}", {"content": make_chart(random.Random(0))}),
+        ("POST", f"/save_version/{song}", {"content": "[G]Edited [C]chart", "version_number": number}),
+        ("GET", f"/songs/{song}/versions/{version}/history", None),
+        ("GET", f"/songs/{song}/versions/{version}/history/1", None),
+        ("POST", f"/songs/{song}/versions/{version}/history/1/restore", None),
+        ("POST", f"/versions/{version}/rate", {"rating": 4}),
+        ("POST", f"/versions/{version}/rate", {"rating": 5}),
+        ("GET", "/songs/add_song", None),
+        ("POST", "/songs/add_song", {"title": "Query Plan Song", "artist_name": "Query Plan Artist", "genre_name": "Query Plan Genre"}),
+        ("POST", "/songs/add_song", {"title": "Query Plan Song", "artist_name": "Query Plan Artist", "genre_name": "Query Plan Genre"}),
+        ("GET", "/autocomplete?field=artist&q=a", None),
+        ("GET", f"/search?q={word}", None),
+        ("GET", f"/search?q={word}&lyrics=1", None),
+        ("GET", f"/search?q={word}&after={encode_cursor([-1.0, 1])}", None),
+        ("GET", f"/search?q={word}&before={encode_cursor([-1.0, 1])}", None),
+        ("GET", f"/search?q={word}&lyrics=1&after={encode_cursor([-1.0, 1])}", None),
+        ("GET", f"/search?q={word}&lyrics=1&before={encode_cursor([-1.0, 1])}", None),
+        ("GET", "/api/songs", None),
+        ("GET", f"/api/songs/{song}", None),
+        ("GET", f"/api/versions/{version}", None),
+        ("GET", "/api/chord-search?chords=G,C,D,Em", None),
+        ("GET", "/api/chord-search?chords=C,G&match=overlap", None),
+        ("GET", "/metrics", None),
+        ("POST", f"/songs/{song}/versions/{version}/delete", None),
+        ("GET", "/logout", None),
+        ("POST", "/register", {"username": "query_plan_user", "password": PASSWORD, "confirmation": PASSWORD}),
+    ]
+    statuses = []
+    for method, path, data in requests:
+        response = client.post(path, data=data) if method == "POST" else client.get(path)
+        statuses.append((f"{method} {path}", response.status_code))
+    return statuses
+
+
+def capture(db, route):
+    """Hooks into db.query_hook to record every statement sent from one of CHECKED_MODULES.
+
+    Args:
+        db: The app's Database.
+        route: One-item list holding the description of the request being sent.
+
+    Returns:
+        dict: Filled in as statements run: normalized SQL -> (SQL, parameters, first request that sent it).
+    """
+    statements = {}
+    previous = db.query_hook
+
+    def hook(sql, args, seconds):
+        # The first frame outside database.py is whoever sent the statement
+        frame = sys._getframe(1)
+        while frame is not None and frame.f_code.co_filename.endswith("database.py"):
+            frame = frame.f_back
+        if frame is not None and os.path.basename(frame.f_code.co_filename) in CHECKED_MODULES:
+            key = " ".join(sql.split())
+            if key.split(None, 1)[0].upper() in PLANNED and key not in statements:
+                statements[key] = (sql, tuple(args), route[0])
+        if previous is not None:
+            previous(sql, args, seconds)
+
+    db.query_hook = hook
+    return statements
+
+
+def explain(connection, sql, args):
+    """Returns the plan's lines (EXPLAIN QUERY PLAN's detail column)."""
+    return [row[3] for row in connection.execute(f"EXPLAIN QUERY PLAN {sql}", args)]
+
+
+def check_plans(db_path):
+    """Runs every route against a database, then EXPLAIN QUERY PLAN on each statement the routes sent.
+
+    Args:
+        db_path: Database built by benchmarks.generate; write routes modify it.
+
+    Returns:
+        tuple[list, list]: The requests that failed with a 5xx, as (request, status code); and every
+            statement checked, as dicts with its sql, the request that first sent it, its plan lines, and the
+            full_scans and temp_sorts among them.
+    """
+    targets = pick_targets(db_path)
+    # The app reads DB_PATH when it's imported
+    os.environ["DB_PATH"] = db_path
+    from app import app, db
+
+    route = [None]
+    statements = capture(db, route)
+    client = app.test_client()
+
+    class Client:
+        # Records which request is running, so each statement can be traced back to a route
+        def get(self, path):
+            route[0] = f"GET {path}"
+            return client.get(path)
+
+        def post(self, path, data=None):
+            route[0] = f"POST {path}"
+            return client.post(path, data=data)
+
+    failed = [(request, status) for request, status in run_routes(Client(), targets) if status >= 500]
+
+    connection = sqlite3.connect(db_path)
+    checked = []
+    try:
+        for sql, params, request in statements.values():
+            plan = explain(connection, sql, params)
+            built = {match.group(1) for match in map(MATERIALIZED.match, plan) if match}
+            checked.append({
+                "sql": sql,
+                "request": request,
+                "plan": plan,
+                "full_scans": [line for line in plan if (match := FULL_SCAN.match(line)) and match.group(1) not in built],
+                "temp_sorts": [line for line in plan if TEMP_SORT in line],
+            })
+    finally:
+        connection.close()
+    return failed, checked
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check that no query the routes send reads a whole table")
+    parser.add_argument("database", help="database built by benchmarks.generate (write routes modify it)")
+    parser.add_argument("--verbose", action="store_true", help="print every statement's plan, not just the problems")
+    args = parser.parse_args()
+
+    failed, checked = check_plans(args.database)
+    for request, status in failed:
+        print(f"{request}: {status}")
+
+    scans = warnings = 0
+    for statement in checked:
+        scans += bool(statement["full_scans"])
+        warnings += bool(statement["temp_sorts"])
+        if statement["full_scans"] or statement["temp_sorts"] or args.verbose:
+            verdict = "FULL SCAN" if statement["full_scans"] else "TEMP SORT" if statement["temp_sorts"] else "ok"
+            print(f"[{verdict}] {statement['request']}\n  {' '.join(statement['sql'].split())[:200]}")
+            for line in statement["plan"]:
+                print(f"    {line}")
+
+    print(f"{len(checked)} statements checked: {scans} with a full table scan, {warnings} with a temporary sort")
+    if scans:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
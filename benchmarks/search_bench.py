@@ -0,0 +1,86 @@
+# Benchmark: full-text search index vs. the original LIKE '%q%' search
+# - the lyrics column runs the /search?lyrics=1 query, which also looks the words up in every version's chart
+# Usage: python -m benchmarks.search_bench [--songs N] [--versions N] [--repeat N]
+import argparse
+import os
+import sqlite3
+import statistics
+import tempfile
+import time
+
+from benchmarks.dataset import generate
+from helpers import search_expression
+
+LIKE_QUERY = """
+    SELECT songs.id, songs.title, artists.name AS artist, genres.name AS genre
+    FROM songs
+    JOIN artists ON songs.artist_id = artists.id
+    JOIN genres ON songs.genre_id = genres.id
+    WHERE songs.title LIKE ? OR artists.name LIKE ? OR genres.name LIKE ?
+    ORDER BY artists.name, songs.title
+"""
+
+FTS_QUERY = """
+    SELECT songs.id, songs.title, artists.name AS artist, genres.name AS genre
+    FROM songs_fts
+    JOIN songs ON songs.id = songs_fts.rowid
+    JOIN artists ON songs.artist_id = artists.id
+    JOIN genres ON songs.genre_id = genres.id
+    WHERE songs_fts MATCH ? AND rank MATCH 'bm25(10.0, 5.0, 2.0)'
+    ORDER BY rank
+"""
+
+LYRICS_QUERY = """
+    SELECT songs.id, songs.title, artists.name AS artist, genres.name AS genre
+    FROM (
+        SELECT song_id, MIN(rank) AS rank FROM (
+            SELECT rowid AS song_id, bm25(songs_fts, 10.0, 5.0, 2.0) AS rank FROM songs_fts WHERE songs_fts MATCH ?
+            UNION ALL
+            SELECT versions.song_id, bm25(versions_fts) FROM versions_fts JOIN versions ON versions.id = versions_fts.rowid WHERE versions_fts MATCH ?
+        )
+        GROUP BY song_id
+    ) AS ranked
+    JOIN songs ON songs.id = ranked.song_id
+    JOIN artists ON songs.artist_id = artists.id
+    JOIN genres ON songs.genre_id = genres.id
+    ORDER BY ranked.rank
+"""
+
+SEARCHES = ["river", "golden moon", "yester", "jazz", "broken heart", "zzz"]
+
+
+def measure(connection, sql, params, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        rows = connection.execute(sql, params).fetchall()
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings), len(rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare LIKE and FTS5 search latency")
+    parser.add_argument("--songs", type=int, default=100_000)
+    parser.add_argument("--versions", type=int, default=20_000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "search.db")
+        print(f"Generating {args.songs} songs, {args.versions} versions...")
+        generate(path, songs=args.songs, versions=args.versions, ratings=0, users=1)
+        connection = sqlite3.connect(path)
+
+        print(f"{'query':<14} {'LIKE ms':>9} {'rows':>7} {'FTS ms':>9} {'rows':>7} {'lyrics ms':>10} {'rows':>7}")
+        for search in SEARCHES:
+            like = f"%{search}%"
+            like_ms, like_rows = measure(connection, LIKE_QUERY, (like, like, like), args.repeat)
+            match = search_expression(search)
+            fts_ms, fts_rows = measure(connection, FTS_QUERY, (match,), args.repeat)
+            lyrics_ms, lyrics_rows = measure(connection, LYRICS_QUERY, (match, match), args.repeat)
+            print(f"{search:<14} {like_ms:>9.2f} {like_rows:>7} {fts_ms:>9.2f} {fts_rows:>7} {lyrics_ms:>10.2f} {lyrics_rows:>7}")
+        connection.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+# Write contention test: many threads saving versions of the same song, rating it and adding songs at once
+# - checks that no two versions of the song got the same number and that no song or artist was created twice
+# - writes turned away with 503 because the write lock stayed taken are counted apart from errors
+# - reports each route's latency (median and 99th percentile) and the total wall time, since a write holding the
+#   lock for long slows every other writer down
+# - counts the SQL statements each write request sends through the database's query_hook, as the request profiling
+#   does (BEGIN, COMMIT and statements run by triggers aren't included)
+# Usage: python -m benchmarks.write_hammer DATABASE [--threads N] [--requests N] [--seed S]
+# DATABASE should come from benchmarks.generate. The test writes to it, so use a copy you can throw away.
+import argparse
+import os
+import random
+import sqlite3
+import statistics
+import threading
+import time
+
+from benchmarks.dataset import PASSWORD, make_chart
+from benchmarks.load import TestClientSession
+
+# Relative weight of each write in the workload
+MIX = {"save_version": 6, "rate": 3, "add_song": 1}
+
+# Songs the threads race to add; every thread picks from the same few, so most attempts find them already there
+NEW_SONGS = [(f"Hammer Song {i}", f"Hammer Artist {i % 3}", "Hammer Genre") for i in range(5)]
+
+
+def hammer(app, db, song_id, usernames, threads, per_thread, seed):
+    """Sends the writes from several threads at once.
+
+    Returns:
+        tuple[dict, float]: Per route, the (status code, statement count, milliseconds) of every request; and the
+            wall time.
+    """
+    results = {route: [] for route in MIX}
+    lock = threading.Lock()
+    routes = list(MIX)
+    weights = [MIX[route] for route in routes]
+    counter = threading.local()
+    previous = db.query_hook
+
+    def hook(sql, args, seconds):
+        # Threads that aren't counting (none yet, or the app's own) have no counter
+        if hasattr(counter, "statements"):
+            counter.statements += 1
+        if previous is not None:
+            previous(sql, args, seconds)
+
+    def worker(index):
+        rng = random.Random(seed + index)
+        session = TestClientSession(app)
+        while session.post("/login", {"username": usernames[index], "password": PASSWORD}) == 503:
+            time.sleep(0.1)
+        version_ids = [row["id"] for row in db.execute("SELECT id FROM versions WHERE song_id = ?", song_id)]
+        local = []
+        barrier.wait()
+        for _ in range(per_thread):
+            route = rng.choices(routes, weights)[0]
+            counter.statements = 0
+            start = time.perf_counter()
+            if route == "save_version":
+                status = session.post(f"/save_version/{song_id}", {"content": make_chart(rng)})
+            elif route == "rate":
+                status = session.post(f"/versions/{rng.choice(version_ids)}/rate", {"rating": rng.randint(1, 5)})
+            else:
+                title, artist, genre = rng.choice(NEW_SONGS)
+                status = session.post("/songs/add_song", {"title": title, "artist_name": artist, "genre_name": genre})
+            local.append((route, status, counter.statements, (time.perf_counter() - start) * 1000))
+        with lock:
+            for route, status, statements, milliseconds in local:
+                results[route].append((status, statements, milliseconds))
+
+    db.query_hook = hook
+    barrier = threading.Barrier(threads + 1)
+    workers = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    for thread in workers:
+        thread.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for thread in workers:
+        thread.join()
+    db.query_hook = previous
+    return results, time.perf_counter() - start
+
+
+def percentile(values, fraction):
+    """Returns the value below which the given fraction of values fall (nearest rank)."""
+    ordered = sorted(values)
+    return ordered[min(int(fraction * len(ordered)), len(ordered) - 1)]
+
+
+def check(db_path, song_id):
+    """Looks for rows the writes should never have duplicated.
+
+    Returns:
+        dict[str, int]: Number of duplicated version numbers, songs and artists.
+    """
+    connection = sqlite3.connect(db_path)
+    try:
+        versions = connection.execute("SELECT COUNT(*) FROM (SELECT 1 FROM versions WHERE song_id = ? GROUP BY version_number HAVING COUNT(*) > 1)", (song_id,)).fetchone()[0]
+        songs = connection.execute("SELECT COUNT(*) FROM (SELECT 1 FROM songs WHERE title LIKE 'Hammer Song %' GROUP BY title, artist_id, genre_id HAVING COUNT(*) > 1)").fetchone()[0]
+        artists = connection.execute("SELECT COUNT(*) FROM (SELECT 1 FROM artists WHERE name LIKE 'Hammer Artist %' GROUP BY name HAVING COUNT(*) > 1)").fetchone()[0]
+    finally:
+        connection.close()
+    return {"versions": versions, "songs": songs, "artists": artists}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Hammer ChordApp's write routes from many threads and check the results")
+    parser.add_argument("database", help="database built by benchmarks.generate (it is modified)")
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=50, help="requests per thread")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    connection = sqlite3.connect(args.database)
+    song_id = connection.execute("SELECT song_id FROM versions GROUP BY song_id ORDER BY COUNT(*) DESC LIMIT 1").fetchone()[0]
+    usernames = [row[0] for row in connection.execute("SELECT username FROM users WHERE username LIKE 'bench%' ORDER BY id LIMIT ?", (args.threads,))]
+    before = connection.execute("SELECT COUNT(*) FROM versions WHERE song_id = ?", (song_id,)).fetchone()[0]
+    connection.close()
+    if len(usernames) < args.threads:
+        raise SystemExit(f"The database needs at least {args.threads} bench users; build it with benchmarks.generate")
+
+    # The app reads DB_PATH when it's imported
+    os.environ["DB_PATH"] = args.database
+    from app import app, db
+
+    results, elapsed = hammer(app, db, song_id, usernames, args.threads, args.requests, args.seed)
+
+    print(f"{args.threads} threads x {args.requests} requests on song {song_id} in {elapsed:.2f}s")
+    print(f"{'route':<14} {'requests':>8} {'busy':>6} {'errors':>6} {'statements':>10} {'max':>5} {'p50 ms':>8} {'p99 ms':>8}")
+    failed = False
+    for route, requests in results.items():
+        busy = sum(status == 503 for status, _, _ in requests)
+        errors = sum(status >= 500 for status, _, _ in requests) - busy
+        counts = [statements for _, statements, _ in requests]
+        latencies = [milliseconds for _, _, milliseconds in requests]
+        failed = failed or errors > 0
+        if counts:
+            print(f"{route:<14} {len(requests):>8} {busy:>6} {errors:>6} {statistics.mean(counts):>10.1f} {max(counts):>5} {percentile(latencies, 0.5):>8.1f} {percentile(latencies, 0.99):>8.1f}")
+
+    saved = sum(status == 302 for status, _, _ in results["save_version"])
+    connection = sqlite3.connect(args.database)
+    after = connection.execute("SELECT COUNT(*) FROM versions WHERE song_id = ?", (song_id,)).fetchone()[0]
+    connection.close()
+    duplicates = check(args.database, song_id)
+    print(f"Versions saved: {saved}, added to the song: {after - before}")
+    print(f"Duplicated version numbers: {duplicates['versions']}, songs: {duplicates['songs']}, artists: {duplicates['artists']}")
+    if failed or after - before != saved or any(duplicates.values()):
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,284 @@
+# In-process caches for ChordApp
+# - ParsedSongCache: bounded LRU of tokenized charts, evicted by estimated memory use
+# - ReferenceCache: artist and genre names in sorted arrays, for exact and prefix lookups without a query
+import bisect
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+from tokenizer import BREAK, PAD
+
+
+def estimate_size(tokens):
+    """Estimates how many bytes a token list keeps alive.
+
+    Counts the list itself plus every token tuple and its value string. The shared padding and
+    line-break tokens are not counted, since every chart points to the same instances.
+
+    Args:
+        tokens: A list of tokens as produced by the tokenizer.
+
+    Returns:
+        int: Approximate size in bytes.
+    """
+    size = sys.getsizeof(tokens)
+    for token in tokens:
+        if token is PAD or token is BREAK:
+            continue
+        size += sys.getsizeof(token) + sys.getsizeof(token.value)
+    return size
+
+
+class ParsedSongCache:
+    """Thread-safe LRU cache of parsed charts, bounded by total memory.
+
+    Entries are keyed by (version id, content hash, variant), so an entry can never be served for content
+    it wasn't parsed from. The variant tells apart derived forms of the same chart, such as transpositions.
+    Entries for a version can also be dropped explicitly when it is edited or deleted, so stale parses don't
+    sit in memory until they age out.
+
+    Attributes:
+        max_bytes: Memory budget for all entries together.
+        hits: Number of lookups served from the cache.
+        misses: Number of lookups that weren't in the cache.
+        evictions: Number of entries dropped to stay within the memory budget.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()  # key -> (tokens, size), least recently used first
+        self._keys_by_version = {}  # version id -> set of keys, for invalidation
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, version_id, content_hash, variant=None):
+        """Looks up the parsed chart for a version's content.
+
+        Args:
+            version_id: The ID of the version.
+            content_hash: Hash of the version's current content.
+            variant: Which form of the chart, e.g. a (semitones, spelling) transposition; None for the
+                chart as written.
+
+        Returns:
+            list[Token] | None: The cached tokens, or None on a miss.
+        """
+        key = (version_id, content_hash, variant)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, version_id, content_hash, tokens, variant=None):
+        """Stores a parsed chart, evicting the least recently used entries if needed.
+
+        Charts bigger than the whole budget are not cached at all.
+
+        Args:
+            version_id: The ID of the version.
+            content_hash: Hash of the content the tokens were parsed from.
+            tokens: The parsed chart.
+            variant: Which form of the chart the tokens are, as for get().
+        """
+        key = (version_id, content_hash, variant)
+        size = estimate_size(tokens)
+        if size > self.max_bytes:
+            return
+
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (tokens, size)
+            self._keys_by_version.setdefault(version_id, set()).add(key)
+            self._bytes += size
+
+            while self._bytes > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def invalidate(self, version_id):
+        """Drops every cached entry for a version.
+
+        Args:
+            version_id: The ID of the version that was edited or deleted.
+        """
+        with self._lock:
+            for key in self._keys_by_version.get(version_id, set()).copy():
+                self._remove(key)
+
+    def stats(self):
+        """Returns the cache counters, for sizing the cache.
+
+        Returns:
+            dict[str, int]: Hits, misses, evictions, entry count and memory use.
+        """
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+            }
+
+    def _remove(self, key):
+        # Caller must hold the lock
+        _, size = self._entries.pop(key)
+        self._bytes -= size
+        keys = self._keys_by_version[key[0]]
+        keys.discard(key)
+        if not keys:
+            del self._keys_by_version[key[0]]
+
+
+class _NameIndex:
+    # One table's names, sorted by their case-folded form so prefixes can be found with bisect
+    __slots__ = ("keys", "names", "ids", "by_name", "max_id")
+
+    def __init__(self, rows):
+        rows = sorted((name.casefold(), name, row_id) for row_id, name in rows)
+        self.keys = [row[0] for row in rows]
+        self.names = [row[1] for row in rows]
+        self.ids = [row[2] for row in rows]
+        self.by_name = {}
+        for _, name, row_id in rows:
+            self.by_name.setdefault(name, row_id)
+        self.max_id = max(self.ids, default=0)
+
+    def add(self, name, row_id):
+        # Caller must hold the cache's lock
+        key = name.casefold()
+        position = bisect.bisect_right(self.keys, key)
+        # Already read with the table, or added twice; a duplicate would throw off the staleness check
+        start = bisect.bisect_left(self.keys, key, 0, position)
+        if any(self.ids[i] == row_id and self.names[i] == name for i in range(start, position)):
+            return
+        self.keys.insert(position, key)
+        self.names.insert(position, name)
+        self.ids.insert(position, row_id)
+        self.by_name.setdefault(name, row_id)
+        self.max_id = max(self.max_id, row_id)
+
+
+class ReferenceCache:
+    """Process-local copy of the artist and genre names, for exact lookups and prefix autocomplete.
+
+    Each table is loaded once, kept sorted, and updated in place when this process adds a row. Rows added
+    by other processes (other server workers, imports) are picked up by a cheap check of the table's size
+    and largest id, run at most once every refresh_interval seconds.
+
+    Attributes:
+        tables: The tables cached, e.g. ("artists", "genres"); each must have id and name columns.
+        refresh_interval: Seconds between checks for rows added by other processes.
+    """
+
+    def __init__(self, db, tables=("artists", "genres"), refresh_interval=30):
+        self.db = db
+        self.tables = tuple(tables)
+        self.refresh_interval = refresh_interval
+        self._indexes = {}
+        self._checked = {}
+        self._lock = threading.Lock()
+
+    def get_id(self, table, name):
+        """Looks up the id of a row by its exact name.
+
+        A miss doesn't prove the row doesn't exist (another process may have just added it), so callers
+        should still check the database before inserting.
+
+        Args:
+            table: One of the cached tables.
+            name: The exact name.
+
+        Returns:
+            int | None: The row's id, or None if it isn't cached.
+        """
+        index = self._index(table)
+        with self._lock:
+            return index.by_name.get(name)
+
+    def complete(self, table, prefix, limit=10):
+        """Finds the names starting with a prefix, ignoring case.
+
+        Args:
+            table: One of the cached tables.
+            prefix: What the user has typed so far.
+            limit: Most names to return.
+
+        Returns:
+            list[str]: Up to limit names, in alphabetical order.
+        """
+        index = self._index(table)
+        key = prefix.casefold()
+        # Under the lock: add() inserts into the same lists, which would shift them between a bisect and a slice.
+        # Held for a few bisects and at most limit names.
+        with self._lock:
+            position = bisect.bisect_left(index.keys, key)
+            # Artist names aren't unique; list each once. Rows sharing a key (the same name, or the same name in
+            # another case) are taken together, so a run of duplicates costs one step.
+            names = {}
+            while len(names) < limit and position < len(index.keys) and index.keys[position].startswith(key):
+                run_end = bisect.bisect_right(index.keys, index.keys[position], position)
+                names.update(dict.fromkeys(index.names[position:run_end]))
+                position = run_end
+        return list(names)[:limit]
+
+    def add(self, table, name, row_id):
+        """Records a row this process just inserted. Rows already cached are ignored.
+
+        Args:
+            table: One of the cached tables.
+            name: The new row's name.
+            row_id: The new row's id.
+        """
+        with self._lock:
+            index = self._indexes.get(table)
+            if index is None:
+                return  # Not loaded yet; the row will be read with the rest
+            index.add(name, row_id)
+
+    def _index(self, table):
+        if table not in self.tables:
+            raise ValueError(f"{table} is not a cached table")
+        index = self._indexes.get(table)
+        now = time.monotonic()
+        if index is not None and now - self._checked[table] < self.refresh_interval:
+            return index
+
+        with self._lock:
+            index = self._indexes.get(table)
+            if index is not None and now - self._checked[table] < self.refresh_interval:
+                return index
+            if index is not None:
+                # This thread checks; the others keep answering from the current index meanwhile
+                self._checked[table] = now
+                count, max_id = len(index.ids), index.max_id
+
+        # The queries and the sort run outside the lock, so lookups from other threads never wait on a reload
+        if index is not None:
+            # Both are answered from the table's b-tree without reading the rows
+            state = self.db.execute(f"SELECT COUNT(*) AS count, COALESCE(MAX(id), 0) AS max_id FROM {table}")[0]
+            if state["count"] == count and state["max_id"] == max_id:
+                return index
+        loaded = _NameIndex((row["id"], row["name"]) for row in self.db.execute(f"SELECT id, name FROM {table}"))
+
+        with self._lock:
+            current = self._indexes.get(table)
+            if current is not None and current.max_id > loaded.max_id:
+                # Rows add() recorded (or another reload read) after this one read the table
+                for name, row_id in zip(current.names, current.ids):
+                    if row_id > loaded.max_id:
+                        loaded.add(name, row_id)
+            self._indexes[table] = loaded
+            self._checked[table] = now
+            return loaded
@@ -0,0 +1,219 @@
+# Chord-set index for ChordApp: which charts can be played with a given set of chords
+# - every distinct chord in the catalog is interned once in the chords table, and its id picks its bit
+# - each version points to its chord set, a chord_sets row holding the OR of its chords' bits; versions using
+#   the same chords share one set, and a catalog has far fewer distinct sets than versions
+# - chords and chord sets are only ever added, so each process keeps them in memory and reads just the new rows
+# - a query tests the user's chords against every distinct set in memory, then SQLite ranks the versions of the
+#   matching sets by rating through idx_versions_chord_set
+import json
+import threading
+
+from tokenizer import CHORD
+from transpose import parse_chord
+
+SUBSET = "subset"
+OVERLAP = "overlap"
+MATCHES = (SUBSET, OVERLAP)
+
+# How chords are named in the index: one spelling per pitch, the one most charts use
+CANONICAL_NAMES = ("C", "C#", "D", "Eb", "E", "F", "F#", "G", "Ab", "A", "Bb", "B")
+
+# Other ways charts write the same quality
+QUALITY_ALIASES = {"M": "", "maj": "", "min": "m", "mi": "m", "-": "m", "M7": "maj7", "Δ": "maj7", "Δ7": "maj7", "min7": "m7", "-7": "m7"}
+
+_SEARCH_QUERY = """
+    WITH ranked AS (
+        SELECT id, chord_set_id FROM versions
+        WHERE chord_set_id IN (SELECT value FROM json_each(?))
+        ORDER BY rating_avg DESC, id DESC
+        LIMIT ?
+    )
+    SELECT versions.id, versions.song_id, versions.version_number, songs.title, artists.name AS artist,
+           versions.rating_count, ROUND(versions.rating_avg, 2) AS rating_avg, ranked.chord_set_id
+    FROM ranked
+    JOIN versions ON versions.id = ranked.id
+    JOIN songs ON versions.song_id = songs.id
+    JOIN artists ON songs.artist_id = artists.id
+    ORDER BY versions.rating_avg DESC, versions.id DESC
+"""
+
+
+def chord_key(symbol):
+    """Names a chord the way the index does, so different spellings of it match.
+
+    Enharmonic roots are merged (A# and Bb), common quality spellings too (Am, Amin, A-), and a slash bass is
+    dropped: a player who knows G can play G/B.
+
+    Args:
+        symbol: A chord as written in a chart.
+
+    Returns:
+        str | None: The chord's name in the index, or None if the symbol isn't a chord ("N.C.", "x2").
+    """
+    parsed = parse_chord(symbol.strip())
+    if parsed is None:
+        return None
+    root, quality, _ = parsed
+    return CANONICAL_NAMES[root] + QUALITY_ALIASES.get(quality, quality)
+
+
+def chart_chords(tokens):
+    """Returns the distinct chord symbols of a parsed chart, as written."""
+    return {token.value for token in tokens if token.type == CHORD}
+
+
+def chord_keys(symbols):
+    """Returns the distinct chords among chord symbols, named as in the index."""
+    keys = {chord_key(symbol) for symbol in symbols}
+    keys.discard(None)
+    return keys
+
+
+def _encode_bits(bits):
+    return bits.to_bytes((bits.bit_length() + 7) // 8, "little")
+
+
+def _decode_bits(blob):
+    return int.from_bytes(blob, "little")
+
+
+def intern_chord_set(connection, keys):
+    """Finds or creates the chord set made of the given chords.
+
+    Args:
+        connection: An open sqlite3 connection, inside the transaction that stores the version.
+        keys: The chords, named as chord_key() does. May be empty, for charts without chords.
+
+    Returns:
+        int: The chord set's id.
+    """
+    # The no-op updates make RETURNING give the ids of existing rows too
+    bits = 0
+    for (chord_id,) in connection.execute(
+        "INSERT INTO chords (symbol) SELECT value FROM json_each(?) WHERE true ON CONFLICT (symbol) DO UPDATE SET symbol = excluded.symbol RETURNING id",
+        (json.dumps(sorted(keys)),),
+    ):
+        bits |= 1 << (chord_id - 1)
+    return connection.execute(
+        "INSERT INTO chord_sets (bits, size) VALUES (?, ?) ON CONFLICT (bits) DO UPDATE SET size = excluded.size RETURNING id",
+        (_encode_bits(bits), bits.bit_count()),
+    ).fetchone()[0]
+
+
+class ChordIndex:
+    """Process-local copy of the chord vocabulary and chord sets, for chord searches.
+
+    Both tables only ever grow, so bringing the copy up to date reads just the rows added since the last
+    time, by this or any other process.
+
+    Attributes:
+        db: The database.Database to read from.
+    """
+
+    def __init__(self, db):
+        self.db = db
+        self._chord_ids = {}  # chord name -> id
+        self._names = {}  # chord id -> name
+        self._set_ids = {}  # frozenset of chord names -> chord set id
+        self._sets = []  # (chord set id, bits) of every non-empty set
+        self._bits = {}  # chord set id -> bits
+        self._max_chord_id = 0
+        self._max_set_id = 0
+        self._stale = False  # set_id() looked up a set the copy doesn't have
+        self._lock = threading.Lock()
+
+    def set_id(self, connection, symbols):
+        """Returns the id of a chart's chord set, creating the set if it's new.
+
+        Args:
+            connection: An open sqlite3 connection, inside the transaction that stores the version.
+            symbols: The chart's chord symbols, as chart_chords() or tokenizer.stored_chords() return them.
+
+        Returns:
+            int: The value for the version's chord_set_id.
+        """
+        keys = frozenset(chord_keys(symbols))
+        set_id = self._set_ids.get(keys)
+        if set_id is None:
+            # Not added to the copy here: the transaction could still roll back. See committed().
+            set_id = intern_chord_set(connection, keys)
+            self._stale = True
+        return set_id
+
+    def committed(self):
+        """Reads back the chord sets set_id() had to look up in the database, once their transaction committed.
+
+        Call it after every transaction that used set_id(), so the next versions with the same chords find
+        their set in memory.
+        """
+        if self._stale:
+            self.refresh()
+
+    def search(self, symbols, match=SUBSET, limit=20):
+        """Finds the versions playable with, or using some of, the given chords, best rated first.
+
+        Args:
+            symbols: The chords the player knows, as they'd write them.
+            match: SUBSET for versions using only these chords, OVERLAP for versions using any of them.
+            limit: Most versions to return.
+
+        Returns:
+            list[dict]: The versions, with their song and rating, their chords, and how many of them the
+                player knows.
+
+        Raises:
+            ValueError: If match isn't one of MATCHES.
+        """
+        if match not in MATCHES:
+            raise ValueError(f"match must be one of {', '.join(MATCHES)}")
+        self.refresh()
+        mask = 0
+        for symbol in symbols:
+            chord_id = self._chord_ids.get(chord_key(symbol))
+            if chord_id is not None:
+                mask |= 1 << (chord_id - 1)
+        if match == SUBSET:
+            outside = ~mask
+            set_ids = [set_id for set_id, bits in self._sets if not bits & outside]
+        else:
+            set_ids = [set_id for set_id, bits in self._sets if bits & mask]
+        if not set_ids:
+            return []
+
+        versions = self.db.execute(_SEARCH_QUERY, json.dumps(set_ids), limit)
+        for version in versions:
+            bits = self._bits[version.pop("chord_set_id")]
+            version["chords"] = self._chord_names(bits)
+            version["known"] = (bits & mask).bit_count()
+        return versions
+
+    def _chord_names(self, bits):
+        names = []
+        while bits:
+            low = bits & -bits
+            names.append(self._names[low.bit_length()])
+            bits ^= low
+        return names
+
+    def refresh(self):
+        """Reads the chords and chord sets added since the last refresh, by this process or another one.
+
+        Must not run inside a write transaction: rows it adds could still be rolled back.
+        """
+        with self._lock:
+            self._stale = False
+            # One read transaction for both tables, so every set read has its chords read too
+            with self.db.read_transaction():
+                chords = self.db.execute("SELECT id, symbol FROM chords WHERE id > ? ORDER BY id", self._max_chord_id)
+                sets = self.db.execute("SELECT id, bits FROM chord_sets WHERE id > ? ORDER BY id", self._max_set_id)
+            for row in chords:
+                self._chord_ids[row["symbol"]] = row["id"]
+                self._names[row["id"]] = row["symbol"]
+                self._max_chord_id = row["id"]
+            for row in sets:
+                bits = _decode_bits(row["bits"])
+                self._bits[row["id"]] = bits
+                self._set_ids[frozenset(self._chord_names(bits))] = row["id"]
+                if bits:
+                    self._sets.append((row["id"], bits))
+                self._max_set_id = row["id"]
@@ -0,0 +1,278 @@
+# Data-access layer for ChordApp
+# - one SQLite connection per thread at a time, handed back to a bounded pool of idle connections when the request
+#   ends (and per process, so it's safe under forking servers)
+# - WAL journaling, synchronous=NORMAL, memory-mapped reads and a configurable busy timeout
+# - parameters are always bound, so sqlite3's per-connection statement cache reuses prepared statements
+# - same execute() interface the routes were written against
+import os
+import queue
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+
+class DatabaseBusy(Exception):
+    """Raised by run_transaction when other writers kept the database locked through every attempt."""
+
+
+class Database:
+    """Thread-safe access to a SQLite database, with a pool of connections shared by the threads.
+
+    A thread takes a connection from the pool the first time it needs one and keeps it until release(), so
+    a request's statements and transactions all run on the same connection. Connections of threads that end
+    without releasing them are closed when the thread's state is freed.
+
+    Attributes:
+        path: Path to the SQLite database file.
+        busy_timeout: Milliseconds to wait for a lock held by another connection before failing.
+        mmap_size: Bytes of the database file to memory-map for reads.
+        cached_statements: Prepared statements kept per connection.
+        pool_size: Idle connections kept open for reuse; released connections beyond that are closed.
+        query_hook: Optional callable(sql, args, seconds), called after every execute() for profiling.
+    """
+
+    def __init__(self, path, busy_timeout=5000, mmap_size=256 * 1024 * 1024, cached_statements=256, pool_size=8):
+        self.path = path
+        self.busy_timeout = busy_timeout
+        self.mmap_size = mmap_size
+        self.cached_statements = cached_statements
+        self.pool_size = pool_size
+        self.query_hook = None
+        self._local = threading.local()
+        self._idle = queue.LifoQueue(maxsize=pool_size)
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+
+    def connection(self):
+        """Returns this thread's connection, taking one from the pool (or opening one) on first use.
+
+        Connections are in autocommit mode: every statement is its own transaction unless it runs
+        inside transaction().
+
+        Returns:
+            sqlite3.Connection: The connection.
+        """
+        connection = getattr(self._local, "connection", None)
+        # A connection inherited through fork() must not be used by the child
+        if connection is None or self._local.pid != os.getpid():
+            connection = self._checkout()
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    def release(self):
+        """Hands this thread's connection back to the pool, e.g. when a request ends.
+
+        The connection is closed instead if the pool is full. A transaction left open is rolled back first.
+        """
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            return
+        self._local.connection = None
+        if self._local.pid != os.getpid():
+            return
+        try:
+            if connection.in_transaction:
+                connection.execute("ROLLBACK")
+            self._idle.put_nowait(connection)
+        except (sqlite3.Error, queue.Full):
+            connection.close()
+
+    def _checkout(self):
+        with self._lock:
+            # Connections pooled before a fork() belong to the parent
+            if self._pid != os.getpid():
+                self._idle = queue.LifoQueue(maxsize=self.pool_size)
+                self._pid = os.getpid()
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            return self._connect()
+
+    def _connect(self):
+        connection = sqlite3.connect(
+            self.path,
+            timeout=self.busy_timeout / 1000,
+            isolation_level=None,
+            check_same_thread=False,
+            cached_statements=self.cached_statements,
+        )
+        connection.execute("PRAGMA journal_mode = WAL")
+        connection.execute("PRAGMA synchronous = NORMAL")
+        connection.execute(f"PRAGMA mmap_size = {int(self.mmap_size)}")
+        connection.execute(f"PRAGMA busy_timeout = {int(self.busy_timeout)}")
+        connection.execute("PRAGMA foreign_keys = ON")
+        return connection
+
+    def execute(self, sql, *args):
+        """Runs a single SQL statement with bound parameters.
+
+        Args:
+            sql: The statement, with ? placeholders.
+            *args: The values for the placeholders.
+
+        Returns:
+            list[dict] | int | None: For statements returning rows (SELECT, ... RETURNING), the rows as dicts.
+                For INSERT, the id of the new row. For UPDATE and DELETE, the number of rows changed.
+
+        Raises:
+            ValueError: If the statement violates a constraint (e.g. a UNIQUE column).
+        """
+        start = time.perf_counter()
+        try:
+            cursor = self.connection().execute(sql, args)
+            rows = cursor.fetchall() if cursor.description is not None else None
+        except sqlite3.IntegrityError as e:
+            raise ValueError(str(e)) from e
+        finally:
+            if self.query_hook is not None:
+                self.query_hook(sql, args, time.perf_counter() - start)
+
+        if rows is not None:
+            columns = [column[0] for column in cursor.description]
+            return [dict(zip(columns, row)) for row in rows]
+
+        keyword = sql.lstrip().split(None, 1)[0].upper() if sql.strip() else ""
+        if keyword in ("INSERT", "REPLACE"):
+            return cursor.lastrowid
+        if keyword in ("UPDATE", "DELETE"):
+            return cursor.rowcount
+        return None
+
+    @contextmanager
+    def transaction(self):
+        """Runs the enclosed statements in one write transaction.
+
+        The write lock is taken up front (BEGIN IMMEDIATE), so the transaction can't fail halfway through
+        because another writer got there first. Commits on success, rolls back on any exception.
+
+        Yields:
+            sqlite3.Connection: This thread's connection, for bulk operations such as executemany. Its
+                execute() and executemany() calls are reported to query_hook like execute()'s.
+        """
+        connection = self.connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            yield _ProfiledConnection(connection, self)
+            connection.execute("COMMIT")
+        except BaseException:
+            if connection.in_transaction:
+                connection.execute("ROLLBACK")
+            raise
+
+    @contextmanager
+    def read_transaction(self):
+        """Runs the enclosed reads in one read transaction, so they all see the database as it was at the first one.
+
+        Unlike snapshot(), it uses this thread's connection, for the few statements of a request; execute()
+        calls made meanwhile are part of it. Inside a transaction already open on the connection, the reads
+        simply join it.
+
+        Yields:
+            sqlite3.Connection: This thread's connection, as for transaction().
+        """
+        connection = self.connection()
+        began = not connection.in_transaction
+        if began:
+            connection.execute("BEGIN")
+        try:
+            yield _ProfiledConnection(connection, self)
+        finally:
+            if began and connection.in_transaction:
+                connection.execute("COMMIT")
+
+    def run_transaction(self, work, attempts=3):
+        """Runs work(connection) in a write transaction, trying again if the database stays busy.
+
+        The busy timeout already makes each attempt wait for other writers; this covers the rare case
+        where one of them holds the lock for longer than that. work must not have side effects outside
+        the database, since it may run more than once.
+
+        Args:
+            work: Callable taking the connection (see transaction()) and returning a result.
+            attempts: Most times to run it.
+
+        Returns:
+            Whatever work returns.
+
+        Raises:
+            DatabaseBusy: If the database was still locked after the last attempt.
+        """
+        delay = 0.05
+        for attempt in range(1, attempts + 1):
+            try:
+                with self.transaction() as connection:
+                    return work(connection)
+            except sqlite3.OperationalError as e:
+                if e.sqlite_errorcode not in (sqlite3.SQLITE_BUSY, sqlite3.SQLITE_LOCKED):
+                    raise
+                if attempt == attempts:
+                    raise DatabaseBusy(f"database still locked after {attempts} attempts") from e
+            time.sleep(delay)
+            delay *= 2
+
+    @contextmanager
+    def snapshot(self):
+        """Opens a separate connection that sees the database as it is now, for long reads such as exports.
+
+        The read transaction lasts for the whole block. In WAL mode it doesn't block writers, and the
+        thread's own connection stays free for other statements meanwhile.
+
+        Yields:
+            sqlite3.Connection: The connection, closed when the block ends.
+        """
+        connection = self._connect()
+        try:
+            connection.execute("BEGIN")
+            # The snapshot is taken by the first read, not by BEGIN
+            connection.execute("SELECT 1 FROM sqlite_master LIMIT 1").fetchall()
+            yield connection
+        finally:
+            connection.close()
+
+    def close_all(self):
+        """Closes this thread's connection and every idle one in the pool.
+
+        Connections other threads hold go back to the pool when they release them, and are closed when
+        those threads end.
+        """
+        connection = getattr(self._local, "connection", None)
+        self._local.connection = None
+        connections = [connection] if connection is not None else []
+        while True:
+            try:
+                connections.append(self._idle.get_nowait())
+            except queue.Empty:
+                break
+        for connection in connections:
+            try:
+                connection.close()
+            except sqlite3.Error:
+                pass
+
+
+class _ProfiledConnection:
+    # A connection whose execute() and executemany() calls are timed and reported to the database's query_hook
+
+    def __init__(self, connection, db):
+        self._connection = connection
+        self._db = db
+
+    def execute(self, sql, parameters=()):
+        return self._profiled(self._connection.execute, sql, parameters, parameters)
+
+    def executemany(self, sql, parameters):
+        # Batches can be large: don't hand every row to the hook
+        return self._profiled(self._connection.executemany, sql, parameters, ())
+
+    def _profiled(self, method, sql, parameters, reported):
+        start = time.perf_counter()
+        try:
+            return method(sql, parameters)
+        finally:
+            if self._db.query_hook is not None:
+                self._db.query_hook(sql, reported, time.perf_counter() - start)
+
+    def __getattr__(self, name):
+        return getattr(self._connection, name)
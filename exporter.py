@@ -0,0 +1,172 @@
+# Catalog export
+# - dumps songs, versions (with their rating aggregates) and ratings as NDJSON, or the charts as ChordPro
+# - everything is a generator reading straight from SQLite cursors, so memory use doesn't grow with the catalog
+# - rows are read inside one read transaction, so the dump is a consistent snapshot even while the app writes
+# - output is produced in chunks of bytes, optionally gzip-compressed on the fly
+import json
+import zlib
+
+FORMATS = ("ndjson", "chordpro")
+
+# Bytes of output gathered before a chunk is handed to the writer (or the HTTP response)
+CHUNK_SIZE = 64 * 1024
+
+# Ordered by song id and version number, which walks the primary key and idx_versions_song_version without sorting
+_CATALOG_QUERY = """
+    SELECT songs.id, songs.title, artists.name, genres.name, songs.created_at,
+           versions.id, versions.version_number, users.username, versions.created_at, versions.content,
+           versions.rating_count, versions.rating_avg
+    FROM songs
+    JOIN artists ON songs.artist_id = artists.id
+    JOIN genres ON songs.genre_id = genres.id
+    LEFT JOIN versions ON versions.song_id = songs.id
+    LEFT JOIN users ON versions.creator_id = users.id
+    ORDER BY songs.id, versions.version_number
+"""
+
+_RATINGS_QUERY = "SELECT version_id, user_id, rating, created_at FROM ratings ORDER BY version_id, user_id"
+
+
+def _json_line(record):
+    return json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n"
+
+
+def iter_ndjson(connection):
+    """Dumps the catalog as newline-delimited JSON.
+
+    Each song is followed by its versions, then come all the ratings. Every record has a "type" field
+    ("song", "version" or "rating").
+
+    Args:
+        connection: An open sqlite3 connection, ideally inside a read transaction.
+
+    Yields:
+        str: One JSON line at a time.
+    """
+    last_song = None
+    for song_id, title, artist, genre, song_created, version_id, number, creator, created, content, rating_count, rating_avg in connection.execute(_CATALOG_QUERY):
+        if song_id != last_song:
+            last_song = song_id
+            yield _json_line({"type": "song", "id": song_id, "title": title, "artist": artist, "genre": genre, "created_at": song_created})
+        if version_id is not None:
+            yield _json_line({
+                "type": "version", "id": version_id, "song_id": song_id, "version_number": number, "creator": creator,
+                "created_at": created, "content": content, "rating_count": rating_count, "rating_avg": rating_avg,
+            })
+
+    for version_id, user_id, rating, created in connection.execute(_RATINGS_QUERY):
+        yield _json_line({"type": "rating", "version_id": version_id, "user_id": user_id, "rating": rating, "created_at": created})
+
+
+def iter_chordpro(connection):
+    """Dumps every version as a ChordPro song, one after another.
+
+    The app's bracket notation is already ChordPro's inline chord syntax, so the content is written as is
+    under title, artist and genre directives. Songs are separated by {new_song}.
+
+    Args:
+        connection: An open sqlite3 connection, ideally inside a read transaction.
+
+    Yields:
+        str: The export, one song at a time.
+    """
+    first = True
+    for song_id, title, artist, genre, _, version_id, number, creator, _, content, rating_count, rating_avg in connection.execute(_CATALOG_QUERY):
+        if version_id is None:
+            continue
+        header = [] if first else ["", "{new_song}"]
+        first = False
+        header += [f"{{title: {title}}}", f"{{artist: {artist}}}", f"{{meta: genre {genre}}}", f"{{meta: version {number}}}", f"{{meta: creator {creator}}}"]
+        if rating_count:
+            header.append(f"{{meta: rating {rating_avg:.2f} ({rating_count})}}")
+        yield "\n".join(header) + "\n\n" + content + "\n"
+
+
+def iter_export(connection, export_format):
+    """Dumps the catalog in the given format.
+
+    Args:
+        connection: An open sqlite3 connection.
+        export_format: "ndjson" or "chordpro".
+
+    Returns:
+        Iterator[str]: The export.
+
+    Raises:
+        ValueError: If the format is unknown.
+    """
+    if export_format == "ndjson":
+        return iter_ndjson(connection)
+    if export_format == "chordpro":
+        return iter_chordpro(connection)
+    raise ValueError(f"unknown export format {export_format!r}")
+
+
+def encode_chunks(parts, chunk_size=CHUNK_SIZE):
+    """Encodes text as UTF-8, gathered into chunks of about chunk_size bytes.
+
+    Args:
+        parts: Iterable of strings.
+        chunk_size: Bytes per chunk (the last one may be smaller).
+
+    Yields:
+        bytes: The encoded text.
+    """
+    buffer = []
+    size = 0
+    for part in parts:
+        data = part.encode("utf-8")
+        buffer.append(data)
+        size += len(data)
+        if size >= chunk_size:
+            yield b"".join(buffer)
+            buffer = []
+            size = 0
+    if buffer:
+        yield b"".join(buffer)
+
+
+def gzip_chunks(chunks, level=6):
+    """Compresses a stream of bytes into a gzip stream, chunk by chunk.
+
+    Args:
+        chunks: Iterable of bytes.
+        level: zlib compression level, 1 (fastest) to 9 (smallest).
+
+    Yields:
+        bytes: The gzip stream.
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)  # wbits 31: gzip header and trailer
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def stream_export(db, export_format, compress=False):
+    """Streams a consistent dump of the catalog.
+
+    The rows are read from a connection of their own, inside one read transaction that lasts until the
+    stream is exhausted or closed, so the app keeps writing meanwhile and the dump still sees a single
+    point in time.
+
+    Args:
+        db: The database.Database to export.
+        export_format: "ndjson" or "chordpro".
+        compress: Whether to gzip the output.
+
+    Yields:
+        bytes: The export, in chunks.
+
+    Raises:
+        ValueError: If the format is unknown.
+    """
+    if export_format not in FORMATS:
+        raise ValueError(f"unknown export format {export_format!r}")
+
+    with db.snapshot() as connection:
+        chunks = encode_chunks(iter_export(connection, export_format))
+        if compress:
+            chunks = gzip_chunks(chunks)
+        yield from chunks
@@ -1,5 +1,12 @@
 from flask import redirect, session
 from functools import wraps
+import base64
+import binascii
+import hashlib
+import json
+import re
+
+from tokenizer import tokenize
 
 
 def login_required(f):
@@ -26,61 +33,117 @@ def login_required(f):
     return decorated_function
 
 
+def content_hash(content):
+    """Hashes a version's content, to tell apart different revisions of the same version.
+
+    Args:
+        content: The raw song content string.
+
+    Returns:
+        str: Hex digest of the content.
+    """
+    return hashlib.blake2b(content.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def search_expression(query):
+    """Turns a user's search terms into an FTS5 MATCH expression.
+
+    Every word must match, and the last characters of a word may be missing (prefix match), so
+    "beat yest" finds "Yesterday" by "The Beatles". Punctuation is dropped, so user input can never
+    inject FTS5 query syntax.
+
+    Args:
+        query: The search terms as typed by the user.
+
+    Returns:
+        str | None: The MATCH expression, or None if the query has no searchable words.
+    """
+    words = re.findall(r"\w+", query)
+    if not words:
+        return None
+    return " AND ".join(f'"{word}"*' for word in words)
+
+
+def encode_cursor(values):
+    """Encodes the sort key of a row into an opaque, URL-safe pagination cursor.
+
+    Args:
+        values: The row's values for the columns the listing is ordered by.
+
+    Returns:
+        str: The cursor.
+    """
+    return base64.urlsafe_b64encode(json.dumps(list(values)).encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    """Decodes a cursor made by encode_cursor.
+
+    Args:
+        cursor: The cursor from the query string.
+
+    Returns:
+        list | None: The sort key values, or None if the cursor is malformed: not a list, or holding anything
+            but strings and numbers, which are all a sort key can hold and all SQLite can be given.
+    """
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except (binascii.Error, ValueError, RecursionError):
+        return None
+    if not isinstance(values, list) or not all(type(value) in (str, int, float) for value in values):
+        return None
+    return values
+
+
+def keyset_page(rows, page_size, backwards, has_cursor, key):
+    """Trims a keyset query's rows to one page and works out the cursors around it.
+
+    The query must fetch page_size + 1 rows, the extra one only telling whether there's more to come.
+    Queries for the previous page run in reverse order; their rows are put back in display order here.
+
+    Args:
+        rows: The rows fetched by the query.
+        page_size: Number of rows per page.
+        backwards: Whether the query fetched the rows before a cursor, in reverse order.
+        has_cursor: Whether the query started from a cursor (i.e. this isn't the first page).
+        key: Function returning the sort key values of a row.
+
+    Returns:
+        tuple[list, str | None, str | None]: The page's rows, and the cursors for the next and previous pages
+            (None if there's no such page).
+    """
+    more = len(rows) > page_size
+    rows = rows[:page_size]
+    if backwards:
+        rows.reverse()
+        has_next, has_prev = True, more
+    else:
+        has_next, has_prev = more, has_cursor
+
+    if not rows:
+        return rows, None, None
+    next_cursor = encode_cursor(key(rows[-1])) if has_next else None
+    prev_cursor = encode_cursor(key(rows[0])) if has_prev else None
+    return rows, next_cursor, prev_cursor
+
 
 def parse_content(content):
     """Parses chord notations from the given content string.
 
     Processes the input to extract chords (in brackets), lyrics, spaces, and line breaks,
-    returning a structured list for rendering.
+    returning a structured list for rendering. See tokenizer.iter_tokens for the lazy version.
 
     Args:
         content: The raw song content string with chords and lyrics.
 
     Returns:
-        list[dict[str, str]]: A list of dictionaries, each with 'type' ('chord', 'lyric', 'spaces', 'line-break')
-            and 'value' keys.
+        list[Token]: A list of (type, value) tokens, where type is 'chord', 'lyric', 'spaces' or 'line-break'.
+            Tokens expose `.type` and `.value` so templates can render them directly.
 
     Examples:
         >>> parse_content("[C]Hello world\\n")
-        [{'type': 'spaces', 'value': ' '}, {'type': 'chord', 'value': 'C'}, {'type': 'spaces', 'value': ' '},
-         {'type': 'lyric', 'value': 'Hello world'}, {'type': 'line-break', 'value': '\\n'}]
+        [Token(type='spaces', value=' '), Token(type='chord', value='C'), Token(type='spaces', value=' '),
+         Token(type='lyric', value='Hello'), Token(type='spaces', value=' '), Token(type='lyric', value='world'),
+         Token(type='line-break', value='\\n')]
     """
-
-    # Data structure: 
-    # List of dictionaries with 'type' and 'value' keys; types: 'chord', 'lyric', 'spaces' and 'line-break'. All values are strings. 
-
-    parsed_song = []
-    cursor = 0
-    while cursor < len(content):
-        if content[cursor] == " ":
-            # Count consecutive spaces
-            space_count = 0
-            while cursor < len(content) and content[cursor] == " ":
-                space_count += 1
-                cursor += 1
-            parsed_song.append({"type": "spaces", "value": " " * space_count})
-        elif content[cursor] == "[":
-            # Extract chord
-            chord = ""
-            cursor += 1  # Skip opening bracket
-            while cursor < len(content) and content[cursor] != "]":
-                chord += content[cursor]
-                cursor += 1
-            parsed_song.append({"type": "spaces", "value": " "})
-            parsed_song.append({"type": "chord", "value": chord})
-            parsed_song.append({"type": "spaces", "value": " "})
-            if cursor < len(content):  # Skip closing bracket if it exists
-                cursor += 1
-        elif content[cursor] == "\n":
-            parsed_song.append({"type": "line-break", "value": "\n"})
-            cursor += 1
-        else:
-            # Extract lyric
-            lyric = ""
-            while cursor < len(content) and content[cursor] not in [" ", "[", "]", "\n"]:
-                lyric += content[cursor]
-                cursor += 1
-            parsed_song.append({"type": "lyric", "value": lyric})
-
-    return parsed_song
-
+    return tokenize(content)
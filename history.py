@@ -0,0 +1,216 @@
+# Edit history of versions
+# - every saved content of a version is kept as a revision, most of them as a line-based delta against a parent
+# - a version's first revision is diffed against the song's other versions, so forks of a chart cost only their changes
+# - a full snapshot is stored at least every SNAPSHOT_INTERVAL revisions, so rebuilding any revision applies a bounded
+#   number of deltas
+import difflib
+import json
+import zlib
+
+# Most deltas between a revision and the snapshot it is ultimately based on
+SNAPSHOT_INTERVAL = 10
+
+# Latest revisions of a song's other versions tried as the parent of a new version's first revision
+FORK_CANDIDATES = 5
+
+
+def _compress(text):
+    return zlib.compress(text.encode("utf-8"), 9)
+
+
+def _decompress(data):
+    return zlib.decompress(data).decode("utf-8")
+
+
+def make_delta(parent, content):
+    """Encodes content as line-level edits of its parent.
+
+    The delta is a list of operations: [start, count] copies count lines of the parent from line start,
+    and a string inserts those lines as is. Lines keep their line endings, so the result is exact.
+
+    Args:
+        parent: The content the delta is based on.
+        content: The content to encode.
+
+    Returns:
+        bytes: The compressed delta, readable by apply_delta.
+    """
+    parent_lines = parent.splitlines(keepends=True)
+    lines = content.splitlines(keepends=True)
+    operations = []
+    matcher = difflib.SequenceMatcher(None, parent_lines, lines, autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == "equal":
+            operations.append([i1, i2 - i1])
+        elif tag in ("replace", "insert"):
+            operations.append("".join(lines[j1:j2]))
+    return _compress(json.dumps(operations, ensure_ascii=False, separators=(",", ":")))
+
+
+def apply_delta(parent, delta):
+    """Rebuilds content from its parent and a delta written by make_delta.
+
+    Args:
+        parent: The content the delta is based on.
+        delta: The compressed delta.
+
+    Returns:
+        str: The content.
+    """
+    parent_lines = parent.splitlines(keepends=True)
+    parts = []
+    for operation in json.loads(_decompress(delta)):
+        if isinstance(operation, str):
+            parts.append(operation)
+        else:
+            start, count = operation
+            parts.extend(parent_lines[start:start + count])
+    return "".join(parts)
+
+
+def load_revision(connection, revision_id):
+    """Rebuilds the content of a revision.
+
+    Walks up to the nearest snapshot and applies the deltas back down, at most SNAPSHOT_INTERVAL of them.
+
+    Args:
+        connection: An open sqlite3 connection.
+        revision_id: The revision's id.
+
+    Returns:
+        str: The revision's content.
+    """
+    chain = []
+    while True:
+        parent_id, data = connection.execute("SELECT parent_id, data FROM revisions WHERE id = ?", (revision_id,)).fetchone()
+        if parent_id is None:
+            content = _decompress(data)
+            break
+        chain.append(data)
+        revision_id = parent_id
+    for delta in reversed(chain):
+        content = apply_delta(content, delta)
+    return content
+
+
+def _encode(connection, content, candidates):
+    # The smallest delta against any candidate parent, or a snapshot if no delta beats it.
+    # Candidates are (revision id, depth, content or None to load it).
+    best = (None, 0, _compress(content))
+    for parent_id, depth, parent_content in candidates:
+        if depth + 1 > SNAPSHOT_INTERVAL:
+            continue
+        if parent_content is None:
+            parent_content = load_revision(connection, parent_id)
+        delta = make_delta(parent_content, content)
+        if len(delta) < len(best[2]):
+            best = (parent_id, depth + 1, delta)
+    return best
+
+
+def record_revision(connection, version_id, content, author_id, previous=None):
+    """Adds a revision to a version's history, unless the content didn't change.
+
+    Versions saved before history was kept have no revisions yet: their previous content, if given, is
+    recorded first, so the edit can be undone.
+
+    Args:
+        connection: An open sqlite3 connection, inside the transaction that saves the content.
+        version_id: The ID of the version.
+        content: The version's new content.
+        author_id: The ID of the user who saved it.
+        previous: The version's content before this save, if it was edited. The latest revision always
+            holds the version's content, so this also spares rebuilding it to diff against.
+
+    Returns:
+        int | None: The new revision's number, or None if the content didn't change.
+    """
+    if previous == content:
+        return None
+    latest = connection.execute(
+        "SELECT id, revision_number, depth FROM revisions WHERE version_id = ? ORDER BY revision_number DESC LIMIT 1", (version_id,)
+    ).fetchone()
+    if latest is None and previous is not None:
+        creator_id, created_at = connection.execute("SELECT creator_id, created_at FROM versions WHERE id = ?", (version_id,)).fetchone()
+        latest = _insert(connection, version_id, 1, previous, creator_id, created_at, _candidates(connection, version_id))
+
+    if latest is None:
+        return _insert(connection, version_id, 1, content, author_id, None, _candidates(connection, version_id))[1]
+    if previous is None and load_revision(connection, latest[0]) == content:
+        return None
+    return _insert(connection, version_id, latest[1] + 1, content, author_id, None, [(latest[0], latest[2], previous)])[1]
+
+
+def _candidates(connection, version_id):
+    # The latest revision of each of the song's other recently edited versions. A version's latest
+    # revision holds its current content, so that doesn't need rebuilding from the deltas.
+    return connection.execute("""
+        SELECT revisions.id, revisions.depth, versions.content FROM revisions
+        JOIN versions ON revisions.version_id = versions.id
+        WHERE versions.song_id = (SELECT song_id FROM versions WHERE id = ?) AND revisions.version_id != ?
+          AND revisions.revision_number = (SELECT MAX(revision_number) FROM revisions AS latest WHERE latest.version_id = revisions.version_id)
+        ORDER BY revisions.id DESC LIMIT ?
+    """, (version_id, version_id, FORK_CANDIDATES)).fetchall()
+
+
+def _insert(connection, version_id, number, content, author_id, created_at, candidates):
+    # Returns the new revision's (id, number, depth)
+    parent_id, depth, data = _encode(connection, content, candidates)
+    return connection.execute(
+        "INSERT INTO revisions (version_id, revision_number, parent_id, depth, author_id, size, data, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, COALESCE(?, CURRENT_TIMESTAMP)) RETURNING id, revision_number, depth",
+        (version_id, number, parent_id, depth, author_id, len(content.encode("utf-8")), data, created_at),
+    ).fetchone()
+
+
+def detach_history(connection, version_id):
+    """Prepares a version's history for deletion.
+
+    Revisions of other versions that are deltas against this version's revisions are rewritten as
+    snapshots, so they don't depend on rows about to disappear. The version's own revisions are deleted
+    along with it (ON DELETE CASCADE).
+
+    Args:
+        connection: An open sqlite3 connection, inside the transaction that deletes the version.
+    """
+    dependents = connection.execute("""
+        SELECT id FROM revisions
+        WHERE version_id != ? AND parent_id IN (SELECT id FROM revisions WHERE version_id = ?)
+    """, (version_id, version_id)).fetchall()
+    for (revision_id,) in dependents:
+        content = load_revision(connection, revision_id)
+        connection.execute("UPDATE revisions SET parent_id = NULL, depth = 0, data = ? WHERE id = ?", (_compress(content), revision_id))
+        # Later deltas on top of it are now closer to a snapshot
+        _reset_depths(connection, revision_id, 0)
+
+
+def _reset_depths(connection, revision_id, depth):
+    children = connection.execute("SELECT id FROM revisions WHERE parent_id = ?", (revision_id,)).fetchall()
+    for (child_id,) in children:
+        connection.execute("UPDATE revisions SET depth = ? WHERE id = ?", (depth + 1, child_id))
+        _reset_depths(connection, child_id, depth + 1)
+
+
+def storage_report(connection):
+    """Measures how much space the history takes, against keeping every revision as a full copy.
+
+    Args:
+        connection: An open sqlite3 connection.
+
+    Returns:
+        dict: Revision, snapshot and delta counts, versions with history, the deepest delta chain, the bytes
+            the revisions would take as full copies and the bytes actually stored.
+    """
+    revisions, snapshots, versions, deepest, full_bytes, stored_bytes = connection.execute("""
+        SELECT COUNT(*), COALESCE(SUM(parent_id IS NULL), 0), COUNT(DISTINCT version_id), COALESCE(MAX(depth), 0),
+               COALESCE(SUM(size), 0), COALESCE(SUM(length(data)), 0)
+        FROM revisions
+    """).fetchone()
+    return {
+        "revisions": revisions,
+        "snapshots": snapshots,
+        "deltas": revisions - snapshots,
+        "versions": versions,
+        "deepest_chain": deepest,
+        "full_bytes": full_bytes,
+        "stored_bytes": stored_bytes,
+    }
@@ -0,0 +1,317 @@
+# Bulk import of chord charts
+# - streams ChordPro (.cho, .chordpro, .chopro, .pro) and bracket-notation (.txt, .crd) files
+#   from a directory, a .zip or a .tar(.gz) archive
+# - each batch looks up the artists, genres and songs it names in one query per table; rows are inserted
+#   with executemany in large transactions, with ids assigned up front so no row has to be read back
+# - progress is checkpointed in the same transaction as each batch, so an interrupted import resumes
+#   exactly where it stopped
+import json
+import os
+import re
+import tarfile
+import time
+import zipfile
+
+from chord_index import chart_chords
+from tokenizer import TOKENS_FORMAT, serialize_tokens, tokenize
+
+CHORDPRO_EXTENSIONS = (".cho", ".chordpro", ".chopro", ".pro")
+TEXT_EXTENSIONS = (".txt", ".crd")
+
+_DIRECTIVE_RE = re.compile(r"^\{\s*([\w-]+)\s*(?::\s*(.*?))?\s*\}$")
+_HEADER_RE = re.compile(r"^(title|artist|genre)\s*:\s*(.+)$", re.IGNORECASE)
+
+# ChordPro directives and what they become in the app's plain chart format
+_TITLE_DIRECTIVES = {"title", "t"}
+_ARTIST_DIRECTIVES = {"artist", "subtitle", "st"}
+_SECTION_LABELS = {"start_of_chorus": "Chorus:", "soc": "Chorus:", "start_of_verse": "Verse:", "sov": "Verse:", "start_of_bridge": "Bridge:", "sob": "Bridge:"}
+_COMMENT_DIRECTIVES = {"comment", "c", "comment_italic", "ci", "comment_box", "cb"}
+
+
+class Chart:
+    """A chart read from an import source, ready to be stored."""
+
+    __slots__ = ("name", "title", "artist", "genre", "content")
+
+    def __init__(self, name, title, artist, genre, content):
+        self.name = name
+        self.title = title
+        self.artist = artist
+        self.genre = genre
+        self.content = content
+
+
+def iter_sources(path):
+    """Streams the chart files of a directory or archive, in a stable order.
+
+    Args:
+        path: A directory, a .zip file or a .tar / .tar.gz / .tgz file.
+
+    Yields:
+        tuple[str, str]: Each file's name and text.
+    """
+    extensions = CHORDPRO_EXTENSIONS + TEXT_EXTENSIONS
+    if os.path.isdir(path):
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for name in sorted(files):
+                if name.lower().endswith(extensions):
+                    full = os.path.join(root, name)
+                    with open(full, encoding="utf-8", errors="replace") as f:
+                        yield os.path.relpath(full, path), f.read()
+    elif zipfile.is_zipfile(path):
+        with zipfile.ZipFile(path) as archive:
+            for info in archive.infolist():
+                if not info.is_dir() and info.filename.lower().endswith(extensions):
+                    yield info.filename, archive.read(info).decode("utf-8", errors="replace")
+    elif tarfile.is_tarfile(path):
+        # Streaming mode: members are read in archive order without loading the index first
+        with tarfile.open(path, "r|*") as archive:
+            for member in archive:
+                if member.isfile() and member.name.lower().endswith(extensions):
+                    yield member.name, archive.extractfile(member).read().decode("utf-8", errors="replace")
+    else:
+        raise ValueError(f"{path} is not a directory, .zip or .tar archive")
+
+
+def _name_metadata(name):
+    # "Artist - Title.txt" (or just "Title.txt" inside an "Artist" directory)
+    name = os.path.normpath(name)
+    stem = os.path.splitext(os.path.basename(name))[0]
+    if " - " in stem:
+        artist, title = stem.split(" - ", 1)
+        return title.strip(), artist.strip()
+    return stem.strip(), os.path.basename(os.path.dirname(name)).strip() or None
+
+
+def parse_chordpro(name, text, default_genre):
+    """Converts a ChordPro file into a chart.
+
+    Chords are already written inline in brackets, as the app expects. Title, artist and genre come
+    from their directives, section markers and comments become plain label lines, and other
+    directives are dropped.
+
+    Args:
+        name: The file's name, used for any metadata the directives don't provide.
+        text: The file's contents.
+        default_genre: Genre to use if the file has none.
+
+    Returns:
+        Chart: The chart.
+    """
+    title = artist = genre = None
+    lines = []
+    for line in text.splitlines():
+        stripped = line.strip()
+        if stripped.startswith("#"):
+            continue
+        match = _DIRECTIVE_RE.match(stripped)
+        if not match:
+            lines.append(line.rstrip())
+            continue
+
+        directive, value = match.group(1).lower(), (match.group(2) or "").strip()
+        if directive in _TITLE_DIRECTIVES:
+            title = title or value
+        elif directive in _ARTIST_DIRECTIVES:
+            artist = artist or value
+        elif directive == "genre":
+            genre = value
+        elif directive == "meta" and value.lower().startswith(("genre ", "artist ")):
+            key, _, meta_value = value.partition(" ")
+            if key.lower() == "genre":
+                genre = meta_value.strip()
+            else:
+                artist = artist or meta_value.strip()
+        elif directive in _SECTION_LABELS:
+            lines.append(_SECTION_LABELS[directive])
+        elif directive in _COMMENT_DIRECTIVES and value:
+            lines.append(value)
+        elif directive.startswith("end_of") or directive in ("eoc", "eov", "eob"):
+            lines.append("")
+
+    name_title, name_artist = _name_metadata(name)
+    return Chart(name, title or name_title, artist or name_artist, genre or default_genre, "\n".join(lines).strip("\n"))
+
+
+def parse_text(name, text, default_genre):
+    """Converts a bracket-notation text file into a chart.
+
+    Optional "Title: ...", "Artist: ..." and "Genre: ..." lines at the top provide the metadata,
+    otherwise it comes from the file name ("Artist - Title.txt").
+
+    Args:
+        name: The file's name.
+        text: The file's contents.
+        default_genre: Genre to use if the file has none.
+
+    Returns:
+        Chart: The chart.
+    """
+    metadata = {}
+    lines = text.splitlines()
+    while lines:
+        match = _HEADER_RE.match(lines[0].strip())
+        if not match:
+            break
+        metadata[match.group(1).lower()] = match.group(2).strip()
+        lines.pop(0)
+
+    name_title, name_artist = _name_metadata(name)
+    return Chart(
+        name,
+        metadata.get("title") or name_title,
+        metadata.get("artist") or name_artist,
+        metadata.get("genre") or default_genre,
+        "\n".join(line.rstrip() for line in lines).strip("\n"),
+    )
+
+
+def parse_chart(name, text, default_genre):
+    if name.lower().endswith(CHORDPRO_EXTENSIONS):
+        return parse_chordpro(name, text, default_genre)
+    return parse_text(name, text, default_genre)
+
+
+class Importer:
+    """Imports charts in batches, one transaction per batch.
+
+    Attributes:
+        imported: Charts stored so far.
+        skipped: Charts rejected (missing metadata, too long, ...), with the reason, as (name, reason).
+    """
+
+    def __init__(self, db, creator_id, limits, default_genre="Unknown", batch_size=1000, chord_index=None):
+        """Sets up an import.
+
+        Args:
+            db: The database.Database to import into.
+            creator_id: ID of the user the imported versions are credited to.
+            limits: Maximum lengths, as a dict with "title", "artist", "genre" and "content" keys.
+            default_genre: Genre for charts that don't state one.
+            batch_size: Charts per transaction.
+            chord_index: Optional chord_index.ChordIndex to add the versions to. Without it they're left for
+                `flask --app app index-chords`.
+        """
+        self.db = db
+        self.creator_id = creator_id
+        self.limits = limits
+        self.default_genre = default_genre
+        self.batch_size = batch_size
+        self.chord_index = chord_index
+        self.imported = 0
+        self.skipped = []
+
+    def _check(self, chart):
+        if not chart.title or not chart.artist:
+            return "no title or artist"
+        if not chart.content.strip():
+            return "no content"
+        for field in ("title", "artist", "genre", "content"):
+            if len(getattr(chart, field)) > self.limits[field]:
+                return f"{field} longer than {self.limits[field]} characters"
+        return None
+
+    def run(self, path, progress=None):
+        """Imports every chart of a directory or archive, resuming from its last checkpoint.
+
+        Args:
+            path: The directory or archive.
+            progress: Optional callable(imported, skipped, seconds), called after every batch.
+        """
+        source = os.path.abspath(path)
+        row = self.db.execute("SELECT processed FROM import_checkpoints WHERE source = ?", source)
+        done = row[0]["processed"] if row else 0
+
+        start = time.perf_counter()
+        batch = []
+        position = 0
+        for position, (name, text) in enumerate(iter_sources(path), 1):
+            if position <= done:
+                continue
+            chart = parse_chart(name, text, self.default_genre)
+            reason = self._check(chart)
+            if reason:
+                self.skipped.append((name, reason))
+            else:
+                batch.append(chart)
+            if len(batch) >= self.batch_size:
+                self._store(batch, source, position)
+                batch = []
+                if progress:
+                    progress(self.imported, len(self.skipped), time.perf_counter() - start)
+
+        if position > done:
+            self._store(batch, source, position)
+        if progress:
+            progress(self.imported, len(self.skipped), time.perf_counter() - start)
+
+    def _store(self, charts, source, position):
+        with self.db.transaction() as connection:
+            # Holding the write lock, so ids past the current maximum are ours to hand out
+            # (also past the AUTOINCREMENT sequence, so ids of deleted rows are never reused)
+            next_ids = {
+                table: connection.execute(
+                    f"SELECT MAX(COALESCE((SELECT MAX(id) FROM {table}), 0), COALESCE((SELECT seq FROM sqlite_sequence WHERE name = ?), 0)) + 1", (table,)
+                ).fetchone()[0]
+                for table in ("artists", "genres", "songs")
+            }
+            new_rows = {"artists": [], "genres": [], "songs": []}
+            versions = []
+
+            # Read under the write lock, not kept between batches: the app, or another import, may have added some
+            # since. artists.name isn't UNIQUE, so a name the app stored twice maps to its first row.
+            artists = dict(connection.execute(
+                "SELECT name, MIN(id) FROM artists WHERE name IN (SELECT value FROM json_each(?)) GROUP BY name",
+                (json.dumps(sorted({chart.artist for chart in charts})),),
+            ))
+            genres = dict(connection.execute(
+                "SELECT name, id FROM genres WHERE name IN (SELECT value FROM json_each(?))",
+                (json.dumps(sorted({chart.genre for chart in charts})),),
+            ))
+            songs = {
+                (title, artist_id, genre_id): song_id
+                for title, artist_id, genre_id, song_id in connection.execute(
+                    "SELECT title, artist_id, genre_id, MIN(id) FROM songs WHERE title IN (SELECT value FROM json_each(?)) GROUP BY title, artist_id, genre_id",
+                    (json.dumps(sorted({chart.title for chart in charts})),),
+                )
+            }
+
+            def get_id(table, known, key, values):
+                if key not in known:
+                    known[key] = next_ids[table]
+                    next_ids[table] += 1
+                    new_rows[table].append((known[key],) + values)
+                return known[key]
+
+            song_ids = []
+            for chart in charts:
+                artist_id = get_id("artists", artists, chart.artist, (chart.artist,))
+                genre_id = get_id("genres", genres, chart.genre, (chart.genre,))
+                song_ids.append(get_id("songs", songs, (chart.title, artist_id, genre_id), (chart.title, artist_id, genre_id)))
+
+            # Read under the write lock, not kept between batches: the app may have saved versions of these songs since
+            next_number = dict(connection.execute(
+                "SELECT song_id, MAX(version_number) + 1 FROM versions WHERE song_id IN (SELECT value FROM json_each(?)) GROUP BY song_id",
+                (json.dumps(sorted(set(song_ids))),),
+            ))
+            for chart, song_id in zip(charts, song_ids):
+                number = next_number.get(song_id, 1)
+                next_number[song_id] = number + 1
+                tokens = tokenize(chart.content)
+                chord_set_id = self.chord_index.set_id(connection, chart_chords(tokens)) if self.chord_index else None
+                versions.append((song_id, number, self.creator_id, chart.content, serialize_tokens(tokens), TOKENS_FORMAT, chord_set_id))
+
+            # Parents first, for the foreign keys
+            connection.executemany("INSERT INTO artists (id, name) VALUES (?, ?)", new_rows["artists"])
+            connection.executemany("INSERT INTO genres (id, name) VALUES (?, ?)", new_rows["genres"])
+            connection.executemany("INSERT INTO songs (id, title, artist_id, genre_id) VALUES (?, ?, ?, ?)", new_rows["songs"])
+            connection.executemany("INSERT INTO versions (song_id, version_number, creator_id, content, tokens, tokens_format, chord_set_id) VALUES (?, ?, ?, ?, ?, ?, ?)", versions)
+            connection.execute(
+                "INSERT INTO import_checkpoints (source, processed) VALUES (?, ?) ON CONFLICT (source) DO UPDATE SET processed = excluded.processed, updated_at = CURRENT_TIMESTAMP",
+                (source, position),
+            )
+        if self.chord_index:
+            # Chord sets created by this batch are found in memory by the next ones
+            self.chord_index.committed()
+        self.imported += len(charts)
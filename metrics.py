@@ -0,0 +1,203 @@
+# Request profiling for ChordApp
+# - minimal Prometheus-style metrics (counters, histograms, callback gauges) rendered in the text format
+# - instrument() hooks them into a Flask app and a database.Database: SQL timings, queries per request,
+#   template render time, request latency and a slow-query log
+import logging
+import threading
+import time
+
+from flask import g, has_request_context, request
+from flask.signals import before_render_template, template_rendered
+
+# Seconds; the usual Prometheus latency buckets, plus a finer end for fast SQL queries
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55)
+
+slow_query_log = logging.getLogger("chordapp.slow_queries")
+
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+class Counter:
+    """A monotonically increasing count, optionally split by labels."""
+
+    type = "counter"
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels[name] for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+        for key, value in sorted(values.items()):
+            yield self.name, _format_labels(self.labelnames, key), value
+
+
+class Histogram:
+    """Observations counted into cumulative buckets, optionally split by labels."""
+
+    type = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}  # label values -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels[name] for name in self.labelnames)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def samples(self):
+        with self._lock:
+            series = {key: list(values) for key, values in self._series.items()}
+        for key, values in sorted(series.items()):
+            for bound, count in zip(self.buckets, values):
+                yield f"{self.name}_bucket", _format_labels(self.labelnames, key, ("le", bound)), count
+            yield f"{self.name}_bucket", _format_labels(self.labelnames, key, ("le", "+Inf")), values[-1]
+            yield f"{self.name}_sum", _format_labels(self.labelnames, key), values[-2]
+            yield f"{self.name}_count", _format_labels(self.labelnames, key), values[-1]
+
+
+class CallbackMetric:
+    """A value read from elsewhere (e.g. a cache's counters) each time metrics are scraped."""
+
+    def __init__(self, name, help, type, callback):
+        self.name = name
+        self.help = help
+        self.type = type
+        self.callback = callback
+
+    def samples(self):
+        yield self.name, "", self.callback()
+
+
+class Registry:
+    """A set of metrics that can be rendered together."""
+
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labelnames=()):
+        return self.register(Counter(name, help, labelnames))
+
+    def histogram(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, help, labelnames, buckets))
+
+    def callback(self, name, help, type, callback):
+        return self.register(CallbackMetric(name, help, type, callback))
+
+    def render(self):
+        """Renders every metric in the Prometheus text exposition format.
+
+        Returns:
+            str: The metrics page.
+        """
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{labels} {value}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+request_latency = registry.histogram("chordapp_request_duration_seconds", "Time spent handling a request.", ["endpoint", "method"])
+request_queries = registry.histogram("chordapp_request_queries", "SQL statements run per request.", ["endpoint"], COUNT_BUCKETS)
+query_latency = registry.histogram("chordapp_query_duration_seconds", "Time spent running a SQL statement.", ["endpoint"])
+slow_queries = registry.counter("chordapp_slow_queries_total", "SQL statements slower than the slow-query threshold.", ["endpoint"])
+template_latency = registry.histogram("chordapp_template_render_seconds", "Time spent rendering a template.", ["template"])
+
+
+def _endpoint():
+    return (request.endpoint or "unmatched") if has_request_context() else "cli"
+
+
+def _short(value, limit=200):
+    text = repr(value)
+    return text if len(text) <= limit else f"{text[:limit]}... ({len(text)} chars)"
+
+
+def instrument(app, db, slow_query_ms):
+    """Hooks request, template and SQL profiling into the app and its database.
+
+    Args:
+        app: The Flask app.
+        db: The database.Database the app queries through.
+        slow_query_ms: Statements taking at least this many milliseconds are logged with their
+            parameters to the "chordapp.slow_queries" logger.
+    """
+
+    def on_query(sql, args, seconds):
+        endpoint = _endpoint()
+        query_latency.observe(seconds, endpoint=endpoint)
+        if has_request_context():
+            g.query_count = g.get("query_count", 0) + 1
+        if seconds * 1000 >= slow_query_ms:
+            slow_queries.inc(endpoint=endpoint)
+            # Never write password hashes to the logs
+            params = "<redacted>" if "password" in sql else ", ".join(_short(arg) for arg in args)
+            slow_query_log.warning("%.1f ms [%s] %s %s", seconds * 1000, endpoint, " ".join(sql.split()), params)
+
+    db.query_hook = on_query
+
+    @app.before_request
+    def start_timer():
+        g.request_start = time.perf_counter()
+        g.query_count = 0
+
+    # Teardown runs even when the view raised, so failed requests are measured too
+    @app.teardown_request
+    def record_request(exception):
+        start = g.pop("request_start", None)
+        if start is None:
+            return
+        endpoint = _endpoint()
+        request_latency.observe(time.perf_counter() - start, endpoint=endpoint, method=request.method)
+        request_queries.observe(g.get("query_count", 0), endpoint=endpoint)
+
+    def start_render(sender, template, context, **extra):
+        g.render_start = time.perf_counter()
+
+    def record_render(sender, template, context, **extra):
+        start = g.pop("render_start", None)
+        if start is not None:
+            template_latency.observe(time.perf_counter() - start, template=template.name or "string")
+
+    # Flask only keeps weak references to signal receivers, so keep these alive with the app
+    app.extensions["chordapp_metrics"] = (start_render, record_render)
+    before_render_template.connect(start_render, app)
+    template_rendered.connect(record_render, app)
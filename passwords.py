@@ -0,0 +1,206 @@
+# Password hashing for ChordApp
+# - hashing and verification run on a small process pool, so a burst of logins can't take every request thread's CPU
+# - the number of calls waiting for the pool is capped; past that, callers are turned away at once instead of queueing
+# - the hash method and its cost are configurable, and hashes made with other parameters can be detected for rehashing
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+from werkzeug.security import DEFAULT_PBKDF2_ITERATIONS, check_password_hash, generate_password_hash
+
+# werkzeug's scrypt cost when the method gives none (N, r, p); it doesn't export them
+SCRYPT_DEFAULTS = (2 ** 15, 8, 1)
+
+
+class HasherBusy(Exception):
+    """Raised when the hashing pool is saturated and the call was rejected without being queued."""
+
+
+def canonical_method(method):
+    """Spells out a werkzeug hash method with its cost parameters, as they appear at the start of its hashes.
+
+    werkzeug fills in default costs ("scrypt" becomes "scrypt:32768:8:1"); this does the same without
+    hashing anything.
+
+    Args:
+        method: The method, e.g. "scrypt", "pbkdf2:sha512" or "scrypt:16384:8:1".
+
+    Returns:
+        str: The method with every parameter.
+
+    Raises:
+        ValueError: If the method isn't one werkzeug knows.
+    """
+    name, *args = method.split(":")
+    if name == "scrypt":
+        if args and len(args) != 3:
+            raise ValueError("'scrypt' takes 3 arguments.")
+        return "scrypt:" + ":".join(str(int(value)) for value in (args or SCRYPT_DEFAULTS))
+    if name == "pbkdf2":
+        if len(args) > 2:
+            raise ValueError("'pbkdf2' takes 2 arguments.")
+        hash_name = args[0] if args else "sha256"
+        iterations = int(args[1]) if len(args) == 2 else DEFAULT_PBKDF2_ITERATIONS
+        return f"pbkdf2:{hash_name}:{iterations}"
+    raise ValueError(f"Invalid hash method '{method}'.")
+
+
+def _hash(password, method, submitted):
+    started = time.time()
+    return generate_password_hash(password, method), started - submitted, time.time() - started
+
+
+def _verify(pwhash, password, submitted):
+    started = time.time()
+    return check_password_hash(pwhash, password), started - submitted, time.time() - started
+
+
+class PasswordHasher:
+    """Hashes and verifies passwords on a bounded pool of worker processes.
+
+    Attributes:
+        method: werkzeug hash method with its cost parameters, e.g. "scrypt:32768:8:1" or "pbkdf2:sha256:600000".
+        workers: Worker processes. With 0, hashing runs in the calling thread (the queue limit still applies).
+        max_pending: Most calls queued or running at once; more are rejected with HasherBusy.
+        timeout: Seconds a caller waits for its result before giving up with HasherBusy.
+        rejected: Number of calls rejected because the pool was saturated or too slow.
+        timing_hook: Optional callable(operation, queue_seconds, hash_seconds), called after every hash or
+            verification, for metrics. operation is "hash" or "verify".
+    """
+
+    def __init__(self, method="scrypt", workers=1, max_pending=8, timeout=5.0):
+        self.method = method
+        self.workers = workers
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self.rejected = 0
+        self.timing_hook = None
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._pending = 0
+        self._pool = None
+        self._pid = None
+        self._canonical_method = canonical_method(method)
+        self._lock = threading.Lock()
+
+    def hash(self, password):
+        """Hashes a password with the configured method.
+
+        Args:
+            password: The plain-text password.
+
+        Returns:
+            str: The hash, in werkzeug's "method$salt$hash" format.
+
+        Raises:
+            HasherBusy: If the pool is saturated.
+        """
+        return self._run("hash", _hash, password, self.method)
+
+    def verify(self, pwhash, password):
+        """Checks a password against a stored hash.
+
+        Args:
+            pwhash: The stored hash.
+            password: The plain-text password to check.
+
+        Returns:
+            bool: Whether the password matches.
+
+        Raises:
+            HasherBusy: If the pool is saturated.
+        """
+        return self._run("verify", _verify, pwhash, password)
+
+    def needs_rehash(self, pwhash):
+        """Tells whether a stored hash was made with other parameters than the configured ones.
+
+        Args:
+            pwhash: The stored hash.
+
+        Returns:
+            bool: True if the password should be hashed again (e.g. right after a successful login).
+        """
+        return pwhash.split("$", 1)[0] != self._canonical_method
+
+    def pending(self):
+        """Returns the number of calls queued or running."""
+        return self._pending
+
+    def close(self):
+        """Shuts the worker processes down."""
+        with self._lock:
+            pool = self._pool if self._pid == os.getpid() else None
+            self._pool = None
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    def _run(self, operation, function, *args):
+        if not self._slots.acquire(blocking=False):
+            raise self._reject(f"{self.max_pending} password checks already pending")
+        with self._lock:
+            self._pending += 1
+
+        if not self.workers:
+            try:
+                result, queue_seconds, hash_seconds = function(*args, time.time())
+            finally:
+                self._release()
+        else:
+            pool = self._executor()
+            try:
+                future = pool.submit(function, *args, time.time())
+            except BrokenProcessPool:
+                self._release()
+                self._discard(pool)
+                raise self._reject("hashing pool is broken, restarting it") from None
+            except BaseException:
+                self._release()
+                raise
+            # The slot is freed when the work is done, even if the caller stopped waiting for it
+            future.add_done_callback(lambda _: self._release())
+            try:
+                result, queue_seconds, hash_seconds = future.result(timeout=self.timeout)
+            except FutureTimeoutError:
+                future.cancel()
+                raise self._reject(f"no result within {self.timeout}s") from None
+            except BrokenProcessPool:
+                # A worker died (crashed, killed for memory, couldn't start): the next call gets a new pool
+                self._discard(pool)
+                raise self._reject("a hashing worker died, restarting the pool") from None
+
+        if self.timing_hook is not None:
+            self.timing_hook(operation, max(queue_seconds, 0), hash_seconds)
+        return result
+
+    def _reject(self, reason):
+        # Counted under the lock: rejections come from many request threads at once
+        with self._lock:
+            self.rejected += 1
+        return HasherBusy(reason)
+
+    def _release(self):
+        with self._lock:
+            self._pending -= 1
+        self._slots.release()
+
+    def _discard(self, pool):
+        with self._lock:
+            if self._pool is pool:
+                self._pool = None
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    def _executor(self):
+        # Created on first use rather than at import, so each forked server worker gets its own pool
+        if self._pool is not None and self._pid == os.getpid():
+            return self._pool
+        with self._lock:
+            if self._pool is None or self._pid != os.getpid():
+                # Fresh interpreters rather than forks of a process that may be running threads
+                method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+                self._pool = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context(method))
+                self._pid = os.getpid()
+            return self._pool
@@ -0,0 +1,375 @@
+# Schema migrations for ChordApp
+# - brings an existing chordapp.db up to date with the columns, tables and indexes the app expects
+# - migrations are numbered, and PRAGMA user_version records the last one a database has had
+# - each migration runs in one transaction with the version bump, so a failed one leaves nothing half done
+# - migrations 1 to 6 are idempotent: databases from before the numbering already have some of them
+import sqlite3
+import time
+
+# Full-text indexes behind /search: songs_fts has one row per song (rowid = songs.id) with its title, artist
+# and genre names; versions_fts indexes each version's content in place (rowid = versions.id), so saving a
+# version only indexes that version.
+_SEARCH_INDEXES = """
+CREATE VIRTUAL TABLE songs_fts USING fts5(title, artist, genre, tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3');
+CREATE VIRTUAL TABLE versions_fts USING fts5(content, content = 'versions', content_rowid = 'id', tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3');
+"""
+
+# Keep songs_fts and versions_fts in sync with the tables they're built from. versions_fts stores no text of
+# its own: entries are removed by handing FTS5 the content they were indexed from.
+_SEARCH_TRIGGERS = """
+CREATE TRIGGER IF NOT EXISTS songs_fts_insert AFTER INSERT ON songs BEGIN
+    INSERT INTO songs_fts (rowid, title, artist, genre)
+    VALUES (NEW.id, NEW.title, (SELECT name FROM artists WHERE id = NEW.artist_id), (SELECT name FROM genres WHERE id = NEW.genre_id));
+END;
+
+CREATE TRIGGER IF NOT EXISTS songs_fts_update AFTER UPDATE OF title, artist_id, genre_id ON songs BEGIN
+    UPDATE songs_fts SET title = NEW.title, artist = (SELECT name FROM artists WHERE id = NEW.artist_id), genre = (SELECT name FROM genres WHERE id = NEW.genre_id)
+    WHERE rowid = NEW.id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS songs_fts_delete AFTER DELETE ON songs BEGIN
+    DELETE FROM songs_fts WHERE rowid = OLD.id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS versions_fts_insert AFTER INSERT ON versions BEGIN
+    INSERT INTO versions_fts (rowid, content) VALUES (NEW.id, NEW.content);
+END;
+
+CREATE TRIGGER IF NOT EXISTS versions_fts_update AFTER UPDATE OF content ON versions BEGIN
+    INSERT INTO versions_fts (versions_fts, rowid, content) VALUES ('delete', OLD.id, OLD.content);
+    INSERT INTO versions_fts (rowid, content) VALUES (NEW.id, NEW.content);
+END;
+
+CREATE TRIGGER IF NOT EXISTS versions_fts_delete AFTER DELETE ON versions BEGIN
+    INSERT INTO versions_fts (versions_fts, rowid, content) VALUES ('delete', OLD.id, OLD.content);
+END;
+"""
+
+# Migration 3's search index, as released: the lyrics of all of a song's versions in the song's row, rebuilt
+# by trigger on every version write. Migration 9 replaces it with the indexes above.
+_SEARCH_INDEX_V3 = """
+CREATE VIRTUAL TABLE songs_fts USING fts5(title, artist, genre, lyrics, tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')
+"""
+
+_SEARCH_TRIGGERS_V3 = """
+CREATE TRIGGER IF NOT EXISTS songs_fts_insert AFTER INSERT ON songs BEGIN
+    INSERT INTO songs_fts (rowid, title, artist, genre, lyrics)
+    VALUES (NEW.id, NEW.title, (SELECT name FROM artists WHERE id = NEW.artist_id), (SELECT name FROM genres WHERE id = NEW.genre_id), '');
+END;
+
+CREATE TRIGGER IF NOT EXISTS songs_fts_update AFTER UPDATE OF title, artist_id, genre_id ON songs BEGIN
+    UPDATE songs_fts SET title = NEW.title, artist = (SELECT name FROM artists WHERE id = NEW.artist_id), genre = (SELECT name FROM genres WHERE id = NEW.genre_id)
+    WHERE rowid = NEW.id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS songs_fts_delete AFTER DELETE ON songs BEGIN
+    DELETE FROM songs_fts WHERE rowid = OLD.id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS songs_fts_version_insert AFTER INSERT ON versions BEGIN
+    UPDATE songs_fts SET lyrics = (SELECT group_concat(content, char(10)) FROM versions WHERE song_id = NEW.song_id) WHERE rowid = NEW.song_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS songs_fts_version_update AFTER UPDATE OF content ON versions BEGIN
+    UPDATE songs_fts SET lyrics = (SELECT group_concat(content, char(10)) FROM versions WHERE song_id = NEW.song_id) WHERE rowid = NEW.song_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS songs_fts_version_delete AFTER DELETE ON versions BEGIN
+    UPDATE songs_fts SET lyrics = COALESCE((SELECT group_concat(content, char(10)) FROM versions WHERE song_id = OLD.song_id), '') WHERE rowid = OLD.song_id;
+END;
+"""
+
+# Keep each version's rating aggregates in step with its ratings, in the same statement that changes them
+_RATING_TRIGGERS = """
+CREATE TRIGGER IF NOT EXISTS ratings_aggregate_insert AFTER INSERT ON ratings BEGIN
+    UPDATE versions SET rating_count = rating_count + 1, rating_sum = rating_sum + NEW.rating,
+                        rating_avg = CAST(rating_sum + NEW.rating AS REAL) / (rating_count + 1)
+    WHERE id = NEW.version_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS ratings_aggregate_update AFTER UPDATE OF rating ON ratings BEGIN
+    UPDATE versions SET rating_sum = rating_sum - OLD.rating + NEW.rating,
+                        rating_avg = CAST(rating_sum - OLD.rating + NEW.rating AS REAL) / rating_count
+    WHERE id = NEW.version_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS ratings_aggregate_delete AFTER DELETE ON ratings BEGIN
+    UPDATE versions SET rating_count = rating_count - 1, rating_sum = rating_sum - OLD.rating,
+                        rating_avg = CAST(rating_sum - OLD.rating AS REAL) / NULLIF(rating_count - 1, 0)
+    WHERE id = OLD.version_id;
+END;
+"""
+
+
+def _columns(connection, table):
+    return {row[1] for row in connection.execute(f"PRAGMA table_info({table})")}
+
+
+def _execute_script(connection, script):
+    # Statement by statement: executescript() would commit the migration's transaction first
+    statement = ""
+    for line in script.splitlines(keepends=True):
+        statement += line
+        if sqlite3.complete_statement(statement):
+            connection.execute(statement)
+            statement = ""
+
+
+def install_triggers(connection):
+    """Creates the triggers that keep the rating aggregates and the search index in sync, if missing.
+
+    Bulk loads drop them to go faster, and call this once the derived data has been rebuilt.
+
+    Args:
+        connection: An open sqlite3 connection. The caller commits, or runs this inside a transaction.
+    """
+    _execute_script(connection, _RATING_TRIGGERS)
+    _execute_script(connection, _SEARCH_TRIGGERS)
+
+
+def _add_tokens(connection):
+    # Pre-tokenized chart, written by save_version so reads don't need to parse the content
+    versions = _columns(connection, "versions")
+    if "tokens" not in versions:
+        connection.execute("ALTER TABLE versions ADD COLUMN tokens BLOB")
+    if "tokens_format" not in versions:
+        connection.execute("ALTER TABLE versions ADD COLUMN tokens_format INTEGER")
+
+
+def _add_rating_aggregates(connection):
+    # Rating aggregates, so version lists and pages don't need to AVG() over the ratings table
+    if "rating_count" not in _columns(connection, "versions"):
+        connection.execute("ALTER TABLE versions ADD COLUMN rating_count INTEGER NOT NULL DEFAULT 0")
+        connection.execute("ALTER TABLE versions ADD COLUMN rating_sum INTEGER NOT NULL DEFAULT 0")
+        connection.execute("ALTER TABLE versions ADD COLUMN rating_avg REAL")
+        reconcile_rating_aggregates(connection)
+    _execute_script(connection, _RATING_TRIGGERS)
+    connection.execute("CREATE INDEX IF NOT EXISTS idx_versions_song_rating ON versions(song_id, rating_avg)")
+
+
+def _add_search_index(connection):
+    if not connection.execute("SELECT 1 FROM sqlite_master WHERE name = 'songs_fts'").fetchone():
+        connection.execute(_SEARCH_INDEX_V3)
+        connection.execute("""
+            INSERT INTO songs_fts (rowid, title, artist, genre, lyrics)
+            SELECT songs.id, songs.title, artists.name, genres.name,
+                   COALESCE((SELECT group_concat(content, char(10)) FROM versions WHERE versions.song_id = songs.id), '')
+            FROM songs
+            JOIN artists ON songs.artist_id = artists.id
+            JOIN genres ON songs.genre_id = genres.id
+        """)
+    _execute_script(connection, _SEARCH_TRIGGERS_V3)
+
+
+def _add_import_checkpoints(connection):
+    # How far each bulk import source got, so an interrupted import can resume
+    connection.execute("CREATE TABLE IF NOT EXISTS import_checkpoints (source TEXT PRIMARY KEY NOT NULL, processed INTEGER NOT NULL, updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)")
+
+
+def _add_revisions(connection):
+    # Edit history of versions (see history.py). parent_id is the revision a delta applies to, NULL for a snapshot;
+    # depth counts the deltas between a revision and its snapshot.
+    connection.execute("""
+        CREATE TABLE IF NOT EXISTS revisions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL,
+            version_id INTEGER NOT NULL REFERENCES versions(id) ON DELETE CASCADE,
+            revision_number INTEGER NOT NULL,
+            parent_id INTEGER REFERENCES revisions(id),
+            depth INTEGER NOT NULL,
+            author_id INTEGER NOT NULL REFERENCES users(id),
+            size INTEGER NOT NULL,
+            data BLOB NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            UNIQUE (version_id, revision_number)
+        )
+    """)
+    connection.execute("CREATE INDEX IF NOT EXISTS idx_revisions_parent ON revisions(parent_id)")
+
+
+def _add_songs_title_index(connection):
+    # Keyset pagination of /songs walks songs in (title, id) order; the rowid is part of every index key
+    connection.execute("CREATE INDEX IF NOT EXISTS idx_songs_title ON songs(title)")
+
+
+def _add_covering_indexes(connection):
+    # Artists are looked up by name when a song is added; the name was unindexed
+    connection.execute("CREATE INDEX IF NOT EXISTS idx_artists_name ON artists(name)")
+    # /songs reads artist and genre ids straight from the index it walks, and add_song's duplicate check
+    # never leaves it. id is spelled out so it stays second: after genre_id, (title, id) order would need a sort.
+    # Replaces idx_songs_title, a prefix of it.
+    connection.execute("CREATE INDEX IF NOT EXISTS idx_songs_title_listing ON songs(title, id, artist_id, genre_id)")
+    connection.execute("DROP INDEX IF EXISTS idx_songs_title")
+    # A song's version list is answered from the index alone. The listed columns come after content in
+    # the row, so reading them from the table means stepping over each chart (and its overflow pages).
+    connection.execute("CREATE INDEX IF NOT EXISTS idx_versions_song_listing ON versions(song_id, rating_avg, version_number, creator_id, rating_count, created_at)")
+    connection.execute("DROP INDEX IF EXISTS idx_versions_song_rating")
+
+
+def _add_chord_index(connection):
+    # See chord_index.py. Versions are linked to their chord set by `flask --app app index-chords`.
+    _execute_script(connection, """
+        CREATE TABLE IF NOT EXISTS chords (
+            id INTEGER PRIMARY KEY,
+            symbol TEXT NOT NULL UNIQUE
+        );
+        CREATE TABLE IF NOT EXISTS chord_sets (
+            id INTEGER PRIMARY KEY,
+            bits BLOB NOT NULL UNIQUE,
+            size INTEGER NOT NULL
+        );
+    """)
+    if "chord_set_id" not in _columns(connection, "versions"):
+        connection.execute("ALTER TABLE versions ADD COLUMN chord_set_id INTEGER REFERENCES chord_sets(id)")
+    # A search ranks the versions of the matching sets by rating without reading them
+    connection.execute("CREATE INDEX IF NOT EXISTS idx_versions_chord_set ON versions(chord_set_id, rating_avg)")
+
+
+def _add_lyrics_index(connection):
+    # Migration 3's triggers rebuilt the lyrics of the whole song on every version write, holding the write
+    # lock for as long as it took to re-index all of the song's versions
+    for trigger in ("songs_fts_insert", "songs_fts_update", "songs_fts_delete", "songs_fts_version_insert", "songs_fts_version_update", "songs_fts_version_delete"):
+        connection.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+    connection.execute("DROP TABLE IF EXISTS songs_fts")
+    connection.execute("DROP TABLE IF EXISTS versions_fts")
+    _execute_script(connection, _SEARCH_INDEXES)
+    rebuild_search_index(connection)
+    _execute_script(connection, _SEARCH_TRIGGERS)
+
+
+# (number, description, function), in the order they are applied. Never renumber or edit a released one;
+# add a new migration instead.
+MIGRATIONS = (
+    (1, "tokenized charts on versions", _add_tokens),
+    (2, "rating aggregates on versions", _add_rating_aggregates),
+    (3, "full-text search index", _add_search_index),
+    (4, "import checkpoints", _add_import_checkpoints),
+    (5, "revision history", _add_revisions),
+    (6, "songs title index", _add_songs_title_index),
+    (7, "covering indexes for artists, song listing and version listing", _add_covering_indexes),
+    (8, "chord index", _add_chord_index),
+    (9, "per-version lyrics index", _add_lyrics_index),
+)
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def schema_version(connection):
+    """Returns the number of the last migration applied to a database (0 for none).
+
+    Args:
+        connection: An open sqlite3 connection.
+    """
+    return connection.execute("PRAGMA user_version").fetchone()[0]
+
+
+def pending_migrations(connection):
+    """Lists the migrations a database hasn't had yet.
+
+    Args:
+        connection: An open sqlite3 connection.
+
+    Returns:
+        list[tuple[int, str]]: Number and description of each, in the order they would be applied.
+    """
+    current = schema_version(connection)
+    return [(number, description) for number, description, _ in MIGRATIONS if number > current]
+
+
+def migrate(db_path, target=None, log=None):
+    """Applies the pending migrations to a database.
+
+    Safe to run from several processes at once (e.g. server workers starting together): each migration
+    takes the write lock and checks again that it's still pending.
+
+    Args:
+        db_path: Path to the SQLite database file.
+        target: Number of the last migration to apply; all of them by default.
+        log: Optional callable(number, description, seconds), called after each migration applied.
+
+    Returns:
+        list[tuple[int, str]]: Number and description of the migrations applied.
+
+    Raises:
+        RuntimeError: If the database has had migrations this code doesn't know about.
+    """
+    target = LATEST_VERSION if target is None else target
+    connection = sqlite3.connect(db_path, isolation_level=None)
+    applied = []
+    try:
+        if schema_version(connection) > LATEST_VERSION:
+            raise RuntimeError(f"{db_path} is at schema version {schema_version(connection)}, newer than this code ({LATEST_VERSION})")
+        for number, description, function in MIGRATIONS:
+            if number > target:
+                break
+            if number <= schema_version(connection):
+                continue
+            start = time.perf_counter()
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                if number <= schema_version(connection):
+                    # Another process got there first
+                    connection.execute("ROLLBACK")
+                    continue
+                function(connection)
+                connection.execute(f"PRAGMA user_version = {int(number)}")
+                connection.execute("COMMIT")
+            except BaseException:
+                if connection.in_transaction:
+                    connection.execute("ROLLBACK")
+                raise
+            applied.append((number, description))
+            if log is not None:
+                log(number, description, time.perf_counter() - start)
+        if applied:
+            # Fresh statistics, so the query planner knows about the new indexes
+            connection.execute("PRAGMA optimize")
+    finally:
+        connection.close()
+    return applied
+
+
+def rebuild_search_index(connection):
+    """Refills the full-text search indexes from the songs, artists, genres and versions tables.
+
+    Args:
+        connection: An open sqlite3 connection. The caller commits, or runs this inside a transaction.
+    """
+    connection.execute("DELETE FROM songs_fts")
+    connection.execute("""
+        INSERT INTO songs_fts (rowid, title, artist, genre)
+        SELECT songs.id, songs.title, artists.name, genres.name
+        FROM songs
+        JOIN artists ON songs.artist_id = artists.id
+        JOIN genres ON songs.genre_id = genres.id
+    """)
+    connection.execute("INSERT INTO songs_fts (songs_fts) VALUES ('optimize')")
+    # Reads every version's content back from the versions table
+    connection.execute("INSERT INTO versions_fts (versions_fts) VALUES ('rebuild')")
+    connection.execute("INSERT INTO versions_fts (versions_fts) VALUES ('optimize')")
+
+
+def reconcile_rating_aggregates(connection):
+    """Recomputes every version's rating count, sum and average from the ratings table.
+
+    Args:
+        connection: An open sqlite3 connection. The caller commits, or runs this inside a transaction.
+
+    Returns:
+        int: Number of versions whose aggregates were out of date.
+    """
+    # Keyed by version_id, so each version's lookup below is a primary key search
+    connection.execute("CREATE TEMP TABLE rating_totals (version_id INTEGER PRIMARY KEY, count INTEGER, total INTEGER)")
+    connection.execute("INSERT INTO rating_totals SELECT version_id, COUNT(*), SUM(rating) FROM ratings GROUP BY version_id")
+    try:
+        drifted = connection.execute("""
+            UPDATE versions
+            SET rating_count = COALESCE((SELECT count FROM rating_totals WHERE version_id = versions.id), 0),
+                rating_sum = COALESCE((SELECT total FROM rating_totals WHERE version_id = versions.id), 0),
+                rating_avg = (SELECT CAST(total AS REAL) / count FROM rating_totals WHERE version_id = versions.id)
+            WHERE rating_count IS NOT COALESCE((SELECT count FROM rating_totals WHERE version_id = versions.id), 0)
+               OR rating_sum IS NOT COALESCE((SELECT total FROM rating_totals WHERE version_id = versions.id), 0)
+               OR rating_avg IS NOT (SELECT CAST(total AS REAL) / count FROM rating_totals WHERE version_id = versions.id)
+        """).rowcount
+    finally:
+        connection.execute("DROP TABLE temp.rating_totals")
+    return drifted
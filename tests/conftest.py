@@ -0,0 +1,65 @@
+# Shared fixtures for the test suite
+# - app.py reads DB_PATH when it's imported, so every test that sends requests shares one generated database
+# - logins hash in the test's own thread: no worker processes
+import os
+
+import pytest
+
+from benchmarks.dataset import PASSWORD, generate
+from schema import migrate
+
+# Large enough for the planner's statistics to favor the indexes the way they do on a real catalog
+SONGS = 2_000
+VERSIONS = 10_000
+RATINGS = 20_000
+USERS = 50
+
+
+@pytest.fixture(scope="session")
+def catalog(tmp_path_factory):
+    """Generates the database the app is tested against, and points DB_PATH at it.
+
+    Returns:
+        str: Path to the database.
+    """
+    path = str(tmp_path_factory.mktemp("catalog") / "catalog.db")
+    generate(path, songs=SONGS, versions=VERSIONS, ratings=RATINGS, users=USERS, log=lambda message: None)
+    migrate(path)
+    os.environ["DB_PATH"] = path
+    os.environ.setdefault("PASSWORD_HASH_WORKERS", "0")
+    return path
+
+
+@pytest.fixture(scope="session")
+def chordapp(catalog):
+    """Imports the app against the generated database.
+
+    Returns:
+        module: The app module, for its app, db and caches.
+    """
+    import app
+
+    assert app.DB_PATH == catalog, "app.py was imported before the test database was generated"
+    return app
+
+
+@pytest.fixture(scope="session")
+def login(chordapp):
+    """Logs test clients in as generated users.
+
+    Returns:
+        Callable[[str], FlaskClient]: Takes a username ("bench0" by default) and returns a client logged in as it.
+    """
+    def login(username="bench0"):
+        client = chordapp.app.test_client()
+        response = client.post("/login", data={"username": username, "password": PASSWORD})
+        assert response.status_code == 302, f"login as {username} answered {response.status_code}"
+        return client
+
+    return login
+
+
+@pytest.fixture(scope="module")
+def client(login):
+    """A test client logged in as bench0, shared by the module's tests."""
+    return login()
@@ -0,0 +1,75 @@
+# JSON API tests
+# - versions answer 200 with a strong ETag, then 304 to a client sending it back, for each compression
+# - the ETag changes with the transposition and with the tokenizer or transposition rules
+# - a ?limit= out of range, or not a number, is answered with 400 by every route taking one
+import gzip
+import json
+
+import pytest
+
+@pytest.fixture(scope="module")
+def version_path(chordapp):
+    version_id = chordapp.db.execute("SELECT id FROM versions ORDER BY id LIMIT 1")[0]["id"]
+    return f"/api/versions/{version_id}"
+
+
+def test_version_revalidates(client, version_path):
+    first = client.get(version_path)
+    assert first.status_code == 200
+    assert first.headers.get("Content-Encoding") is None
+    etag = first.headers["ETag"]
+    assert json.loads(first.data)["tokens"]
+
+    cached = client.get(version_path, headers={"If-None-Match": etag})
+    assert cached.status_code == 304
+    assert cached.data == b""
+    assert cached.headers["ETag"] == etag
+
+
+def test_gzip_has_its_own_etag(client, version_path):
+    plain = client.get(version_path)
+    compressed = client.get(version_path, headers={"Accept-Encoding": "gzip"})
+    assert compressed.status_code == 200
+    assert compressed.headers["Content-Encoding"] == "gzip"
+    assert json.loads(gzip.decompress(compressed.data)) == json.loads(plain.data)
+    etag = compressed.headers["ETag"]
+    assert etag != plain.headers["ETag"]
+
+    assert client.get(version_path, headers={"Accept-Encoding": "gzip", "If-None-Match": etag}).status_code == 304
+    # The uncompressed body isn't the one the client holds
+    assert client.get(version_path, headers={"If-None-Match": etag}).status_code == 200
+
+
+def test_transposition_has_its_own_etag(client, version_path):
+    etag = client.get(version_path).headers["ETag"]
+    transposed = client.get(f"{version_path}?transpose=2")
+    assert transposed.headers["ETag"] != etag
+    assert client.get(f"{version_path}?transpose=2", headers={"If-None-Match": etag}).status_code == 200
+    assert client.get(f"{version_path}?transpose=2", headers={"If-None-Match": transposed.headers["ETag"]}).status_code == 304
+
+
+def test_new_render_version_changes_etag(client, version_path, chordapp, monkeypatch):
+    etag = client.get(f"{version_path}?transpose=2").headers["ETag"]
+    monkeypatch.setattr(chordapp, "RENDER_VERSION", f"{chordapp.RENDER_VERSION}.next")
+    response = client.get(f"{version_path}?transpose=2", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+
+
+@pytest.mark.parametrize("path, maximum", [
+    ("/api/songs", 200),
+    ("/api/chord-search?chords=G,C,D", 200),
+    ("/autocomplete?field=artist&q=a", 50),
+])
+def test_invalid_limit_is_rejected(client, path, maximum):
+    separator = "&" if "?" in path else "?"
+    for limit in ("abc", "0", "-1", "2.5", str(maximum + 1)):
+        response = client.get(f"{path}{separator}limit={limit}")
+        assert response.status_code == 400, limit
+    assert client.get(f"{path}{separator}limit={maximum}").status_code == 200
+
+
+def test_limit_names_itself(client):
+    response = client.get("/api/songs?limit=abc")
+    assert json.loads(response.data) == {"error": "limit must be a whole number from 1 to 200"}
+    assert len(json.loads(client.get("/api/songs?limit=5").data)["songs"]) == 5
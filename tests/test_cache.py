@@ -0,0 +1,169 @@
+# In-process cache tests
+# - ParsedSongCache: LRU eviction within the byte budget, transposed variants kept apart, and entries dropped when
+#   their version is edited or deleted
+# - ReferenceCache: prefix completion and exact lookups, while other threads add names or reload the table
+import threading
+import time
+
+import pytest
+
+from benchmarks.dataset import generate
+from cache import ParsedSongCache, ReferenceCache, estimate_size
+from database import Database
+from helpers import content_hash
+from tokenizer import tokenize
+from transpose import transpose_tokens
+
+
+@pytest.fixture
+def db(tmp_path):
+    path = str(tmp_path / "cache.db")
+    generate(path, songs=10, versions=0, ratings=0, users=1, log=lambda message: None)
+    db = Database(path)
+    yield db
+    db.close_all()
+
+
+def test_complete_and_get_id(db):
+    cache = ReferenceCache(db)
+    assert cache.complete("genres", "ro") == ["Rock"]
+    assert cache.complete("genres", "") == sorted(cache.complete("genres", "", 100), key=str.casefold)[:10]
+    genre_id = db.execute("SELECT id FROM genres WHERE name = 'Rock'")[0]["id"]
+    assert cache.get_id("genres", "Rock") == genre_id
+    assert cache.get_id("genres", "rock") is None
+
+    cache.add("genres", "rockabilly", 1000)
+    assert cache.complete("genres", "RO") == ["Rock", "rockabilly"]
+    assert cache.get_id("genres", "rockabilly") == 1000
+
+
+def test_complete_while_adding(db):
+    cache = ReferenceCache(db)
+    cache.complete("artists", "")  # Loaded before the threads start
+    stop = threading.Event()
+    errors = []
+
+    def add():
+        for i in range(5000):
+            # Inserted all over the sorted lists, most of them ahead of the prefix
+            cache.add("artists", f"{chr(ord('a') + i % 26)}dded {i}", 10_000 + i)
+        stop.set()
+
+    def complete():
+        while not stop.is_set():
+            names = cache.complete("artists", "m", 20)
+            if any(not name.casefold().startswith("m") for name in names) or names != sorted(names, key=str.casefold):
+                errors.append(names)
+
+    threads = [threading.Thread(target=add)] + [threading.Thread(target=complete) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    # Every name added is found, in order
+    added = sorted((f"mdded {i}" for i in range(12, 5000, 26)), key=str.casefold)
+    assert cache.complete("artists", "mdded", len(added) + 1) == added
+
+
+def chart(i):
+    return tokenize(f"[C]Verse {i} goes [G]here\n[Am]and [F]there {i}")
+
+
+def test_parsed_cache_evicts_least_recently_used():
+    charts = [chart(i) for i in range(4)]
+    size = max(estimate_size(tokens) for tokens in charts)
+    cache = ParsedSongCache(3 * size)
+    for i, tokens in enumerate(charts[:3]):
+        cache.put(i, "hash", tokens)
+    assert cache.get(0, "hash") is charts[0]  # Now the most recently used
+
+    cache.put(3, "hash", charts[3])
+    assert cache.evictions == 1
+    assert cache.get(1, "hash") is None
+    assert [cache.get(i, "hash") is not None for i in (0, 2, 3)] == [True, True, True]
+    assert cache.stats()["bytes"] <= cache.max_bytes
+    assert cache.stats()["entries"] == 3
+
+
+def test_parsed_cache_skips_charts_over_budget():
+    tokens = chart(0)
+    cache = ParsedSongCache(estimate_size(tokens) - 1)
+    cache.put(1, "hash", tokens)
+    assert cache.get(1, "hash") is None
+    assert cache.stats()["bytes"] == 0
+
+
+def test_parsed_cache_keeps_variants_apart():
+    tokens = chart(0)
+    up = transpose_tokens(tokens, 2)
+    cache = ParsedSongCache(1024 * 1024)
+    cache.put(1, "hash", tokens)
+    cache.put(1, "hash", up, (2, None))
+    assert cache.get(1, "hash") is tokens
+    assert cache.get(1, "hash", (2, None)) is up
+    assert cache.get(1, "hash", (2, "flat")) is None
+    # Another content hash is another chart
+    assert cache.get(1, "other", (2, None)) is None
+
+    cache.put(2, "hash", tokens)
+    cache.invalidate(1)
+    assert cache.get(1, "hash") is None and cache.get(1, "hash", (2, None)) is None
+    assert cache.get(2, "hash") is tokens
+    assert cache.stats()["entries"] == 1
+
+
+def test_edit_and_delete_invalidate(chordapp, client):
+    cache = chordapp.parsed_cache
+    song_id = chordapp.db.execute("SELECT id FROM songs ORDER BY id LIMIT 1")[0]["id"]
+    content = "[C]Cached [G]chart"
+    version_id = int(client.post(f"/save_version/{song_id}", data={"content": content}).headers["Location"].rsplit("/", 1)[1])
+    page = f"/songs/{song_id}/versions/{version_id}"
+    digest = content_hash(content)
+
+    assert client.get(page).status_code == 200
+    assert client.get(f"{page}?transpose=2").status_code == 200
+    assert cache.get(version_id, digest) is not None
+    assert cache.get(version_id, digest, (2, None)) is not None
+
+    number = chordapp.db.execute("SELECT version_number FROM versions WHERE id = ?", version_id)[0]["version_number"]
+    client.post(f"/save_version/{song_id}", data={"content": "[D]Edited", "version_number": number})
+    assert cache.get(version_id, digest) is None
+    assert cache.get(version_id, digest, (2, None)) is None
+
+    assert client.get(page).status_code == 200
+    assert cache.get(version_id, content_hash("[D]Edited")) is not None
+    client.post(f"{page}/delete")
+    assert cache.get(version_id, content_hash("[D]Edited")) is None
+
+
+def test_reload_does_not_block_lookups(db):
+    cache = ReferenceCache(db, refresh_interval=0)
+    cache.complete("artists", "")
+    db.execute("INSERT INTO artists (name) VALUES (?)", "Zed Newcomer")  # As another process would
+    reading = threading.Event()
+    release = threading.Event()
+
+    def hook(sql, args, seconds):
+        # Holds the reload right after it has read the table
+        if sql == "SELECT id, name FROM artists" and threading.current_thread() is reloader:
+            reading.set()
+            release.wait(5)
+
+    db.query_hook = hook
+    reloader = threading.Thread(target=cache.complete, args=("artists", "z"))
+    reloader.start()
+    try:
+        assert reading.wait(5)
+        cache.refresh_interval = 60  # The index the reload started from counts as fresh for this thread
+        started = time.monotonic()
+        cache.add("artists", "Zz Added Meanwhile", 100_000)
+        assert cache.complete("artists", "zz") == ["Zz Added Meanwhile"]
+        assert cache.get_id("artists", "Zz Added Meanwhile") == 100_000
+        assert time.monotonic() - started < 1
+    finally:
+        release.set()
+        reloader.join()
+        db.query_hook = None
+    # The reload picked up the other process's row without losing the one added meanwhile
+    assert cache.complete("artists", "z") == ["Zed Newcomer", "Zz Added Meanwhile"]
@@ -0,0 +1,115 @@
+# Version history tests
+# - every revision rebuilds to the content it was saved with, through at most SNAPSHOT_INTERVAL deltas
+# - detaching a deleted version's history keeps the revisions of the versions forked from it readable
+# - the history routes show and restore past revisions
+import random
+import sqlite3
+
+import pytest
+
+from benchmarks.dataset import generate, make_chart
+from history import SNAPSHOT_INTERVAL, detach_history, load_revision, record_revision
+
+
+@pytest.fixture
+def connection(tmp_path):
+    path = str(tmp_path / "history.db")
+    generate(path, songs=1, versions=0, ratings=0, users=1, log=lambda message: None)
+    connection = sqlite3.connect(path, isolation_level=None)
+    connection.execute("PRAGMA foreign_keys = ON")
+    yield connection
+    connection.close()
+
+
+def add_version(connection, number, content):
+    return connection.execute(
+        "INSERT INTO versions (song_id, version_number, creator_id, content) VALUES (1, ?, 1, ?) RETURNING id", (number, content)
+    ).fetchone()[0]
+
+
+def save(connection, version_id, content):
+    # What save_version does: the new content, then its revision
+    previous = connection.execute("SELECT content FROM versions WHERE id = ?", (version_id,)).fetchone()[0]
+    connection.execute("UPDATE versions SET content = ? WHERE id = ?", (content, version_id))
+    return record_revision(connection, version_id, content, 1, previous)
+
+
+def revisions(connection, version_id):
+    return connection.execute("SELECT id, revision_number, parent_id, depth FROM revisions WHERE version_id = ? ORDER BY revision_number", (version_id,)).fetchall()
+
+
+def test_every_revision_rebuilds(connection):
+    rng = random.Random(0)
+    contents = [make_chart(rng)]
+    version_id = add_version(connection, 1, contents[0])
+    assert record_revision(connection, version_id, contents[0], 1) == 1
+    for _ in range(3 * SNAPSHOT_INTERVAL):
+        # Small edits, so every revision can be stored as a delta
+        lines = contents[-1].split("\n")
+        lines[rng.randrange(len(lines))] = f"[G]edit {rng.random()}"
+        contents.append("\n".join(lines))
+        save(connection, version_id, contents[-1])
+
+    rows = revisions(connection, version_id)
+    assert [number for _, number, _, _ in rows] == list(range(1, len(contents) + 1))
+    for (revision_id, _, _, _), content in zip(rows, contents):
+        assert load_revision(connection, revision_id) == content
+    # Deltas mostly, with a full snapshot at least every SNAPSHOT_INTERVAL revisions
+    assert max(depth for _, _, _, depth in rows) == SNAPSHOT_INTERVAL
+    assert sum(parent_id is None for _, _, parent_id, _ in rows) >= len(rows) // (SNAPSHOT_INTERVAL + 1)
+    assert sum(parent_id is not None for _, _, parent_id, _ in rows) > len(rows) // 2
+
+
+def test_unchanged_content_adds_no_revision(connection):
+    version_id = add_version(connection, 1, "[C]Hello")
+    record_revision(connection, version_id, "[C]Hello", 1)
+    assert save(connection, version_id, "[C]Hello") is None
+    assert len(revisions(connection, version_id)) == 1
+
+
+def test_detach_keeps_forks_readable(connection):
+    rng = random.Random(1)
+    original = make_chart(rng)
+    first = add_version(connection, 1, original)
+    record_revision(connection, first, original, 1)
+    # A second version of the song, forked from the first: its revisions are deltas against the first's
+    fork = original + "\n[D]One more line"
+    second = add_version(connection, 2, fork)
+    record_revision(connection, second, fork, 1)
+    save(connection, second, fork + "\n[E]And another")
+    forked = revisions(connection, second)
+    assert forked[0][2] == revisions(connection, first)[0][0]
+
+    connection.execute("BEGIN")
+    detach_history(connection, first)
+    connection.execute("DELETE FROM versions WHERE id = ?", (first,))
+    connection.execute("COMMIT")
+
+    assert revisions(connection, first) == []
+    rows = revisions(connection, second)
+    assert rows[0][2] is None and rows[0][3] == 0
+    assert rows[1][3] == 1
+    assert [load_revision(connection, revision_id) for revision_id, _, _, _ in rows] == [fork, fork + "\n[E]And another"]
+
+
+def test_history_routes(client, chordapp):
+    song_id = chordapp.db.execute("SELECT id FROM songs ORDER BY id LIMIT 1")[0]["id"]
+    location = client.post(f"/save_version/{song_id}", data={"content": "[C]First take"}).headers["Location"]
+    version_id = int(location.rsplit("/", 1)[1])
+    number = chordapp.db.execute("SELECT version_number FROM versions WHERE id = ?", version_id)[0]["version_number"]
+    client.post(f"/save_version/{song_id}", data={"content": "[G]Second take", "version_number": number})
+    history = f"/songs/{song_id}/versions/{version_id}/history"
+
+    assert client.get(history).status_code == 200
+    page = client.get(f"{history}/1")
+    assert page.status_code == 200
+    assert b"First" in page.data
+    assert client.get(f"{history}/3").status_code == 404
+
+    assert client.post(f"{history}/1/restore").status_code == 302
+    assert chordapp.db.execute("SELECT content FROM versions WHERE id = ?", version_id)[0]["content"] == "[C]First take"
+    # The restore is a revision of its own
+    assert client.get(f"{history}/3").status_code == 200
+
+    client.post(f"/songs/{song_id}/versions/{version_id}/delete")
+    assert client.get(f"{history}/1").status_code == 404
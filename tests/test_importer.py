@@ -0,0 +1,69 @@
+# Bulk import tests
+# - artists, genres and songs added by someone else between two batches are reused, not inserted again, and charts
+#   imported into such a song are numbered after the versions it already has
+import pytest
+
+from benchmarks.dataset import generate
+from database import Database
+from importer import Importer
+
+LIMITS = {"title": 200, "artist": 100, "genre": 50, "content": 10000}
+
+
+@pytest.fixture
+def db(tmp_path):
+    path = str(tmp_path / "import.db")
+    generate(path, songs=10, versions=10, ratings=0, users=1, log=lambda message: None)
+    db = Database(path)
+    yield db
+    db.close_all()
+
+
+def write_chart(directory, name, title, artist, genre):
+    (directory / name).write_text(f"Title: {title}\nArtist: {artist}\nGenre: {genre}\n[C]Hello [G]world\n", encoding="utf-8")
+
+
+def test_names_added_between_batches_are_reused(db, tmp_path):
+    source = tmp_path / "charts"
+    source.mkdir()
+    write_chart(source, "1.txt", "First", "Early Artist", "Early Genre")
+    write_chart(source, "2.txt", "Second", "Late Artist", "Late Genre")
+    write_chart(source, "3.txt", "Third", "Late Artist", "Late Genre")
+
+    added = {}
+
+    def progress(imported, skipped, seconds):
+        # The app adds the names the next batch uses while the import runs
+        if imported == 1 and not added:
+            added["artist"] = db.execute("INSERT INTO artists (name) VALUES (?)", "Late Artist")
+            added["genre"] = db.execute("INSERT INTO genres (name) VALUES (?)", "Late Genre")
+            added["song"] = db.execute("INSERT INTO songs (title, artist_id, genre_id) VALUES (?, ?, ?)", "Second", added["artist"], added["genre"])
+            added["version"] = db.execute("INSERT INTO versions (song_id, version_number, creator_id, content) VALUES (?, 1, 1, ?)", added["song"], "[D]Saved in the app")
+
+    importer = Importer(db, 1, LIMITS, batch_size=1)
+    importer.run(str(source), progress)
+
+    assert importer.imported == 3
+    assert db.execute("SELECT id FROM artists WHERE name = 'Late Artist'") == [{"id": added["artist"]}]
+    assert db.execute("SELECT id FROM genres WHERE name = 'Late Genre'") == [{"id": added["genre"]}]
+    songs = db.execute("SELECT songs.id, songs.title FROM songs JOIN artists ON songs.artist_id = artists.id WHERE artists.name = 'Late Artist' ORDER BY songs.title")
+    assert [song["title"] for song in songs] == ["Second", "Third"]
+    assert songs[0]["id"] == added["song"]
+    # The imported chart became a version of the song the app added, numbered after the version saved there
+    versions = db.execute("SELECT id, version_number FROM versions WHERE song_id = ? ORDER BY version_number", added["song"])
+    assert versions[0] == {"id": added["version"], "version_number": 1}
+    assert [version["version_number"] for version in versions] == [1, 2]
+
+
+def test_resumed_import_reuses_its_own_rows(db, tmp_path):
+    source = tmp_path / "charts"
+    source.mkdir()
+    write_chart(source, "1.txt", "Song", "Artist", "Genre")
+    Importer(db, 1, LIMITS).run(str(source))
+    write_chart(source, "2.txt", "Song", "Artist", "Genre")
+    Importer(db, 1, LIMITS).run(str(source))
+
+    assert db.execute("SELECT COUNT(*) AS count FROM artists WHERE name = 'Artist'")[0]["count"] == 1
+    song = db.execute("SELECT id FROM songs WHERE title = 'Song'")
+    assert len(song) == 1
+    assert [row["version_number"] for row in db.execute("SELECT version_number FROM versions WHERE song_id = ? ORDER BY version_number", song[0]["id"])] == [1, 2]
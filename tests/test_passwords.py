@@ -0,0 +1,65 @@
+# Password hashing tests
+# - a saturated pool turns callers away at once, and the login and register routes answer 503 with Retry-After
+# - a hashing worker re-importing app.py (as under `python app.py`) skips the app's startup
+import os
+import re
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+
+from benchmarks.dataset import PASSWORD
+from passwords import HasherBusy, PasswordHasher
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Slow enough for a second call to arrive while the first one is hashing
+SLOW_METHOD = "pbkdf2:sha256:2000000"
+
+
+def test_saturated_pool_rejects():
+    hasher = PasswordHasher(SLOW_METHOD, workers=1, max_pending=1, timeout=60)
+    try:
+        first = threading.Thread(target=hasher.hash, args=("password",))
+        first.start()
+        while hasher.pending() == 0:
+            time.sleep(0.01)
+        with pytest.raises(HasherBusy):
+            hasher.verify("pbkdf2:sha256:1$salt$hash", "password")
+        assert hasher.rejected == 1
+        first.join()
+        # The slot is free again once the first call is done
+        assert hasher.pending() == 0
+        assert hasher.verify(hasher.hash("password"), "password")
+        assert hasher.rejected == 1
+    finally:
+        hasher.close()
+
+
+def test_saturated_routes_answer_503(chordapp, monkeypatch):
+    saturated = PasswordHasher(workers=0, max_pending=0)
+    monkeypatch.setattr(chordapp, "password_hasher", saturated)
+    client = chordapp.app.test_client()
+
+    login = client.post("/login", data={"username": "bench0", "password": PASSWORD})
+    assert login.status_code == 503
+    assert login.headers["Retry-After"] == str(chordapp.PASSWORD_RETRY_AFTER)
+    register = client.post("/register", data={"username": "saturated_user", "password": "secret", "confirmation": "secret"})
+    assert register.status_code == 503
+    assert chordapp.db.execute("SELECT 1 FROM users WHERE username = 'saturated_user'") == []
+
+    assert saturated.rejected == 2
+    metrics = client.get("/metrics").get_data(as_text=True)
+    assert re.search(r"^chordapp_password_rejected_total 2(\.0)?$", metrics, re.MULTILINE)
+
+
+def test_hashing_worker_skips_app_startup(tmp_path):
+    # What a worker does under `python app.py`: load app.py as __mp_main__
+    path = tmp_path / "never_created.db"
+    env = dict(os.environ, DB_PATH=str(path), MIGRATE_ON_STARTUP="1")
+    code = "import runpy; runpy.run_path('app.py', run_name='__mp_main__')"
+    result = subprocess.run([sys.executable, "-c", code], cwd=ROOT, env=env, capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+    assert not path.exists()
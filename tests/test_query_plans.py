@@ -0,0 +1,50 @@
+# Query plan regression test: no statement the routes send may read a whole table
+# - sends every route once against the generated test database (see conftest.py), then checks EXPLAIN QUERY PLAN
+#   of each statement app.py and chord_index.py sent (see benchmarks.query_plans, which does the same by hand on
+#   databases of any size)
+# - sorts on a temporary B-tree are allowed: the keyset and ranked queries bound them with their LIMIT
+# Run from the repository root: python -m pytest tests
+import sqlite3
+
+import pytest
+
+from schema import LATEST_VERSION, schema_version
+
+
+@pytest.fixture(scope="module")
+def plans(chordapp, catalog):
+    from benchmarks.query_plans import check_plans
+
+    return catalog, *check_plans(catalog)
+
+
+def test_database_is_up_to_date(plans):
+    path, _, _ = plans
+    connection = sqlite3.connect(path)
+    try:
+        assert schema_version(connection) == LATEST_VERSION
+    finally:
+        connection.close()
+
+
+def test_routes_succeed(plans):
+    _, failed, _ = plans
+    assert failed == []
+
+
+def test_statements_were_captured(plans):
+    _, _, checked = plans
+    requests = {statement["request"] for statement in checked}
+    # Every kind of route sent something: listings, search, the API, writes
+    for route in ("GET /songs", "GET /search", "GET /api/chord-search", "POST /save_version"):
+        assert any(request.startswith(route) for request in requests), route
+
+
+def test_no_full_table_scans(plans):
+    _, _, checked = plans
+    scans = [
+        f"{statement['request']}: {' '.join(statement['sql'].split())[:200]}\n    " + "\n    ".join(statement["plan"])
+        for statement in checked
+        if statement["full_scans"]
+    ]
+    assert not scans, "statements reading a whole table:\n" + "\n".join(scans)
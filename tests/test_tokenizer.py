@@ -0,0 +1,60 @@
+# Behavior tests for the chord chart tokenizer (see benchmarks.parser_fuzz for the long fuzz run by hand)
+# - stored token streams must read back as the tokens the original parser produced
+# - the original parser never returns on a "]" outside a chord; there the tokenizer keeps the "]" as lyric text
+import random
+
+import pytest
+
+from benchmarks.parser_bench import legacy_parse_content
+from benchmarks.parser_fuzz import ALPHABET, render
+from tokenizer import CHORD, LINE_BREAK, LYRIC, SPACES, deserialize_tokens, serialize_tokens, tokenize
+
+SEED = 0
+RUNS = 500
+
+
+def round_trip(content):
+    return [(token.type, token.value) for token in deserialize_tokens(serialize_tokens(tokenize(content)))]
+
+
+def legacy(content):
+    return [(token["type"], token["value"]) for token in legacy_parse_content(content)]
+
+
+@pytest.mark.parametrize("content", [
+    "[C",  # Unclosed: the chord runs to the end of the content
+    "[G]Hello [Am",
+    "[",
+    "[]",  # Empty chord
+    "[][]  []",
+    "[C]Hello\r\nworld [G]\r\n",  # CRLF: the \r stays with the lyric
+    "\r\n\r\n",
+    "[C\nG]",
+    "  [C]   [G]  \n",
+    "ñandú [Sol]corazón 🎸 [Re7]",
+])
+def test_round_trip_matches_original_parser(content):
+    assert round_trip(content) == legacy(content)
+
+
+@pytest.mark.parametrize("content, expected", [
+    ("]", [(LYRIC, "]")]),
+    ("a]b", [(LYRIC, "a]b")]),
+    ("[C]]", [(SPACES, " "), (CHORD, "C"), (SPACES, " "), (LYRIC, "]")]),
+    ("][", [(LYRIC, "]"), (SPACES, " "), (CHORD, ""), (SPACES, " ")]),
+    ("x] [G]y\r\n", [(LYRIC, "x]"), (SPACES, " "), (SPACES, " "), (CHORD, "G"), (SPACES, " "), (LYRIC, "y\r"), (LINE_BREAK, "\n")]),
+])
+def test_stray_closing_bracket_is_lyric(content, expected):
+    assert round_trip(content) == expected
+
+
+def test_random_charts():
+    rng = random.Random(SEED)
+    for _ in range(RUNS):
+        content = "".join(rng.choice(ALPHABET) for _ in range(rng.randint(0, 200)))
+        tokens = tokenize(content)
+        assert round_trip(content) == [(token.type, token.value) for token in tokens], content
+        # An unclosed bracket swallows the rest of the content, so its "]" is missing from the input
+        assert render(tokens) in (content, content + "]"), content
+        if not any(token.type == LYRIC and "]" in token.value for token in tokens):
+            assert round_trip(content) == legacy(content), content
@@ -0,0 +1,59 @@
+# Transposition tests
+# - chords move by the offset, slash basses with them, spelled with sharps or flats as asked or as the key suggests
+# - words in brackets that aren't chords ([Chorus], [Bridge], N.C.) come out unchanged
+import pytest
+
+from tokenizer import CHORD, tokenize
+from transpose import FLAT, SHARP, parse_chord, transpose_chord, transpose_tokens
+
+
+def chords(tokens):
+    return [token.value for token in tokens if token.type == CHORD]
+
+
+@pytest.mark.parametrize("symbol, offset, spelling, expected", [
+    ("G", 2, SHARP, "A"),
+    ("C", 1, SHARP, "C#"),
+    ("C", 1, FLAT, "Db"),
+    ("F#m7", 1, SHARP, "Gm7"),
+    ("Bb", 2, FLAT, "C"),
+    ("G/B", 2, SHARP, "A/C#"),
+    ("D/F#", 3, FLAT, "F/A"),
+    ("Am7b5", 5, FLAT, "Dm7b5"),
+    ("C6/9", 2, SHARP, "D6/9"),
+    ("E7(#9)", 1, FLAT, "F7(#9)"),
+    ("Gsus4", 11, SHARP, "F#sus4"),
+])
+def test_transpose_chord(symbol, offset, spelling, expected):
+    assert transpose_chord(symbol, offset, spelling) == expected
+
+
+@pytest.mark.parametrize("label", ["Chorus", "Bridge", "Coda", "Intro", "Outro", "Verse", "N.C.", "x2", "Am/G7", "Cdur"])
+def test_labels_are_not_chords(label):
+    assert parse_chord(label) is None
+    for offset in range(12):
+        assert transpose_chord(label, offset, SHARP) == label
+        assert transpose_chord(label, offset, FLAT) == label
+
+
+def test_labels_survive_a_transposed_chart():
+    tokens = tokenize("[Chorus]\n[G]Sing it [D/F#]loud [Em]now\n[Bridge]\n[C]Quiet [N.C.]")
+    transposed = transpose_tokens(tokens, 2)
+    assert chords(transposed) == ["Chorus", "A", "E/G#", "F#m", "Bridge", "D", "N.C."]
+    # Lyrics are shared with the original chart
+    assert [token for token in transposed if token.type != CHORD] == [token for token in tokens if token.type != CHORD]
+
+
+def test_spelling_follows_the_key():
+    tokens = tokenize("[C]One [G]two [Am]three")
+    assert chords(transpose_tokens(tokens, 5)) == ["F", "C", "Dm"]  # F major
+    assert chords(transpose_tokens(tokens, 3)) == ["Eb", "Bb", "Cm"]  # Eb major: flats
+    assert chords(transpose_tokens(tokens, 3, SHARP)) == ["D#", "A#", "Cm"]
+    assert chords(transpose_tokens(tokens, -1)) == ["B", "F#", "G#m"]  # Down a semitone, B major: sharps
+
+
+def test_no_offset_is_the_same_chart():
+    tokens = tokenize("[C]One [Chorus]")
+    assert transpose_tokens(tokens, 0) is tokens
+    assert transpose_tokens(tokens, 12) is tokens
+    assert chords(transpose_tokens(tokens, 12, FLAT)) == ["C", "Chorus"]
@@ -0,0 +1,105 @@
+# Write-behind rating tests
+# - close() stores every rating submitted, even while another connection holds the write lock for longer than
+#   the writer's retry timeout
+# - only ratings the database rejects outright are dropped, and close() returns when retrying can't help (a missing
+#   table) or close_timeout runs out
+import sqlite3
+import threading
+import time
+
+import pytest
+
+from benchmarks.dataset import generate
+from database import Database
+from write_behind import RatingWriter
+
+VERSIONS = 20
+USERS = 10
+
+
+@pytest.fixture
+def db(tmp_path):
+    path = str(tmp_path / "ratings.db")
+    generate(path, songs=5, versions=VERSIONS, ratings=0, users=USERS, log=lambda message: None)
+    db = Database(path, busy_timeout=20)
+    yield db
+    db.close_all()
+
+
+def stored(db):
+    return {(row["version_id"], row["user_id"]): row["rating"] for row in db.execute("SELECT version_id, user_id, rating FROM ratings")}
+
+
+def submit_all(writer):
+    expected = {}
+    for version_id in range(1, VERSIONS + 1):
+        for user_id in range(1, USERS + 1):
+            # Rated twice: only the last one counts
+            writer.submit(version_id, user_id, 1)
+            rating = (version_id + user_id) % 5 + 1
+            writer.submit(version_id, user_id, rating)
+            expected[(version_id, user_id)] = rating
+    return expected
+
+
+def test_close_stores_every_rating(db):
+    writer = RatingWriter(db, batch_size=64, flush_interval=0.01)
+    expected = submit_all(writer)
+    writer.close()
+    assert stored(db) == expected
+    assert writer.dropped == 0
+    assert writer.pending() == 0
+
+
+def test_close_outlasts_a_held_lock(db):
+    writer = RatingWriter(db, batch_size=64, flush_interval=0.01, retry_timeout=0.1)
+    blocker = sqlite3.connect(db.path, isolation_level=None, check_same_thread=False)
+    blocker.execute("BEGIN IMMEDIATE")
+    try:
+        expected = submit_all(writer)
+        # The background thread gives up on the lock and keeps the ratings; close() waits it out
+        release = threading.Timer(1.0, blocker.execute, ("COMMIT",))
+        release.start()
+        writer.close()
+        release.join()
+    finally:
+        blocker.close()
+    assert stored(db) == expected
+    assert writer.dropped == 0
+
+
+def test_rejected_rating_is_dropped_alone(db):
+    writer = RatingWriter(db, flush_interval=0.01)
+    writer.submit(1, 1, 5)
+    writer.submit(VERSIONS + 1000, 1, 5)  # No such version
+    writer.submit(2, 1, 4)
+    writer.close()
+    assert stored(db) == {(1, 1): 5, (2, 1): 4}
+    assert writer.dropped == 1
+
+
+def test_close_returns_when_the_table_is_gone(db):
+    writer = RatingWriter(db, flush_interval=0.01, close_timeout=60)
+    db.execute("ALTER TABLE ratings RENAME TO ratings_old")
+    writer.submit(1, 1, 5)
+    started = time.monotonic()
+    writer.close()
+    # Retrying can't bring the table back: the rating is dropped, not retried until close_timeout
+    assert time.monotonic() - started < 5
+    assert writer.dropped == 1
+    assert writer.pending() == 0
+
+
+def test_close_gives_up_after_close_timeout(db):
+    writer = RatingWriter(db, flush_interval=0.01, retry_timeout=0.1, close_timeout=0.5)
+    blocker = sqlite3.connect(db.path, isolation_level=None)
+    blocker.execute("BEGIN IMMEDIATE")
+    try:
+        writer.submit(1, 1, 5)
+        started = time.monotonic()
+        writer.close()
+        assert time.monotonic() - started < 5
+    finally:
+        blocker.close()
+    assert writer.dropped == 1
+    assert stored(db) == {}
@@ -0,0 +1,86 @@
+# Concurrency test for the save_version write path (see benchmarks.write_hammer for the full workload by hand)
+# - many threads save new versions of the same song at once
+# - no two versions of the song may get the same number, and every save sends a bounded number of statements
+import random
+import threading
+
+import pytest
+
+from benchmarks.dataset import make_chart
+
+THREADS = 8
+SAVES = 10  # Per thread
+
+# Statements a save may send through query_hook. Usually 4: the version's INSERT ... RETURNING, and the latest
+# revision lookup, the fork candidates and the INSERT of its revision. A chart whose chord set isn't in memory yet
+# adds two to intern it and two to read it back once committed. BEGIN and COMMIT aren't reported.
+MAX_SAVE_STATEMENTS = 8
+
+
+@pytest.fixture(scope="module")
+def saves(chordapp, login):
+    """Saves SAVES new versions of one song from each of THREADS threads at once.
+
+    Returns:
+        tuple[int, list[tuple[str, int]]]: The song's id, and every save's (redirect location, statement count).
+    """
+    db = chordapp.db
+    song_id = db.execute("SELECT id FROM songs ORDER BY id LIMIT 1")[0]["id"]
+    counter = threading.local()
+    previous = db.query_hook
+
+    def hook(sql, args, seconds):
+        if hasattr(counter, "statements"):
+            counter.statements += 1
+        if previous is not None:
+            previous(sql, args, seconds)
+
+    results = []
+    lock = threading.Lock()
+    barrier = threading.Barrier(THREADS)
+
+    def worker(index):
+        rng = random.Random(index)
+        client = clients[index]
+        local = []
+        barrier.wait()
+        for _ in range(SAVES):
+            counter.statements = 0
+            response = client.post(f"/save_version/{song_id}", data={"content": make_chart(rng)})
+            local.append((response.headers.get("Location", str(response.status_code)), counter.statements))
+        with lock:
+            results.extend(local)
+
+    # Logged in one at a time beforehand: concurrent logins could fill the hashing pool and be turned away
+    clients = [login(f"bench{index}") for index in range(THREADS)]
+    db.query_hook = hook
+    try:
+        threads = [threading.Thread(target=worker, args=(i,)) for i in range(THREADS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        db.query_hook = previous
+    return song_id, results
+
+
+def test_every_save_succeeds(saves):
+    song_id, results = saves
+    assert len(results) == THREADS * SAVES
+    # Each save redirects to the version it created
+    locations = [location for location, _ in results]
+    assert all(location.startswith(f"/songs/{song_id}/versions/") for location in locations), locations
+    assert len(set(locations)) == len(locations)
+
+
+def test_version_numbers_are_unique(saves, chordapp):
+    song_id, _ = saves
+    duplicates = chordapp.db.execute("SELECT version_number, COUNT(*) AS count FROM versions WHERE song_id = ? GROUP BY version_number HAVING COUNT(*) > 1", song_id)
+    assert duplicates == []
+
+
+def test_saves_send_few_statements(saves):
+    _, results = saves
+    counts = [statements for _, statements in results]
+    assert max(counts) <= MAX_SAVE_STATEMENTS, f"a save sent {max(counts)} statements"
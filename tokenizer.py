@@ -0,0 +1,244 @@
+# Chord chart tokenizer for ChordApp
+# - single compiled-regex scan over the separators, lyrics are sliced out; linear in the length of the content
+# - emits compact Token tuples with interned type tags
+# - lazy (generator) and eager (list) entry points
+# - compact binary serialization of token streams, for storing them next to the raw content
+import re
+import struct
+import sys
+from array import array
+from collections import namedtuple
+
+# Longest chart content the app accepts, in characters; the bound the tokenizer is fuzzed up to
+MAX_CONTENT_LENGTH = 10000
+
+# Token type tags. Interned so templates and callers can compare them cheaply.
+CHORD = sys.intern("chord")
+LYRIC = sys.intern("lyric")
+SPACES = sys.intern("spaces")
+LINE_BREAK = sys.intern("line-break")
+
+# A token is an immutable (type, value) pair. namedtuple keeps it as small as a plain
+# tuple (no per-instance __dict__) while still allowing `token.type` / `token.value`
+# attribute access from the Jinja templates.
+Token = namedtuple("Token", ["type", "value"])
+
+# Shared instances for the tokens that never change, so long charts don't allocate them over and over
+PAD = Token(SPACES, " ")
+BREAK = Token(LINE_BREAK, "\n")
+
+# namedtuple's own constructor goes through a Python-level __new__; building the tuple directly
+# skips that and is the hot path of the tokenizer.
+_new_token = tuple.__new__
+
+# Everything that separates lyrics: a run of spaces, a chord or a line break. A chord runs from "[" up to
+# the closing "]", or to the end of the content if the bracket is never closed. Whatever lies between two
+# separators is a lyric, sliced straight out of the content. A stray "]" is kept as lyric text.
+_SEPARATOR_RE = re.compile(r" +|\[[^\]]*\]?|\n")
+
+
+def iter_tokens(content):
+    """Lazily tokenizes a chord chart.
+
+    Chords are written in brackets right where they are played, e.g. "[C]Hello [G]world".
+    Each chord is surrounded by a single padding space so it doesn't collide with the lyrics.
+    Runs in a single pass over the content, so it always terminates in linear time.
+
+    Args:
+        content: The raw song content string with chords and lyrics.
+
+    Yields:
+        Token: (type, value) pairs where type is one of CHORD, LYRIC, SPACES or LINE_BREAK.
+    """
+    cursor = 0
+    for match in _SEPARATOR_RE.finditer(content):
+        start, end = match.span()
+        if start > cursor:
+            yield _new_token(Token, (LYRIC, content[cursor:start]))
+
+        first = content[start]
+        if first == "[":
+            yield PAD
+            # Drop the closing bracket, if there is one
+            yield _new_token(Token, (CHORD, content[start + 1:end - 1] if content[end - 1] == "]" else content[start + 1:end]))
+            yield PAD
+        elif first == "\n":
+            yield BREAK
+        elif end - start == 1:
+            yield PAD
+        else:
+            yield _new_token(Token, (SPACES, content[start:end]))
+        cursor = end
+
+    if cursor < len(content):
+        yield _new_token(Token, (LYRIC, content[cursor:]))
+
+
+def tokenize(content):
+    """Tokenizes a whole chord chart at once.
+
+    Args:
+        content: The raw song content string with chords and lyrics.
+
+    Returns:
+        list[Token]: Every token of the chart, in order.
+    """
+    return list(iter_tokens(content))
+
+
+# Version of the serialized token format. Bump it whenever the tokenizer's output or the layout below
+# changes: stored token streams with another version are re-tokenized from the raw content when read.
+TOKENS_FORMAT = 1
+
+# Serialized layout:
+#   header: format version, typecode of the integer arrays, and the number of kinds, arguments and chords
+#   kinds:  one byte per token (a chord's padding is implied by its kind and not stored)
+#   args:   one integer per spaces/lyric/chord token: run length, lyric length or index into the chord table
+#   chords: length of each distinct chord symbol, in order of first appearance
+#   text:   UTF-8 of every lyric followed by every distinct chord symbol
+_HEADER = struct.Struct("<BcIII")
+_KIND_PAD, _KIND_BREAK, _KIND_SPACES, _KIND_LYRIC, _KIND_CHORD = range(5)
+
+
+def serialize_tokens(tokens):
+    """Packs a token stream into a compact binary blob.
+
+    Chord symbols are interned: each distinct chord is stored once and referenced by index.
+
+    Args:
+        tokens: Tokens as produced by iter_tokens.
+
+    Returns:
+        bytes: The serialized stream, readable by deserialize_tokens.
+    """
+    kinds = bytearray()
+    args = []
+    lyrics = []
+    chords = {}
+    skip_pad = False
+    for token in tokens:
+        if token is PAD:
+            if skip_pad:
+                skip_pad = False
+            else:
+                kinds.append(_KIND_PAD)
+        elif token is BREAK:
+            kinds.append(_KIND_BREAK)
+        elif token.type == CHORD:
+            # The padding before the chord was already written; fold it into the chord instead
+            kinds[-1] = _KIND_CHORD
+            args.append(chords.setdefault(token.value, len(chords)))
+            skip_pad = True
+        elif token.type == SPACES:
+            kinds.append(_KIND_SPACES)
+            args.append(len(token.value))
+        else:
+            kinds.append(_KIND_LYRIC)
+            args.append(len(token.value))
+            lyrics.append(token.value)
+
+    chord_lengths = [len(chord) for chord in chords]
+    largest = max(args + chord_lengths, default=0)
+    typecode = "B" if largest < 1 << 8 else "H" if largest < 1 << 16 else "I"
+
+    return b"".join([
+        _HEADER.pack(TOKENS_FORMAT, typecode.encode(), len(kinds), len(args), len(chords)),
+        bytes(kinds),
+        array(typecode, args).tobytes(),
+        array(typecode, chord_lengths).tobytes(),
+        "".join(lyrics).encode("utf-8"),
+        "".join(chords).encode("utf-8"),
+    ])
+
+
+def stored_chords(blob):
+    """Reads the distinct chord symbols of a blob written by serialize_tokens, without rebuilding its tokens.
+
+    Args:
+        blob: The serialized stream.
+
+    Returns:
+        list[str]: Each chord symbol once, in order of first appearance.
+
+    Raises:
+        ValueError: If the blob was written with another TOKENS_FORMAT.
+    """
+    version, typecode, kind_count, arg_count, chord_count = _HEADER.unpack_from(blob)
+    if version != TOKENS_FORMAT:
+        raise ValueError(f"unsupported token format {version}")
+
+    chord_lengths = array(typecode.decode())
+    cursor = _HEADER.size + kind_count + arg_count * chord_lengths.itemsize
+    chord_lengths.frombytes(blob[cursor:cursor + chord_count * chord_lengths.itemsize])
+    text = blob[cursor + chord_count * chord_lengths.itemsize:].decode("utf-8")
+
+    chords = []
+    text_cursor = len(text) - sum(chord_lengths)
+    for length in chord_lengths:
+        chords.append(text[text_cursor:text_cursor + length])
+        text_cursor += length
+    return chords
+
+
+def deserialize_tokens(blob):
+    """Unpacks a blob written by serialize_tokens back into a token list.
+
+    Much cheaper than tokenizing the content again: the text is decoded once and every token is a slice of it.
+    Repeated chords and space runs share a single Token instance.
+
+    Args:
+        blob: The serialized stream.
+
+    Returns:
+        list[Token]: The same tokens that were serialized.
+
+    Raises:
+        ValueError: If the blob was written with another TOKENS_FORMAT.
+    """
+    version, typecode, kind_count, arg_count, chord_count = _HEADER.unpack_from(blob)
+    if version != TOKENS_FORMAT:
+        raise ValueError(f"unsupported token format {version}")
+
+    cursor = _HEADER.size
+    kinds = blob[cursor:cursor + kind_count]
+    cursor += kind_count
+    args = array(typecode.decode())
+    args.frombytes(blob[cursor:cursor + arg_count * args.itemsize])
+    cursor += arg_count * args.itemsize
+    chord_lengths = array(typecode.decode())
+    chord_lengths.frombytes(blob[cursor:cursor + chord_count * chord_lengths.itemsize])
+    cursor += chord_count * chord_lengths.itemsize
+    text = blob[cursor:].decode("utf-8")
+
+    # Chord symbols sit at the end of the text
+    chords = []
+    text_cursor = len(text) - sum(chord_lengths)
+    for length in chord_lengths:
+        chords.append(_new_token(Token, (CHORD, text[text_cursor:text_cursor + length])))
+        text_cursor += length
+
+    tokens = []
+    append = tokens.append
+    next_arg = iter(args).__next__
+    spaces = {1: PAD}
+    text_cursor = 0
+    for kind in kinds:
+        if kind == _KIND_PAD:
+            append(PAD)
+        elif kind == _KIND_LYRIC:
+            length = next_arg()
+            append(_new_token(Token, (LYRIC, text[text_cursor:text_cursor + length])))
+            text_cursor += length
+        elif kind == _KIND_CHORD:
+            append(PAD)
+            append(chords[next_arg()])
+            append(PAD)
+        elif kind == _KIND_BREAK:
+            append(BREAK)
+        else:
+            length = next_arg()
+            token = spaces.get(length)
+            if token is None:
+                token = spaces[length] = _new_token(Token, (SPACES, " " * length))
+            append(token)
+    return tokens
@@ -0,0 +1,150 @@
+# Chord transposition for ChordApp
+# - works on the chord tokens of a parsed chart; lyrics, spaces and line breaks are shared with the original
+# - every distinct chord symbol is parsed once into (root, quality, bass) and kept in an interned table
+# - transposed symbols are memoized per (symbol, offset, spelling), so a chart only costs a lookup per chord
+import re
+import sys
+from functools import lru_cache
+
+from tokenizer import CHORD, Token
+
+SHARP = "sharp"
+FLAT = "flat"
+SPELLINGS = (SHARP, FLAT)
+
+SHARP_NAMES = ("C", "C#", "D", "D#", "E", "F", "F#", "G", "G#", "A", "A#", "B")
+FLAT_NAMES = ("C", "Db", "D", "Eb", "E", "F", "Gb", "G", "Ab", "A", "Bb", "B")
+PITCHES = {name: pitch for names in (SHARP_NAMES, FLAT_NAMES) for pitch, name in enumerate(names)}
+PITCHES.update({"Cb": 11, "B#": 0, "Fb": 4, "E#": 5})
+
+# Version of the transposition rules. Bump it whenever transposing the same chart gives a different result (e.g.
+# when what counts as a chord changes): API responses carry it in their ETags, so clients refetch their copies.
+TRANSPOSE_VERSION = 2
+
+# Major keys written with flats in their key signature (F, Bb, Eb, Ab, Db)
+FLAT_KEYS = frozenset({5, 10, 3, 8, 1})
+
+# Qualities common enough to be parsed ahead of time, for every root and spelling
+COMMON_QUALITIES = ("", "m", "7", "m7", "maj7", "6", "m6", "9", "sus2", "sus4", "7sus4", "dim", "dim7", "aug", "add9", "m7b5", "5")
+
+# Root, accidental, quality, and an optional "/bass" note. The quality is built from the pieces chord names are
+# made of (m7b5, maj9, sus4, add9, 7(#9), 6/9, +, Δ7, ...), so words in brackets ("Chorus", "Bridge", "Coda")
+# aren't taken for a C or B chord.
+_QUALITY = r"(?:maj|min|mi|m|M|dim|aug|sus|add|[0-9]|[#b+\-()Δ°ø]|/(?=[0-9]))*"
+_CHORD_RE = re.compile(rf"([A-G])([#b]?)({_QUALITY})(?:/([A-G])([#b]?))?")
+
+
+def _parse(symbol):
+    match = _CHORD_RE.fullmatch(symbol)
+    if not match:
+        # Not a chord ("N.C.", "x2", "Intro", ...): left as is
+        return None
+    root, accidental, quality, bass, bass_accidental = match.groups()
+    root_pitch = PITCHES.get(root + accidental)
+    bass_pitch = PITCHES.get(bass + bass_accidental) if bass else None
+    if root_pitch is None or (bass and bass_pitch is None):
+        return None
+    return root_pitch, sys.intern(quality), bass_pitch
+
+
+# Parsed chord symbols: symbol -> (root pitch, quality, bass pitch or None)
+_CHORDS = {sys.intern(root + quality): _parse(root + quality) for root in PITCHES for quality in COMMON_QUALITIES}
+
+
+@lru_cache(maxsize=4096)
+def parse_chord(symbol):
+    """Splits a chord symbol into its root, quality and bass note.
+
+    Common chords come from a table built at import; any other symbol is parsed the first time it's seen.
+
+    Args:
+        symbol: A chord as written in a chart, e.g. "F#m7" or "G/B".
+
+    Returns:
+        tuple[int, str, int | None] | None: The root's pitch class (0 = C), the quality ("m7"), and the
+            bass note's pitch class (None without a slash bass); or None if the symbol isn't a chord.
+    """
+    if symbol in _CHORDS:
+        return _CHORDS[symbol]
+    return _parse(symbol)
+
+
+@lru_cache(maxsize=16384)
+def transpose_chord(symbol, offset, spelling):
+    """Transposes one chord symbol.
+
+    Args:
+        symbol: The chord as written in the chart.
+        offset: Semitones to move it up, 0 to 11.
+        spelling: SHARP or FLAT, how to name the black keys.
+
+    Returns:
+        str: The transposed chord, or the symbol unchanged if it isn't a chord.
+    """
+    parsed = parse_chord(symbol)
+    if parsed is None:
+        return symbol
+    root, quality, bass = parsed
+    names = FLAT_NAMES if spelling == FLAT else SHARP_NAMES
+    transposed = names[(root + offset) % 12] + quality
+    if bass is not None:
+        transposed += "/" + names[(bass + offset) % 12]
+    return sys.intern(transposed)
+
+
+def guess_spelling(tokens, offset):
+    """Picks sharps or flats from the key the chart ends up in.
+
+    The first chord is taken as the key (a minor chord as its relative major), and the black keys are
+    named with flats if that key's signature has flats, with sharps otherwise.
+
+    Args:
+        tokens: The chart's tokens.
+        offset: Semitones the chart is moved up.
+
+    Returns:
+        str: SHARP or FLAT.
+    """
+    for token in tokens:
+        if token.type == CHORD:
+            parsed = parse_chord(token.value)
+            if parsed is not None:
+                root, quality, _ = parsed
+                if quality.startswith("m") and not quality.startswith("maj"):
+                    root += 3
+                return FLAT if (root + offset) % 12 in FLAT_KEYS else SHARP
+    return SHARP
+
+
+def transpose_tokens(tokens, offset, spelling=None):
+    """Transposes a parsed chart.
+
+    Only chord tokens are replaced; every other token is shared with the original list.
+
+    Args:
+        tokens: The chart's tokens, as produced by the tokenizer.
+        offset: Semitones to move the chart up (negative moves it down).
+        spelling: SHARP or FLAT to force how black keys are named, or None to follow the target key.
+
+    Returns:
+        list[Token]: The transposed chart.
+    """
+    offset %= 12
+    if offset == 0 and spelling is None:
+        return tokens
+    if spelling is None:
+        spelling = guess_spelling(tokens, offset)
+
+    transposed = {}
+    result = []
+    append = result.append
+    for token in tokens:
+        if token.type == CHORD:
+            # One Token per distinct chord, shared across the chart
+            new_token = transposed.get(token.value)
+            if new_token is None:
+                new_token = transposed[token.value] = Token(CHORD, transpose_chord(token.value, offset, spelling))
+            append(new_token)
+        else:
+            append(token)
+    return result
@@ -0,0 +1,216 @@
+# Write-behind batching for rating submissions
+# - rate_version hands ratings to an in-process queue instead of writing them itself
+# - a background thread upserts them in batches, one transaction per batch
+# - a batch the database can't take yet (locked, full disk) is kept and tried again; close() (also run at exit)
+#   drains the queue and keeps retrying for up to close_timeout seconds, so a passing lock loses no rating on
+#   shutdown while a broken database can't hang it
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+
+log = logging.getLogger("chordapp.write_behind")
+
+UPSERT_RATING = "INSERT INTO ratings (version_id, user_id, rating) VALUES (?, ?, ?) ON CONFLICT (version_id, user_id) DO UPDATE SET rating = excluded.rating"
+
+# Errors the database may get over on its own: another connection's lock, a full disk (primary codes; extended
+# ones such as SQLITE_BUSY_SNAPSHOT are masked down to these)
+RETRYABLE_ERRORS = frozenset({sqlite3.SQLITE_BUSY, sqlite3.SQLITE_LOCKED, sqlite3.SQLITE_FULL})
+
+_STOP = object()
+
+
+class RatingWriter:
+    """Queues ratings and writes them to the database in batches from a background thread.
+
+    Attributes:
+        batch_size: Most ratings written per transaction.
+        flush_interval: Longest a rating waits in the queue, in seconds.
+        retry_timeout: Longest the background thread retries a batch while the database stays locked, in
+            seconds, before setting it aside to try again with the next one.
+        close_timeout: Longest close() keeps retrying the ratings the database can't take yet, in seconds,
+            before dropping them.
+        flushed: Number of ratings written so far.
+        dropped: Number of ratings the database rejected: their version was deleted meanwhile, or an error
+            retrying won't fix (a missing table, a read-only or corrupt database). Ratings hitting a lock held
+            past retry_timeout or a full disk are kept and written later, unless they're still unwritten when
+            close_timeout runs out.
+    """
+
+    def __init__(self, db, batch_size=500, flush_interval=0.5, retry_timeout=30, close_timeout=60):
+        self.db = db
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.retry_timeout = retry_timeout
+        self.close_timeout = close_timeout
+        self.flushed = 0
+        self.dropped = 0
+        self._queue = queue.Queue()
+        self._unwritten = []  # Ratings a failed write left over, older than anything in the queue
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def submit(self, version_id, user_id, rating):
+        """Queues a rating. It reaches the database within flush_interval seconds.
+
+        Args:
+            version_id: The ID of the version being rated.
+            user_id: The ID of the user rating it.
+            rating: The rating, 1 to 5.
+        """
+        self._ensure_started()
+        self._queue.put((version_id, user_id, rating))
+
+    def pending(self):
+        """Returns the number of ratings waiting to be written."""
+        return self._queue.qsize() + len(self._unwritten)
+
+    def close(self):
+        """Writes every queued rating and stops the background thread.
+
+        Ratings the database can't take yet (locked, out of space) are retried for up to close_timeout
+        seconds, so every rating submit() accepted is stored unless the database rejects it outright or stays
+        unavailable that long; what's left then is dropped and logged.
+        """
+        with self._lock:
+            thread = self._thread if self._pid == os.getpid() else None
+            self._thread = None
+        if thread is not None:
+            self._queue.put(_STOP)
+            thread.join()
+        # What the thread left over, and anything queued after it stopped (or in a process where it never ran)
+        rows, self._unwritten = self._unwritten + self._take_all(), []
+        deadline = time.monotonic() + self.close_timeout
+        delay = 0.05
+        while rows:
+            rows = self._flush(rows, deadline)
+            if rows and time.monotonic() + delay > deadline:
+                self.dropped += len(rows)
+                log.error("%d ratings dropped: still not written after %s seconds", len(rows), self.close_timeout)
+                return
+            if rows:
+                time.sleep(delay)
+                delay = min(delay * 2, 2)
+
+    def _ensure_started(self):
+        # Started on first use rather than at import, so each forked server worker gets its own thread
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is None or self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._thread = threading.Thread(target=self._run, name="rating-writer", daemon=True)
+                self._thread.start()
+
+    def _take_all(self):
+        items = []
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                return items
+            if item is not _STOP:
+                items.append(item)
+
+    def _run(self):
+        delay = self.flush_interval
+        while True:
+            batch = []
+            stopping = False
+            # Ratings left over by a failed write are tried again once the interval is up, even if no new ones come
+            deadline = time.monotonic() + delay if self._unwritten else None
+            # Wait for the first rating, then keep collecting until the batch is full or the interval is up
+            while len(batch) < self.batch_size:
+                timeout = None if deadline is None else max(0, deadline - time.monotonic())
+                try:
+                    item = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+                if deadline is None:
+                    deadline = time.monotonic() + self.flush_interval
+
+            if stopping:
+                batch.extend(self._take_all())
+            if self._unwritten or batch:
+                failed = bool(self._unwritten)
+                self._unwritten = self._flush(self._unwritten + batch, deadline=time.monotonic() + self.retry_timeout)
+                # Back off while the same ratings keep failing
+                delay = min(delay * 2, 30) if failed and self._unwritten else self.flush_interval
+            if stopping:
+                return  # close() writes what's left
+
+    def _flush(self, batch, deadline):
+        # Returns the ratings that couldn't be written yet
+        # A user clicking several times in a row only needs their last rating written
+        latest = {}
+        for version_id, user_id, rating in batch:
+            latest[(version_id, user_id)] = rating
+        rows = [(version_id, user_id, rating) for (version_id, user_id), rating in latest.items()]
+
+        unwritten = []
+        for start in range(0, len(rows), self.batch_size):
+            unwritten.extend(self._write(rows[start:start + self.batch_size], deadline))
+        return unwritten
+
+    def _write(self, rows, deadline):
+        try:
+            self._upsert(rows, deadline)
+            self.flushed += len(rows)
+            return []
+        except sqlite3.IntegrityError:
+            pass
+        except sqlite3.OperationalError as e:
+            if (e.sqlite_errorcode & 0xFF) in RETRYABLE_ERRORS:
+                # Lock held too long, disk full: the database may take them later
+                log.warning("%d ratings not written (%s), will retry", len(rows), e)
+                return rows
+            # Missing table, read-only database, ...: writing them one by one or later won't help
+            self.dropped += len(rows)
+            log.error("%d ratings dropped: %s", len(rows), e)
+            return []
+        except sqlite3.Error as e:
+            # Corrupt database and the like: writing them one by one or later won't help
+            self.dropped += len(rows)
+            log.error("%d ratings dropped: %s", len(rows), e)
+            return []
+
+        # Some rating in the batch can't be stored; write the others one by one
+        unwritten = []
+        for row in rows:
+            try:
+                self._upsert([row], deadline)
+                self.flushed += 1
+            except sqlite3.OperationalError as e:
+                if (e.sqlite_errorcode & 0xFF) not in RETRYABLE_ERRORS:
+                    self.dropped += 1
+                    log.error("Rating %r dropped: %s", row, e)
+                    continue
+                log.warning("Rating %r not written (%s), will retry", row, e)
+                unwritten.append(row)
+            except sqlite3.Error as e:
+                self.dropped += 1
+                log.error("Rating %r rejected: %s", row, e)
+        return unwritten
+
+    def _upsert(self, rows, deadline):
+        # deadline: time.monotonic() past which a lock isn't waited out any more
+        delay = 0.05
+        while True:
+            try:
+                with self.db.transaction() as connection:
+                    connection.executemany(UPSERT_RATING, rows)
+                return
+            except sqlite3.OperationalError as e:
+                # Only a lock is worth waiting out here; other errors are left to the caller
+                if e.sqlite_errorcode not in (sqlite3.SQLITE_BUSY, sqlite3.SQLITE_LOCKED) or time.monotonic() + delay > deadline:
+                    raise
+                log.warning("%d ratings not written (%s), retrying", len(rows), e)
+                time.sleep(delay)
+                delay = min(delay * 2, 2)